@@ -1,74 +1,469 @@
-from flask import Flask, request, jsonify
+from flask import Blueprint, Flask, current_app, request, jsonify, g
 from flask_cors import CORS
 import json
+import logging
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import pickle
-import numpy as np
+import sqlite3
 import re
 import threading
 import time
 import requests
 import base64
+import queue
+import atexit
+import heapq
+import bisect
+import math
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import hashlib
+import socket
+import uuid
+from status_normalizer import normalize_status
+from eta_model import (
+    MODEL_FILES, EVENT_TIMEZONE, compile_eta_table, validate_feature_table, predict_eta, build_arrival_graphs,
+    to_event_time, model_files_version, load_model_manifest
+)
 
 import firebase_admin
 from firebase_admin import credentials, messaging, firestore
+from firebase_admin import exceptions as firebase_exceptions
+from google.api_core.exceptions import NotFound
 from dotenv import load_dotenv
 load_dotenv()
+# 📊 PROMETHEUS_MULTIPROC_DIR(.env 포함)을 읽은 뒤 지표 생성
+from metrics import (
+    HTTP_REQUEST_SECONDS, MODEL_LOAD_SECONDS, MODEL_PREDICT_SECONDS, MODEL_PREDICTIONS, TRACKER_REQUEST_SECONDS,
+    FIRESTORE_DOCUMENTS, FCM_SEND_SECONDS, FCM_MESSAGES, SWEEP_SECONDS, SWEEP_SUBSCRIPTIONS, SUBSCRIPTIONS,
+    POLLER_ACTIVE, POLLER_OWNED, POLLER_DUE, POLLER_LAG_SECONDS, POLLER_SHARD_SHARE, FirestoreCall, render_metrics
+)
+from log_config import configure_logging, lazy
+
+# 📝 JSON 로그 (레벨은 LOG_LEVEL / LOG_LEVELS="app.tracker=DEBUG,..."로 조정)
+configure_logging()
+log = logging.getLogger(__name__)
+api_log = logging.getLogger(f"{__name__}.api")
+model_log = logging.getLogger(f"{__name__}.models")
+subscription_log = logging.getLogger(f"{__name__}.subscriptions")
+tracker_log = logging.getLogger(f"{__name__}.tracker")
+fcm_log = logging.getLogger(f"{__name__}.fcm")
+poller_log = logging.getLogger(f"{__name__}.poller")
+delivery_log = logging.getLogger(f"{__name__}.deliveries")
 
 TRACKER_CLIENT_ID = os.environ.get("TRACKER_CLIENT_ID")
 TRACKER_CLIENT_SECRET = os.environ.get("TRACKER_CLIENT_SECRET")
-
-import json
+TRACKER_AUTH_URL = os.environ.get("TRACKER_AUTH_URL", "https://auth.tracker.delivery/oauth2/token")
+TRACKER_GRAPHQL_URL = os.environ.get("TRACKER_GRAPHQL_URL", "https://apis.tracker.delivery/graphql")
+
+# 🔁 배송 상태 폴링 설정
+# 기본 조회 간격(분), 구독 목록을 Firestore에서 다시 읽는 주기로도 사용
+TRACKER_POLL_INTERVAL_MINUTES = float(os.environ.get("TRACKER_POLL_INTERVAL_MINUTES", "5"))
+# 조회 시각이 된 구독을 꺼내는 스케줄러 실행 주기(초)
+TRACKER_SCHEDULER_TICK_SECONDS = float(os.environ.get("TRACKER_SCHEDULER_TICK_SECONDS", "60"))
+TRACKER_POLL_CONCURRENCY = int(os.environ.get("TRACKER_POLL_CONCURRENCY", "16"))
+TRACKER_REQUEST_TIMEOUT = float(os.environ.get("TRACKER_REQUEST_TIMEOUT", "10"))
+# 한 GraphQL 요청에 묶어 조회할 송장 수 (1이면 송장마다 개별 요청)
+TRACKER_QUERY_BATCH_SIZE = max(1, int(os.environ.get("TRACKER_QUERY_BATCH_SIZE", "1")))
+# 한 번의 체크가 다음 실행 시각을 넘지 않도록 하는 제한 시간(초)
+TRACKER_SWEEP_DEADLINE = float(os.environ.get("TRACKER_SWEEP_DEADLINE", str(max(TRACKER_SCHEDULER_TICK_SECONDS - 10, 1))))
 
 FIREBASE_CREDENTIALS = os.environ.get("FIREBASE_CREDENTIALS")  # 원문 JSON
-firebase_creds = json.loads(FIREBASE_CREDENTIALS)               # 원문 -> dict
-cred = credentials.Certificate(firebase_creds)                  # dict로 생성
-firebase_admin.initialize_app(cred)
 
-db = firestore.client()
+_firebase_lock = threading.Lock()
+_firebase_initialized = False
+
+def init_firebase():
+    """Firebase 앱 초기화 (처음 필요할 때 한 번)"""
+    global _firebase_initialized
+    with _firebase_lock:
+        if not _firebase_initialized:
+            firebase_creds = json.loads(FIREBASE_CREDENTIALS)  # 원문 -> dict
+            firebase_admin.initialize_app(credentials.Certificate(firebase_creds))
+            _firebase_initialized = True
+
+
+class LazyFirestoreClient:
+    """처음 사용할 때 Firestore 클라이언트를 만드는 프록시
+
+    gRPC 채널은 fork 후에 쓸 수 없으므로 프로세스마다 따로 만든다.
+    fork 전에 만들어진 클라이언트가 있으면 자식에서는 버리고 다시 만든다.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    init_firebase()
+                    self._client = firestore.client()
+                client = self._client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.client(), name)
+
+
+db = LazyFirestoreClient()
 
 SUBSCRIPTIONS_FILE = os.path.join('subscriptdata', 'subscriptions.json')
 
-def load_subscriptions_from_file():
-    global alert_subscriptions
-    alert_subscriptions = []
-    try:
-        subscriptions_ref = db.collection("subscriptions")
-        for doc in subscriptions_ref.stream():
-            data = doc.to_dict()
-            alert_subscriptions.append(data)
-        print(f"📂 Firestore 구독 정보 로드 완료: {len(alert_subscriptions)}개")
-    except Exception as e:
-        alert_subscriptions = []
-        print(f"❗ Firestore 구독 로드 실패: {e}")
+class Subscription:
+    """구독 한 건 (Firestore subscriptions 문서와 1:1)"""
+
+    __slots__ = ('invoice', 'user_id', 'token', 'carrier_id', 'status', 'current_status',
+                 'subscribed_at', 'alert_enabled', 'last_event_time', 'extra')
+    FIELDS = ('invoice', 'user_id', 'token', 'carrier_id', 'status', 'current_status',
+              'subscribed_at', 'alert_enabled', 'last_event_time')
+
+    def __init__(self, invoice, user_id, token=None, carrier_id=None, status='', current_status='',
+                 subscribed_at=None, alert_enabled=True, last_event_time=None, extra=None):
+        self.invoice = invoice
+        self.user_id = user_id
+        self.token = token
+        self.carrier_id = carrier_id
+        self.status = status
+        self.current_status = current_status
+        self.subscribed_at = subscribed_at
+        self.alert_enabled = alert_enabled
+        self.last_event_time = last_event_time  # 마지막 배송 이벤트 시각 (조회 API 원본 문자열)
+        self.extra = extra  # 알 수 없는 필드는 그대로 보존
+
+    @classmethod
+    def from_dict(cls, data):
+        extra = {k: v for k, v in data.items() if k not in cls.FIELDS}
+        return cls(
+            invoice=data.get('invoice'),
+            user_id=data.get('user_id'),
+            token=data.get('token'),
+            carrier_id=data.get('carrier_id'),
+            status=data.get('status', ''),
+            current_status=data.get('current_status', ''),
+            subscribed_at=data.get('subscribed_at'),
+            alert_enabled=data.get('alert_enabled', True),
+            last_event_time=data.get('last_event_time'),
+            extra=extra or None,
+        )
+
+    def to_dict(self):
+        data = dict(self.extra) if self.extra else {}
+        for field in self.FIELDS:
+            data[field] = getattr(self, field)
+        return data
+
+    @property
+    def key(self):
+        return (self.user_id, self.invoice)
+
+    @property
+    def doc_id(self):
+        return f"{self.user_id}_{self.invoice}"
+
+
+class SubscriptionStore:
+    """(user_id, invoice) 키 구독 저장소, user_id/carrier_id/정규화 상태/FCM 토큰 보조 인덱스 포함
+
+    Flask 요청 스레드와 스케줄러 스레드가 함께 쓰므로 모든 변경은 락 안에서 처리
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_key = {}
+        self._key_by_doc_id = {}
+        self._by_user = {}
+        self._by_carrier = {}
+        self._by_status = {}
+        self._by_token = {}
+        self.version = 0  # 구독 추가/삭제 시 증가
+
+    def _index(self, sub):
+        self._by_user.setdefault(sub.user_id, set()).add(sub.key)
+        self._by_carrier.setdefault(sub.carrier_id, set()).add(sub.key)
+        self._by_status.setdefault(sub.current_status, set()).add(sub.key)
+        if sub.token:
+            self._by_token.setdefault(sub.token, set()).add(sub.key)
+
+    def _unindex(self, sub):
+        for index, value in ((self._by_user, sub.user_id), (self._by_carrier, sub.carrier_id),
+                             (self._by_status, sub.current_status), (self._by_token, sub.token)):
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(sub.key)
+                if not keys:
+                    del index[value]
+
+    def _put(self, sub):
+        old = self._by_key.get(sub.key)
+        if old is not None:
+            self._unindex(old)
+        else:
+            self.version += 1
+        self._by_key[sub.key] = sub
+        self._key_by_doc_id[sub.doc_id] = sub.key
+        self._index(sub)
+
+    def _pop(self, key):
+        sub = self._by_key.pop(key, None)
+        if sub is not None:
+            self._unindex(sub)
+            self._key_by_doc_id.pop(sub.doc_id, None)
+            self.version += 1
+        return sub
+
+    def get(self, user_id, invoice):
+        return self._by_key.get((user_id, invoice))
+
+    def get_by_doc_id(self, doc_id):
+        with self._lock:
+            key = self._key_by_doc_id.get(doc_id)
+            return self._by_key.get(key) if key else None
+
+    def add(self, sub):
+        """없을 때만 추가, 이미 있으면 False"""
+        with self._lock:
+            if sub.key in self._by_key:
+                return False
+            self._put(sub)
+            return True
+
+    def upsert(self, sub):
+        with self._lock:
+            self._put(sub)
+
+    def update(self, user_id, invoice, **fields):
+        """필드 변경 후 인덱스 갱신, 구독이 없으면 None"""
+        with self._lock:
+            sub = self._by_key.get((user_id, invoice))
+            if sub is None:
+                return None
+            self._unindex(sub)
+            for name, value in fields.items():
+                setattr(sub, name, value)
+            self._index(sub)
+            return sub
+
+    def remove(self, user_id, invoice):
+        with self._lock:
+            return self._pop((user_id, invoice))
+
+    def remove_by_doc_id(self, doc_id):
+        with self._lock:
+            key = self._key_by_doc_id.get(doc_id)
+            return self._pop(key) if key else None
+
+    def replace_all(self, subs):
+        with self._lock:
+            self._by_key = {}
+            self._key_by_doc_id = {}
+            self._by_user = {}
+            self._by_carrier = {}
+            self._by_status = {}
+            self._by_token = {}
+            for sub in subs:
+                self._put(sub)
+            self.version += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._by_key.values())
+
+    def by_user(self, user_id):
+        with self._lock:
+            return [self._by_key[key] for key in self._by_user.get(user_id, ())]
+
+    def by_carrier(self, carrier_id):
+        with self._lock:
+            return [self._by_key[key] for key in self._by_carrier.get(carrier_id, ())]
+
+    def by_status(self, status):
+        with self._lock:
+            return [self._by_key[key] for key in self._by_status.get(status, ())]
+
+    def by_token(self, token):
+        with self._lock:
+            return [self._by_key[key] for key in self._by_token.get(token, ())]
+
+    def __len__(self):
+        return len(self._by_key)
+
+
+subscription_store = SubscriptionStore()
+
+# Firestore WriteBatch 한 번에 담을 수 있는 최대 쓰기 수
+FIRESTORE_BATCH_SIZE = 500
+
+class SubscriptionWriteBuffer:
+    """변경된 구독 필드만 모아 두었다가 WriteBatch로 한 번에 저장
+
+    같은 문서에 대한 여러 변경은 마지막 값으로 합쳐져 한 번만 쓰인다.
+    stats['saved']는 이렇게 합쳐지거나(대기 중인 문서에 다시 변경) 구독 삭제로 버려져
+    실제로 쓰지 않은 변경 수.
+    """
+
+    def __init__(self, collection_name, batch_size=FIRESTORE_BATCH_SIZE):
+        self._collection_name = collection_name
+        self._batch_size = batch_size
+        self._pending = {}  # 문서 ID → 변경 필드
+        self._lock = threading.Lock()
+        self.stats = {'requested': 0, 'written': 0, 'saved': 0, 'failed': 0}
+
+    def mark(self, doc_id, fields):
+        with self._lock:
+            if doc_id in self._pending:
+                self.stats['saved'] += 1  # 대기 중인 쓰기에 합쳐짐
+                self._pending[doc_id].update(fields)
+            else:
+                self._pending[doc_id] = dict(fields)
+            self.stats['requested'] += 1
+
+    def discard(self, doc_id):
+        """삭제된 구독의 대기 중인 변경 제거"""
+        with self._lock:
+            if self._pending.pop(doc_id, None) is not None:
+                self.stats['saved'] += 1
+
+    def _requeue(self, doc_id, fields):
+        with self._lock:
+            merged = dict(fields)
+            if doc_id in self._pending:
+                self.stats['saved'] += 1  # 실패한 쓰기를 그 사이 들어온 변경과 합쳐 한 번에 다시 씀
+                merged.update(self._pending[doc_id])  # 그 사이 들어온 최신 값 우선
+            self._pending[doc_id] = merged
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        collection = db.collection(self._collection_name)
+        items = list(pending.items())
+        written = failed = 0
+        for i in range(0, len(items), self._batch_size):
+            chunk = items[i:i + self._batch_size]
+            try:
+                batch = db.batch()
+                for doc_id, fields in chunk:
+                    batch.update(collection.document(doc_id), fields)
+                with FirestoreCall('subscription_batch', 'write', len(chunk)):
+                    batch.commit()
+                written += len(chunk)
+            except Exception as e:
+                # 삭제된 문서가 섞여 있으면 배치 전체가 실패하므로 한 건씩 다시 저장
+                subscription_log.warning(f"❗ Firestore 배치 저장 실패, 개별 저장으로 재시도: {e}")
+                for doc_id, fields in chunk:
+                    try:
+                        with FirestoreCall('subscription_update', 'write'):
+                            collection.document(doc_id).update(fields)
+                        written += 1
+                    except NotFound:
+                        subscription_log.debug("ℹ️ 삭제된 구독 문서 저장 생략: %s", doc_id)
+                    except Exception as e:
+                        failed += 1
+                        self._requeue(doc_id, fields)
+                        subscription_log.error(f"❗ Firestore 구독 저장 실패 [{doc_id}]: {e}")
+
+        with self._lock:
+            self.stats['written'] += written
+            self.stats['failed'] += failed
+        return written
+
+
+subscription_writes = SubscriptionWriteBuffer("subscriptions")
 
 def save_subscriptions_to_file():
+    """변경된 구독만 Firestore에 저장"""
     try:
-        # 전체 alert_subscriptions를 Firestore로 저장
-        for sub in alert_subscriptions:
-            doc_ref = db.collection("subscriptions").document(f"{sub['user_id']}_{sub['invoice']}")
-            doc_ref.set(sub)  # Firestore 저장
-        print(f"☁️ Firestore 구독 정보 저장 완료: {len(alert_subscriptions)}개")
+        written = subscription_writes.flush()
+        if written:
+            subscription_log.info(f"☁️ Firestore 구독 정보 저장 완료: 변경 {written}개 (전체 {len(subscription_store)}개)")
     except Exception as e:
-        print(f"❗ Firestore 저장 실패: {e}")
+        subscription_log.error(f"❗ Firestore 저장 실패: {e}")
 
 def load_subscriptions_from_firestore():
-    global alert_subscriptions
     try:
-        alert_subscriptions = []
-        subscriptions_ref = db.collection("subscriptions").stream()
-        for doc in subscriptions_ref:
-            data = doc.to_dict()
-            alert_subscriptions.append(data)
+        with FirestoreCall('load_subscriptions', 'read') as call:
+            subs = [Subscription.from_dict(doc.to_dict()) for doc in db.collection("subscriptions").stream()]
+            call.documents = len(subs)
+        subscription_store.replace_all(subs)
+        subscription_log.info(f"☁️ Firestore로부터 구독 로드 완료: {len(subscription_store)}개의 구독")
+    except Exception as e:
+        subscription_log.error(f"❗ Firestore 구독 로드 실패: {e}")
 
-        print(f"☁️ Firestore로부터 구독 로드 완료: {len(alert_subscriptions)}개의 구독")
+# 🔄 구독 동기화 방식: listener(on_snapshot 변경분 반영) 또는 poll(주기적 전체 로드)
+SUBSCRIPTION_SYNC_MODE = os.environ.get("SUBSCRIPTION_SYNC_MODE", "listener")
+
+# 시작 직후 초기 구독 로드를 기다리는 최대 시간(초)
+SUBSCRIPTION_READY_TIMEOUT = float(os.environ.get("SUBSCRIPTION_READY_TIMEOUT", "30"))
+
+_subscription_watch = None
+subscriptions_synced = threading.Event()
+subscriptions_loaded = threading.Event()  # 초기 로드 시도가 끝났는지 (실패 포함)
+
+def wait_for_subscriptions():
+    """초기 구독 로드 전에 들어온 구독 변경 요청은 로드가 끝날 때까지 대기"""
+    return subscriptions_loaded.wait(timeout=SUBSCRIPTION_READY_TIMEOUT)
+
+def apply_subscription_changes(changes):
+    """on_snapshot 변경분(추가/수정/삭제)을 메모리 구독 저장소에 반영"""
+    counts = {'ADDED': 0, 'MODIFIED': 0, 'REMOVED': 0}
+    for change in changes:
+        if change.type.name == 'REMOVED':
+            subscription_store.remove_by_doc_id(change.document.id)
+        else:
+            subscription_store.upsert(Subscription.from_dict(change.document.to_dict()))
+        counts[change.type.name] += 1
+    return counts
+
+def on_subscriptions_snapshot(col_snapshot, changes, read_time):
+    try:
+        FIRESTORE_DOCUMENTS.labels('subscription_listener', 'read').inc(len(changes))
+        counts = apply_subscription_changes(changes)
+        if not subscriptions_synced.is_set():
+            subscriptions_synced.set()
+            subscription_log.info(f"☁️ Firestore 구독 리스너 초기 동기화 완료: {len(subscription_store)}개의 구독")
+        else:
+            subscription_log.debug("🔄 구독 변경 반영 - 추가 %d, 수정 %d, 삭제 %d", counts['ADDED'], counts['MODIFIED'], counts['REMOVED'])
+    except Exception as e:
+        subscription_log.error(f"❗ 구독 변경 반영 실패: {e}")
+
+def start_subscription_listener():
+    global _subscription_watch
+    try:
+        _subscription_watch = db.collection("subscriptions").on_snapshot(on_subscriptions_snapshot)
+        subscription_log.info("👂 Firestore 구독 리스너 시작")
     except Exception as e:
-        print(f"❗ Firestore 구독 로드 실패: {e}")
+        _subscription_watch = None
+        subscription_log.error(f"❗ Firestore 구독 리스너 시작 실패: {e}")
+
+def subscription_listener_active():
+    return _subscription_watch is not None and _subscription_watch.is_active
+
+
+def create_tracker_session(pool_size):
+    """tracker.delivery 호출용 커넥션 풀 세션"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
-# 🔐 Step 1. access_token 발급 함수
-def get_access_token(client_id, client_secret):
-    url = "https://auth.tracker.delivery/oauth2/token"
+tracker_session = create_tracker_session(TRACKER_POLL_CONCURRENCY)
+
+# 🔐 Step 1. access_token 발급 함수 (access_token, expires_in 반환)
+def request_access_token(client_id, client_secret):
+    url = TRACKER_AUTH_URL
     credentials = f"{client_id}:{client_secret}"
     encoded_credentials = base64.b64encode(credentials.encode()).decode()  # base64 인코딩
     headers = {
@@ -76,91 +471,441 @@ def get_access_token(client_id, client_secret):
         "Content-Type": "application/x-www-form-urlencoded",
     }
     data = "grant_type=client_credentials"
-    response = requests.post(url, headers=headers, data=data)
+    response = tracker_session.post(url, headers=headers, data=data, timeout=TRACKER_REQUEST_TIMEOUT)
     response.raise_for_status()
-    return response.json()["access_token"]
+    result = response.json()
+    return result["access_token"], float(result.get("expires_in", 300))
+
+
+class TrackerTokenManager:
+    """access_token을 만료 전까지 재사용하고, 동시 갱신 요청은 하나로 합침"""
+
+    def __init__(self, client_id, client_secret, refresh_margin=60.0):
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._refresh_margin = refresh_margin
+        self._cached = (None, 0.0)  # (access_token, 만료 시각 monotonic)
+        self._lock = threading.Lock()
+
+    def _valid(self):
+        token, expires_at = self._cached
+        if token and time.monotonic() < expires_at - self._refresh_margin:
+            return token
+        return None
+
+    def get(self):
+        token = self._valid()
+        if token:
+            return token
+        with self._lock:
+            token = self._valid()
+            if token:
+                return token
+            token, expires_in = request_access_token(self._client_id, self._client_secret)
+            self._cached = (token, time.monotonic() + expires_in)
+            tracker_log.info(f"✅ Access Token 생성 성공 ({expires_in:.0f}초 유효)")
+            return token
+
+    def invalidate(self, token):
+        """401 응답을 받은 토큰을 폐기 (이미 갱신된 경우 무시)"""
+        with self._lock:
+            if self._cached[0] == token:
+                self._cached = (None, 0.0)
+
+
+TRACKER_TOKEN_REFRESH_MARGIN = float(os.environ.get("TRACKER_TOKEN_REFRESH_MARGIN", "60"))
+tracker_token_manager = TrackerTokenManager(TRACKER_CLIENT_ID, TRACKER_CLIENT_SECRET, TRACKER_TOKEN_REFRESH_MARGIN)
+
+def post_tracker_graphql(query, variables):
+    """GraphQL 요청, 401이면 토큰을 강제 갱신해 한 번 재시도"""
+    for attempt in range(2):
+        access_token = tracker_token_manager.get()
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {access_token}'
+        }
+        response = tracker_session.post(
+            TRACKER_GRAPHQL_URL,
+            headers=headers,
+            json={'query': query, 'variables': variables},
+            timeout=TRACKER_REQUEST_TIMEOUT
+        )
+        if response.status_code != 401 or attempt:
+            return response
+        tracker_log.info("🔑 GraphQL 401 응답 - Access Token 갱신 후 재시도")
+        tracker_token_manager.invalidate(access_token)
 
 def predict_arrival_internal(status, last_time_str, carrier_id=None):
     try:
         normalized_status = status.strip()
 
-        # 🚀 carrier_id 기반 모델/매핑 불러오기
-        model, status_map = load_model_and_mapping(carrier_id)
-        if not model or not status_map:
+        # 🚀 carrier_id 기반 예측 테이블 조회
+        entry = load_model_entry(carrier_id)
+        if not entry:
             return {"status": "error", "message": "모델 또는 매핑 로드 실패"}
 
-        code = status_map.get(normalized_status, -1)
-        predicted_minutes = model.predict(np.array([[code]]))[0]
-
-        last_time = datetime.fromisoformat(last_time_str)
-        arrival_time = last_time + timedelta(minutes=predicted_minutes)
-
-        base_date = arrival_time.date()
-        # 🔔 일요일이면 하루 추가
-        if base_date.weekday() == 6:
-            base_date += timedelta(days=1)
+        last_time = to_event_time(datetime.fromisoformat(last_time_str))
+        minutes, _ = timed_predict_eta(entry, [normalized_status], [last_time], time.time())
+        predicted_minutes = float(minutes[0])
 
         return {
             "status": "success",
             "predicted_minutes": round(predicted_minutes, 1),
+            # 도착 예상 시각 (한국 시간)
+            "arrival_time": last_time + timedelta(minutes=predicted_minutes),
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-app = Flask(__name__)
-CORS(app, origins=["https://alimbox.com"])
-
-alert_subscriptions = []
-
-# 🔧 상태 정규화 함수
-def normalize_status(status):
-    status = status.lower().strip()
-    mapping_keywords = {
-        '배송완료': ['배송완료', '배달완료', 'delivered'],
-        '배송출발': ['배송출발', '배달출발', 'out for delivery'],
-        '간선상차': ['간선상차', '캠프상차', '터미널상차', '상차'],
-        '간선하차': ['간선하차', '캠프도착', '터미널하차', '하차'],
-        '집화처리': ['접수', '인수', '소터분류', '운송장출력', '수거', '집하', '수집'],
-        'sm 입고': ['입고', '센터입고'],
-    }
-    for norm_status, keywords in mapping_keywords.items():
-        if any(kw in status for kw in keywords):
-            return norm_status
-    return status
+# 🌐 API 라우트, 앱은 create_app()에서 생성
+api = Blueprint('api', __name__)
+
+# 📦 운송사별 모델/매핑 파일 위치 (파일 목록은 eta_model.MODEL_FILES)
+MODEL_DIR = os.environ.get("MODEL_DIR", "")
+# 파일 변경 여부(mtime)를 확인하는 최소 간격(초)
+MODEL_RELOAD_CHECK_SECONDS = float(os.environ.get("MODEL_RELOAD_CHECK_SECONDS", "30"))
+
+
+class ModelRegistry:
+    """운송사별 모델/매핑을 한 번만 로드해 두고, 파일이 바뀐 경우에만 다시 로드"""
+
+    def __init__(self, model_files, model_dir='', check_interval=30.0):
+        self._model_files = model_files
+        self._model_dir = model_dir
+        self._check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def key_for(self, carrier_id):
+        return carrier_id if carrier_id in self._model_files else 'default'
+
+    def _paths(self, key):
+        return tuple(os.path.join(self._model_dir, filename) for filename in self._model_files[key])
+
+    def get(self, carrier_id):
+        key = self.key_for(carrier_id)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry['checked_at'] < self._check_interval:
+            return entry
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry['checked_at'] >= self._check_interval:
+                entry = self._refresh(key, entry)
+        return entry
+
+    def _refresh(self, key, entry):
+        model_path, mapping_path, features_path = self._paths(key)
+        try:
+            # 특성 테이블은 선택 사항, 없으면 mtime None
+            features_mtime = os.path.getmtime(features_path) if os.path.exists(features_path) else None
+            mtimes = (os.path.getmtime(model_path), os.path.getmtime(mapping_path), features_mtime)
+            if entry is not None and entry['mtimes'] == mtimes:
+                entry['checked_at'] = time.monotonic()
+                return entry
+
+            with open(model_path, 'rb') as f:
+                model_bytes = f.read()
+            with open(mapping_path, 'rb') as f:
+                mapping_bytes = f.read()
+            features_bytes = b''
+            if features_mtime is not None:
+                with open(features_path, 'rb') as f:
+                    features_bytes = f.read()
+            version = model_files_version(model_bytes, mapping_bytes, features_bytes)
+
+            # 🧾 설치 기록과 다르면 파일을 바꾸는 중이므로 이전 모델 유지 (mtimes를 갱신하지 않아 다음 확인에서 다시 읽음)
+            expected = load_model_manifest(self._model_dir).get(key, {}).get('version')
+            if expected is not None and expected != version:
+                raise ValueError(f"설치 기록 버전({expected})과 파일 내용 버전({version})이 다름, 설치 중이거나 불완전한 설치")
+
+            # mtime만 바뀌고 내용이 같으면 다시 언피클하지 않음
+            if entry is not None and entry['version'] == version:
+                entry['mtimes'] = mtimes
+                entry['checked_at'] = time.monotonic()
+                return entry
+
+            load_started = time.perf_counter()
+            model = pickle.loads(model_bytes)
+            status_map = pickle.loads(mapping_bytes)
+            eta_table = compile_eta_table(model, status_map)
+            features = pickle.loads(features_bytes) if features_bytes else None
+            if features is not None:
+                validate_feature_table(features, eta_table)
+            new_entry = {
+                'carrier_id': key,
+                'model': model,
+                'status_map': status_map,
+                'eta_table': eta_table,
+                'features': features,
+                'version': version,
+                'mtimes': mtimes,
+                'loaded_at': datetime.now().isoformat(),
+                'checked_at': time.monotonic(),
+                'model_file': model_path,
+                'mapping_file': mapping_path,
+                'features_file': features_path if features is not None else None,
+            }
+        except Exception as e:
+            if entry is None:
+                raise
+            # 재로드 실패 시 기존 모델을 계속 사용
+            model_log.warning(f"❗ 모델 재로드 실패 [{key}], 기존 버전 유지 ({entry['version']}): {e}")
+            entry['checked_at'] = time.monotonic()
+            return entry
+
+        self._entries[key] = new_entry
+        MODEL_LOAD_SECONDS.labels(key).observe(time.perf_counter() - load_started)
+        model_log.info(f"📦 모델 로드 완료 [{key}] version={new_entry['version']}")
+        return new_entry
+
+    def preload(self):
+        for key in self._model_files:
+            try:
+                self.get(key)
+            except Exception as e:
+                model_log.error(f"❗ 모델 사전 로드 실패 [{key}]: {e}")
+
+    def status(self):
+        return [
+            {
+                'carrier_id': entry['carrier_id'],
+                'version': entry['version'],
+                'loaded_at': entry['loaded_at'],
+                'model_file': entry['model_file'],
+                'mapping_file': entry['mapping_file'],
+                'features_file': entry['features_file'],
+            }
+            for entry in list(self._entries.values())
+        ]
+
+
+MAX_PREDICT_BATCH_SIZE = int(os.environ.get("MAX_PREDICT_BATCH_SIZE", "500"))
+
 
-def load_model_and_mapping(carrier_id):
+model_registry = ModelRegistry(MODEL_FILES, MODEL_DIR, MODEL_RELOAD_CHECK_SECONDS)
+
+def load_model_entry(carrier_id):
     try:
-        if carrier_id == 'kr.coupangls':
-            with open('arrival_predictor_coupangls.pkl', 'rb') as f:
-                model = pickle.load(f)
-            with open('status_mapping_coupangls.pkl', 'rb') as f:
-                status_map = pickle.load(f)
-        elif carrier_id == 'kr.epost':
-            with open('arrival_predictor_epost.pkl', 'rb') as f:
-                model = pickle.load(f)
-            with open('status_mapping_epost.pkl', 'rb') as f:
-                status_map = pickle.load(f)
-        elif carrier_id == 'kr.hanjin':
-            with open('arrival_predictor_hanjin.pkl', 'rb') as f:
-                model = pickle.load(f)
-            with open('status_mapping_hanjin.pkl', 'rb') as f:
-                status_map = pickle.load(f)
-        else:
-            with open('arrival_predictor.pkl', 'rb') as f:
-                model = pickle.load(f)
-            with open('status_mapping.pkl', 'rb') as f:
-                status_map = pickle.load(f)
-        return model, status_map
+        return model_registry.get(carrier_id)
     except Exception as e:
-        print(f"❗ 모델/매핑 파일 로드 실패: {e}")
-        return None, None
+        model_log.error(f"❗ 모델/매핑 파일 로드 실패: {e}")
+        return None
+
+def timed_predict_eta(entry, statuses, last_times, now):
+    """predict_eta + 운송사별 예측 시간/건수 기록"""
+    with MODEL_PREDICT_SECONDS.labels(entry['carrier_id']).time():
+        result = predict_eta(entry, statuses, last_times, now)
+    MODEL_PREDICTIONS.labels(entry['carrier_id']).inc(len(statuses))
+    return result
+
+
+# 🗄️ 배송완료 데이터 저장소
+DELIVERY_DATA_DIR = os.environ.get("DELIVERY_DATA_DIR", os.path.join(os.getcwd(), 'data'))
+DELIVERY_SEGMENT_MAX_BYTES = int(os.environ.get("DELIVERY_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+class DeliveryStore:
+    """배송완료 데이터를 JSONL 세그먼트 로그에 추가하고, 송장번호는 SQLite 인덱스로 관리
+
+    - data/deliveries/segment_000001.jsonl … : 한 줄에 배송 한 건, 크기가 넘으면 다음 세그먼트로 교체
+    - data/delivery_index.sqlite3 : 송장번호 → (세그먼트, 오프셋), 여러 워커 프로세스가 함께 사용
+    - 예전 data/*.json 파일은 처음 열 때 한 번 로그로 옮기고 data/legacy_json/으로 이동
+    """
+
+    def __init__(self, data_dir, segment_max_bytes):
+        self.data_dir = data_dir
+        self.segment_dir = os.path.join(data_dir, 'deliveries')
+        self._index_path = os.path.join(data_dir, 'delivery_index.sqlite3')
+        self._segment_max_bytes = segment_max_bytes
+        self._local = threading.local()
+        self._opened = False
+        self._open_lock = threading.Lock()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._index_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def open(self):
+        with self._open_lock:
+            if self._opened:
+                return
+            os.makedirs(self.segment_dir, exist_ok=True)
+            conn = self._connect()
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS deliveries ('
+                'invoice TEXT PRIMARY KEY, carrier_id TEXT, segment TEXT NOT NULL, '
+                'offset INTEGER NOT NULL, saved_at TEXT NOT NULL)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._migrate_legacy_files(conn)
+            self._opened = True
+
+    def _current_segment(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE key = 'segment'").fetchone()
+        segment = row[0] if row else None
+        if segment is not None:
+            path = os.path.join(self.segment_dir, segment)
+            if not os.path.exists(path) or os.path.getsize(path) < self._segment_max_bytes:
+                return segment
+        number = int(segment[len('segment_'):-len('.jsonl')]) + 1 if segment else 1
+        segment = f'segment_{number:06d}.jsonl'
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('segment', ?)", (segment,))
+        return segment
+
+    def _append(self, conn, invoice, data, saved_at, appended):
+        """인덱스 행을 먼저 넣고 로그에 한 줄 추가, 쓴 (경로, 시작 오프셋)은 appended에 기록
+
+        트랜잭션이 롤백되면 _discard(appended)로 로그를 되돌려 인덱스 없는 줄이 남지 않게 한다.
+        """
+        if conn.execute('SELECT 1 FROM deliveries WHERE invoice = ?', (invoice,)).fetchone():
+            return None
+        segment = self._current_segment(conn)
+        path = os.path.join(self.segment_dir, segment)
+        line = (json.dumps(data, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        conn.execute(
+            'INSERT INTO deliveries (invoice, carrier_id, segment, offset, saved_at) VALUES (?, ?, ?, ?, ?)',
+            (invoice, data.get('carrier_id'), segment, offset, saved_at)
+        )
+        appended.append((path, offset))
+        with open(path, 'ab') as f:
+            f.write(line)
+        return path
+
+    @staticmethod
+    def _discard(appended):
+        """롤백된 트랜잭션에서 쓴 줄 제거 (파일마다 처음 쓴 오프셋으로 되돌림)"""
+        starts = {}
+        for path, offset in appended:
+            starts.setdefault(path, offset)
+        for path, offset in starts.items():
+            try:
+                os.truncate(path, offset)
+            except OSError as e:
+                delivery_log.error(f"❗ 배송 로그 되돌리기 실패 [{path}]: {e}")
+
+    def _repair_tail(self, conn):
+        """현재 세그먼트에서 마지막 인덱스 줄 뒤에 남은 내용(기록 중 종료된 프로세스의 줄) 제거"""
+        row = conn.execute("SELECT value FROM meta WHERE key = 'segment'").fetchone()
+        if row is None:
+            return
+        path = os.path.join(self.segment_dir, row[0])
+        if not os.path.exists(path):
+            return
+        last = conn.execute('SELECT MAX(offset) FROM deliveries WHERE segment = ?', (row[0],)).fetchone()[0]
+        end = 0
+        if last is not None:
+            with open(path, 'rb') as f:
+                f.seek(last)
+                end = last + len(f.readline())
+        size = os.path.getsize(path)
+        if size > end:
+            os.truncate(path, end)
+            delivery_log.warning(f"🧹 인덱스에 없는 배송 로그 {size - end}바이트 제거 [{row[0]}]")
+
+    def save(self, invoice, data):
+        """새 송장이면 로그에 추가하고 세그먼트 경로 반환, 이미 저장된 송장이면 None"""
+        self.open()
+        conn = self._connect()
+        appended = []
+        # IMMEDIATE 트랜잭션으로 다른 워커 프로세스와의 중복 확인/추가를 직렬화
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            path = self._append(conn, invoice, data, datetime.now().isoformat(), appended)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            self._discard(appended)
+            raise
+        return path
+
+    def count(self):
+        self.open()
+        return self._connect().execute('SELECT COUNT(*) FROM deliveries').fetchone()[0]
+
+    def _migrate_legacy_files(self, conn):
+        legacy_dir = os.path.join(self.data_dir, 'legacy_json')
+        appended = []
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._repair_tail(conn)
+            filenames = []
+            migrated = 0
+            for filename in sorted(f for f in os.listdir(self.data_dir) if f.endswith('.json')):
+                path = os.path.join(self.data_dir, filename)
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        existing = json.load(f)
+                except (OSError, ValueError) as e:
+                    delivery_log.error(f"❗ 예전 배송 데이터 읽기 실패, 건너뜀 [{filename}]: {e}")
+                    continue
+                saved_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+                if self._append(conn, existing.get('invoice', 'unknown'), existing, saved_at, appended):
+                    migrated += 1
+                filenames.append(filename)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            self._discard(appended)
+            raise
+        if filenames:
+            os.makedirs(legacy_dir, exist_ok=True)
+            for filename in filenames:
+                os.replace(os.path.join(self.data_dir, filename), os.path.join(legacy_dir, filename))
+            delivery_log.info(f"🗄️ 예전 배송 데이터 {len(filenames)}개 파일 중 {migrated}건 로그로 이전 완료")
+
+
+delivery_store = DeliveryStore(DELIVERY_DATA_DIR, DELIVERY_SEGMENT_MAX_BYTES)
+
+
+@api.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@api.after_app_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        # 경로 변수는 라벨 수가 늘어나지 않도록 규칙(/track 등) 그대로 사용
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(endpoint, request.method, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
 
+@api.route('/metrics', methods=['GET'])
+def metrics():
+    update_poller_metrics()
+    body, content_type = render_metrics()
+    return current_app.response_class(body, content_type=content_type)
 
-@app.route('/test', methods=['GET'])
+@api.route('/test', methods=['GET'])
 def test_api():
     return jsonify({'message': 'API 동작 확인 완료!', 'status': 'success'})
 
-@app.route('/save_delivery', methods=['POST'])
+@api.route('/model_status', methods=['GET'])
+def model_status():
+    return jsonify({'status': 'success', 'models': model_registry.status()})
+
+@api.route('/poller_status', methods=['GET'])
+def poller_status():
+    return jsonify({
+        'status': 'success',
+        'subscriptions': len(subscription_store),
+        'scheduler': poll_scheduler.stats(),
+        'subscription_writes': dict(subscription_writes.stats),
+        'notifications': dict(notification_queue.stats, pending=notification_queue.pending()),
+        'tracking_cache': tracking_cache.stats(),
+        'poller': dict(poller_leader.status(), mode=POLLER_MODE, pid=os.getpid()),
+        'shards': poller_shards.status() if poller_shards is not None else None,
+    })
+
+@api.route('/save_delivery', methods=['POST'])
 def save_delivery():
     try:
         data = request.get_json()
@@ -169,109 +914,171 @@ def save_delivery():
 
         last_event = data.get('lastEvent', {})
         status_name = last_event.get('status', {}).get('name', '')
-        normalized_status = normalize_status(status_name)
         invoice = data.get('invoice', 'unknown')
         carrier_id = data.get('carrier_id', 'unknown')
+        normalized_status = normalize_status(status_name, carrier_id)
 
-        print(f"📦 원본 상태: {status_name}")
-        print(f"🔧 정규화 상태: {normalized_status}")
-        print(f"🔎 lastEvent 전체 내용:\n{json.dumps(last_event, ensure_ascii=False, indent=2)}")
+        api_log.debug("📦 배송 데이터 수신 - 원본 상태: %s, 정규화 상태: %s, lastEvent: %s", status_name, normalized_status,
+                      lazy(lambda: json.dumps(last_event, ensure_ascii=False)), extra={'invoice': invoice, 'carrier_id': carrier_id})
 
         if normalized_status != '배송완료':
             return jsonify({'status': 'ignored', 'message': '배송완료된 건만 저장합니다.'}), 200
 
-        folder_path = os.path.join(os.getcwd(), 'data')
-        os.makedirs(folder_path, exist_ok=True)
-
-        for filename in os.listdir(folder_path):
-            if filename.endswith('.json'):
-                with open(os.path.join(folder_path, filename), encoding='utf-8') as f:
-                    existing = json.load(f)
-                    if existing.get('invoice') == invoice:
-                        return jsonify({'status': 'duplicate', 'message': f'{invoice}는 이미 저장된 송장번호입니다.'}), 200
-
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        file_path = os.path.join(folder_path, f'delivery_{timestamp}.json')
-
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        # 송장 인덱스로 중복 확인 후 세그먼트 로그에 한 줄 추가
+        file_path = delivery_store.save(invoice, data)
+        if file_path is None:
+            return jsonify({'status': 'duplicate', 'message': f'{invoice}는 이미 저장된 송장번호입니다.'}), 200
 
         return jsonify({'status': 'success', 'message': '배송 데이터 저장 완료!', 'file': file_path})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/predict_arrival', methods=['POST'])
+@api.route('/predict_arrival', methods=['POST'])
 def predict_arrival():
     try:
         data = request.get_json()
         status = data.get('status')
         last_time_str = data.get('last_time')
         carrier_id = data.get('carrier_id')  # carrier_id 받기
-        print(f"🔔 [predict_arrival] 요청 carrier_id: {carrier_id}")
 
         if not status or not last_time_str:
             return jsonify({'status': 'fail', 'message': 'status 또는 last_time이 없습니다.'}), 400
 
         normalized_status = status.strip()
 
-        # 🚀 carrier_id 기준으로 pkl 불러오기
-        model, status_map = load_model_and_mapping(carrier_id)
+        # 🚀 carrier_id 기준 예측 테이블 조회
+        entry = load_model_entry(carrier_id)
 
-        if not model or not status_map:
+        if not entry:
             return jsonify({'status': 'fail', 'message': '모델 또는 매핑 로드 실패'}), 500
-        
-        print(f"📦 predict_arrival - 받은 status: {status}, normalized_status: {normalized_status}")
-        print(f"📦 predict_arrival - status_map keys: {list(status_map.keys())}")
+
+        status_map = entry['status_map']
+        api_log.debug("📦 predict_arrival - 받은 status: %s, normalized_status: %s, status_map keys: %s",
+                      status, normalized_status, lazy(lambda: list(status_map)), extra={'carrier_id': carrier_id})
 
         if normalized_status not in status_map:
-            print(f"⚠️ 알 수 없는 상태: {normalized_status}, 기본값 처리")
-            code = -1
-        else:
-            code = status_map[normalized_status]
+            api_log.debug("⚠️ 알 수 없는 상태: %s, 기본값 처리", normalized_status, extra={'carrier_id': carrier_id})
 
-        predicted_minutes = model.predict(np.array([[code]]))[0]
-        last_time = datetime.fromisoformat(last_time_str)
+        last_time = to_event_time(datetime.fromisoformat(last_time_str))
+        minutes, residuals = timed_predict_eta(entry, [normalized_status], [last_time], time.time())
+        predicted_minutes = float(minutes[0])
         arrival_time = last_time + timedelta(minutes=predicted_minutes)
-        base_date = arrival_time.date()
-        if base_date.weekday() == 6:
-            base_date += timedelta(days=1)
-
-        graph_dates = []
-        i = -1
-        while len(graph_dates) < 5:
-            d = base_date + timedelta(days=i)
-            graph_dates.append(d)
-            i += 1
-
-        weight_map = {
-            '집화처리': [0.05, 0.65, 0.20, 0.07, 0.03],
-            '간선상차': [0.10, 0.60, 0.15, 0.10, 0.05],
-            '간선하차': [0.15, 0.50, 0.20, 0.10, 0.05],
-            '배송출발': [0.20, 0.65, 0.10, 0.03, 0.02],
-            'sm 입고': [0.07, 0.65, 0.20, 0.05, 0.03]
-        }
-        default_weights = [0.1, 0.5, 0.2, 0.15, 0.05]
-        weights = weight_map.get(normalized_status, default_weights)
+        graph_dates, probabilities = build_arrival_graphs([arrival_time], [normalized_status], residuals)
 
-        probabilities = [
-            0.0 if d.weekday() == 6 else round(weights[i], 4)
-            for i, d in enumerate(graph_dates)
-        ]
-        
-        print(f"🔎 predict_arrival 응답 데이터: predicted_minutes={predicted_minutes}")
+        api_log.debug("🔎 predict_arrival 응답 데이터: predicted_minutes=%s", predicted_minutes)
 
         return jsonify({
             'status': 'success',
             'predicted_minutes': round(predicted_minutes, 1),
-            'dates': [d.isoformat() for d in graph_dates],
-            'probabilities': probabilities
+            'dates': graph_dates[0],
+            'probabilities': probabilities[0]
         })
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/subscribe_alert', methods=['POST'])
+@api.route('/predict_arrival_batch', methods=['POST'])
+def predict_arrival_batch():
+    try:
+        data = request.get_json()
+        items = data.get('items') if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            return jsonify({'status': 'fail', 'message': 'items 목록이 없습니다.'}), 400
+        if len(items) > MAX_PREDICT_BATCH_SIZE:
+            return jsonify({'status': 'fail', 'message': f'한 번에 최대 {MAX_PREDICT_BATCH_SIZE}건까지 요청할 수 있습니다.'}), 400
+
+        api_log.debug("🔔 [predict_arrival_batch] 요청 건수: %d", len(items))
+
+        results = [None] * len(items)
+        groups = {}  # 모델 키 → [(index, status, last_time)]
+        for i, item in enumerate(items):
+            if not isinstance(item, dict):
+                results[i] = {'status': 'fail', 'message': '잘못된 항목 형식입니다.'}
+                continue
+            status = item.get('status')
+            last_time_str = item.get('last_time')
+            carrier_id = item.get('carrier_id')
+            if not isinstance(status, str) or not status.strip() or not isinstance(last_time_str, str) or not last_time_str:
+                results[i] = {'status': 'fail', 'message': 'status 또는 last_time이 없거나 문자열이 아닙니다.'}
+                continue
+            if carrier_id is not None and not isinstance(carrier_id, str):
+                results[i] = {'status': 'fail', 'message': 'carrier_id는 문자열이어야 합니다.'}
+                continue
+            try:
+                last_time = to_event_time(datetime.fromisoformat(last_time_str))
+            except ValueError as e:
+                results[i] = {'status': 'fail', 'message': f'last_time 형식 오류: {e}'}
+                continue
+            key = model_registry.key_for(carrier_id)
+            groups.setdefault(key, []).append((i, status.strip(), last_time))
+
+        # 🚀 운송사별로 한 번에 예측, 묶음 계산이 실패하면 항목별로 다시 계산해 실패한 항목만 오류 처리
+        now = time.time()
+        arrivals = []
+        for key, group in groups.items():
+            entry = load_model_entry(key)
+            if not entry:
+                for i, _, _ in group:
+                    results[i] = {'status': 'fail', 'message': '모델 또는 매핑 로드 실패'}
+                continue
+            try:
+                predictions = [timed_predict_eta(
+                    entry, [status for _, status, _ in group], [last_time for _, _, last_time in group], now
+                )]
+                subgroups = [group]
+            except Exception:
+                predictions, subgroups = [], []
+                for i, status, last_time in group:
+                    try:
+                        predictions.append(timed_predict_eta(entry, [status], [last_time], now))
+                        subgroups.append([(i, status, last_time)])
+                    except Exception as e:
+                        results[i] = {'status': 'error', 'message': str(e)}
+            for subgroup, (minutes, residuals) in zip(subgroups, predictions):
+                for (i, status, last_time), predicted_minutes, residual in zip(subgroup, minutes, residuals):
+                    try:
+                        arrival_time = last_time + timedelta(minutes=float(predicted_minutes))
+                    except OverflowError as e:
+                        results[i] = {'status': 'error', 'message': str(e)}
+                        continue
+                    arrivals.append((i, status, predicted_minutes, arrival_time, residual))
+
+        # 📈 전체 항목의 5일 그래프를 한 번에 계산 (실패하면 항목별로)
+        if arrivals:
+            try:
+                graphs = [build_arrival_graphs(
+                    [arrival_time for _, _, _, arrival_time, _ in arrivals],
+                    [status for _, status, _, _, _ in arrivals],
+                    [residual for _, _, _, _, residual in arrivals]
+                )]
+                chunks = [arrivals]
+            except Exception:
+                graphs, chunks = [], []
+                for arrival in arrivals:
+                    i, status, _, arrival_time, residual = arrival
+                    try:
+                        graphs.append(build_arrival_graphs([arrival_time], [status], [residual]))
+                        chunks.append([arrival])
+                    except Exception as e:
+                        results[i] = {'status': 'error', 'message': str(e)}
+            for chunk, (graph_dates, probabilities) in zip(chunks, graphs):
+                for (i, _, predicted_minutes, _, _), dates, probs in zip(chunk, graph_dates, probabilities):
+                    results[i] = {
+                        'status': 'success',
+                        'predicted_minutes': round(float(predicted_minutes), 1),
+                        'dates': dates,
+                        'probabilities': probs
+                    }
+
+        return jsonify({'status': 'success', 'results': results})
+
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@api.route('/subscribe_alert', methods=['POST'])
 def subscribe_alert():
+    if not wait_for_subscriptions():
+        return jsonify({'status': 'error', 'message': '구독 정보를 불러오는 중입니다. 잠시 후 다시 시도해 주세요.'}), 503
     try:
         data = request.get_json()
         invoice = data.get('invoice')
@@ -280,50 +1087,48 @@ def subscribe_alert():
         carrier_id = data.get('carrier_id')
         status = data.get('status', '')
 
-        print(f"📥 받은 구독 요청 → invoice: {invoice}, status: {data.get('status')}, carrier_id: {carrier_id}, user_id: {user_id}")
+        api_log.debug("📥 받은 구독 요청 → invoice: %s, status: %s, carrier_id: %s, user_id: %s",
+                      invoice, status, carrier_id, user_id)
 
         if not invoice or not user_id or not token:
             return jsonify({'status': 'fail', 'message': '필수 항목 누락'}), 400
 
-        for sub in alert_subscriptions:
-            if sub['invoice'] == invoice and sub['user_id'] == user_id:
-                print(f"⚠️ 중복 등록 시도 감지 → invoice: {invoice}, user_id: {user_id}")
-                return jsonify({'status': 'duplicate', 'message': '이미 등록됨'}), 200
-
-        alert_subscriptions.append({
-            'invoice': invoice,
-            'user_id': user_id,
-            'token': token,
-            'carrier_id': carrier_id,
-            'status': status,
-            'current_status': status,
-            'subscribed_at': datetime.now().isoformat(),
-            'alert_enabled': True
-        })
-
-        doc_ref = db.collection("subscriptions").document(f"{user_id}_{invoice}")
-        doc_ref.set({
-              "invoice": invoice,
-              "user_id": user_id,
-              "token": token,
-              "carrier_id": carrier_id,
-              "status": status,
-              "current_status": status,
-              "subscribed_at": datetime.now().isoformat(),
-              "alert_enabled": True
-        })
-
-
-        print(f"✅ 등록 완료 → 현재 구독 수: {len(alert_subscriptions)}")
+        sub = Subscription(
+            invoice=invoice,
+            user_id=user_id,
+            token=token,
+            carrier_id=carrier_id,
+            status=status,
+            current_status=status,
+            subscribed_at=datetime.now().isoformat(),
+            alert_enabled=True
+        )
+        if not subscription_store.add(sub):
+            api_log.debug("⚠️ 중복 등록 시도 감지 → invoice: %s, user_id: %s", invoice, user_id)
+            existing = subscription_store.get(user_id, invoice)
+            if existing is not None and existing.token != token:
+                # 토큰이 바뀌었거나 등록 해제로 지워진 경우 새 토큰으로 갱신
+                subscription_store.update(user_id, invoice, token=token)
+                with FirestoreCall('subscribe', 'write'):
+                    db.collection("subscriptions").document(existing.doc_id).update({"token": token})
+                api_log.debug("🔑 FCM 토큰 갱신 → %s", existing.doc_id)
+            return jsonify({'status': 'duplicate', 'message': '이미 등록됨'}), 200
+
+        doc_ref = db.collection("subscriptions").document(sub.doc_id)
+        with FirestoreCall('subscribe', 'write'):
+            doc_ref.set(sub.to_dict())
+
+        api_log.debug("✅ 등록 완료 → 현재 구독 수: %d", len(subscription_store))
 
         return jsonify({'status': 'success', 'message': '알림 등록 완료'}), 200
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/unsubscribe_alert', methods=['POST'])
+@api.route('/unsubscribe_alert', methods=['POST'])
 def unsubscribe_alert():
-    global alert_subscriptions
+    if not wait_for_subscriptions():
+        return jsonify({'status': 'error', 'message': '구독 정보를 불러오는 중입니다. 잠시 후 다시 시도해 주세요.'}), 503
     try:
         data = request.get_json()
         invoice = data.get('invoice')
@@ -335,105 +1140,512 @@ def unsubscribe_alert():
 
         # ✅ Firestore subscriptions 문서 삭제
         doc_ref = db.collection("subscriptions").document(f"{user_id}_{invoice}")
-        doc_ref.delete()
-        print(f"☁️ Firestore 구독 문서 삭제 완료: {user_id}_{invoice}")
+        with FirestoreCall('unsubscribe', 'write'):
+            doc_ref.delete()
 
         # ✅ Firestore 메시지도 삭제
-        doc_ref = db.collection("messages").document(f"{user_id}_{invoice}")
-        doc_ref.delete()
-        print(f"☁️ Firestore 메시지 삭제 완료: {user_id}_{invoice}")
-        
-        load_subscriptions_from_firestore()
+        delete_alert_messages(user_id, invoice)
+        api_log.debug("☁️ Firestore 구독/메시지 삭제 완료: %s_%s", user_id, invoice)
+
+        subscription_store.remove(user_id, invoice)
+        subscription_writes.discard(f"{user_id}_{invoice}")
 
         return jsonify({'status': 'success', 'message': '알림 구독 삭제 완료'}), 200
 
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/toggle_alert', methods=['POST'])
+@api.route('/toggle_alert', methods=['POST'])
 def toggle_alert():
+    if not wait_for_subscriptions():
+        return jsonify({'status': 'error', 'message': '구독 정보를 불러오는 중입니다. 잠시 후 다시 시도해 주세요.'}), 503
     try:
         data = request.get_json()
         invoice = data.get('invoice')
         user_id = data.get('user_id')
         enabled = data.get('enabled', True)
 
-        for sub in alert_subscriptions:
-            if sub['invoice'] == invoice and sub['user_id'] == user_id:
-                sub['alert_enabled'] = enabled
-                save_subscriptions_to_file()
-
-                # ✅ Firestore도 즉시 변경
-                doc_ref = db.collection("subscriptions").document(f"{user_id}_{invoice}")
-                doc_ref.update({"alert_enabled": enabled})
-                print(f"☁️ Firestore alert_enabled 변경 → {user_id}_{invoice}: {enabled}")
-
-                print(f"✔️ toggle_alert 성공 - user_id: {user_id}, invoice: {invoice}, alert_enabled: {enabled}")
+        sub = subscription_store.update(user_id, invoice, alert_enabled=enabled)
+        if sub is None:
+            return jsonify({'status': 'fail', 'message': '구독 정보 없음'}), 404
 
-                return jsonify({'status': 'success', 'message': '알림 설정 변경됨'})
+        # ✅ 바뀐 문서 하나만 즉시 변경 (전체 재저장 생략)
+        doc_ref = db.collection("subscriptions").document(sub.doc_id)
+        with FirestoreCall('toggle_alert', 'write'):
+            doc_ref.update({"alert_enabled": enabled})
+        api_log.debug("☁️ Firestore alert_enabled 변경 → %s: %s", sub.doc_id, enabled)
 
-        return jsonify({'status': 'fail', 'message': '구독 정보 없음'}), 404
+        return jsonify({'status': 'success', 'message': '알림 설정 변경됨'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/get_current_statuses', methods=['GET'])
+# 📋 사용자별 구독 상태 목록: 앱에 필요한 필드만 (FCM 토큰 제외), invoice 순 페이지 단위
+CURRENT_STATUS_FIELDS = ('invoice', 'carrier_id', 'status', 'current_status', 'alert_enabled', 'subscribed_at')
+CURRENT_STATUSES_PAGE_SIZE = 100
+CURRENT_STATUSES_MAX_PAGE_SIZE = 500
+
+def subscription_state_fresh():
+    """메모리 구독 상태가 Firestore와 맞춰져 있는지 (리스너 동작 중이거나 최근 전체 로드)"""
+    if SUBSCRIPTION_SYNC_MODE == 'listener':
+        return subscription_listener_active() and subscriptions_synced.is_set()
+    return time.time() - _last_subscription_load < TRACKER_POLL_INTERVAL_MINUTES * 60
+
+def current_statuses_page(user_id, cursor, limit):
+    """(구독 목록, next_cursor), 메모리 상태가 최신이면 메모리에서, 아니면 Firestore 조회"""
+    if subscription_state_fresh():
+        subs = sorted(subscription_store.by_user(user_id), key=lambda sub: sub.invoice)
+        if cursor:
+            subs = [sub for sub in subs if sub.invoice > cursor]
+        items = [{field: getattr(sub, field) for field in CURRENT_STATUS_FIELDS} for sub in subs[:limit + 1]]
+    else:
+        # 문서 ID(__name__, user_id_invoice) 순 = 사용자 안에서 invoice 순, 복합 색인 불필요
+        subscriptions_ref = db.collection("subscriptions")
+        query = (subscriptions_ref
+                 .where(filter=firestore.FieldFilter('user_id', '==', user_id))
+                 .order_by('__name__')
+                 .select(CURRENT_STATUS_FIELDS))
+        if cursor:
+            query = query.start_after({'__name__': subscriptions_ref.document(f"{user_id}_{cursor}")})
+        with FirestoreCall('current_statuses', 'read') as call:
+            items = [
+                {field: data.get(field) for field in CURRENT_STATUS_FIELDS}
+                for data in (doc.to_dict() for doc in query.limit(limit + 1).stream())
+            ]
+            call.documents = len(items)
+
+    has_more = len(items) > limit
+    items = items[:limit]
+    return items, items[-1]['invoice'] if has_more else None
+
+@api.route('/get_current_statuses', methods=['GET'])
 def get_current_statuses():
+    user_id = request.args.get('user_id')
+    cursor = request.args.get('cursor')  # 이전 응답의 next_cursor (마지막 invoice)
+    if not user_id:
+        return jsonify({'status': 'fail', 'message': 'user_id가 없습니다.'}), 400
+
     try:
-        subscriptions_ref = db.collection("subscriptions").stream()
-        data = [doc.to_dict() for doc in subscriptions_ref]
-        return jsonify({'status': 'success', 'subscriptions': data})
+        limit = min(int(request.args.get('limit', CURRENT_STATUSES_PAGE_SIZE)), CURRENT_STATUSES_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError('limit은 1 이상이어야 합니다.')
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'message': f'잘못된 파라미터: {e}'}), 400
+
+    try:
+        items, next_cursor = current_statuses_page(user_id, cursor, limit)
+        body = {'status': 'success', 'subscriptions': items, 'next_cursor': next_cursor}
+
+        # 🏷️ 내용 기준 ETag, 워커가 달라도 같은 목록이면 같은 값
+        payload = json.dumps(body, ensure_ascii=False, sort_keys=True, default=str)
+        etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = jsonify(body)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/alert_messages', methods=['GET'])
+@api.route('/alert_messages', methods=['GET'])
 def get_alert_messages():
     invoice = request.args.get('invoice')
     user_id = request.args.get('user_id')
+    since = request.args.get('since')    # 이 시각(created_at) 이후 메시지만
+    cursor = request.args.get('cursor')  # 이전 응답의 next_cursor
 
     if not invoice or not user_id:
         return jsonify({'status': 'fail', 'message': 'invoice 또는 user_id가 없습니다.'}), 400
 
+    # limit/cursor/since를 하나도 보내지 않는 예전 클라이언트에는 전체 메시지를 그대로 돌려줌
+    paginated = any(name in request.args for name in ('limit', 'cursor', 'since'))
+
     try:
-        doc_ref = db.collection("messages").document(f"{user_id}_{invoice}")
-        doc = doc_ref.get()
-        if doc.exists:
-            messages = [msg['body'] for msg in doc.to_dict().get('messages', [])]
-        else:
-            messages = []
-        return jsonify({'status': 'success', 'messages': messages})
+        limit = None
+        if paginated:
+            limit = min(int(request.args.get('limit', ALERT_MESSAGES_PAGE_SIZE)), ALERT_MESSAGES_MAX_PAGE_SIZE)
+            if limit <= 0:
+                raise ValueError('limit은 1 이상이어야 합니다.')
+        since_time = datetime.fromisoformat(since) if since else None
+        if since_time is not None and since_time.tzinfo is None:
+            since_time = since_time.replace(tzinfo=timezone.utc)
+    except ValueError as e:
+        return jsonify({'status': 'fail', 'message': f'잘못된 파라미터: {e}'}), 400
+
+    try:
+        if not since and not cursor:
+            migrate_legacy_alert_messages(user_id, invoice)
+
+        items_ref = alert_message_items(user_id, invoice)
+        query = items_ref.order_by('created_at')
+        if since_time is not None:
+            query = query.where(filter=firestore.FieldFilter('created_at', '>', since_time))
+        if cursor:
+            with FirestoreCall('alert_messages', 'read'):
+                cursor_doc = items_ref.document(cursor).get()
+            if cursor_doc.exists:
+                query = query.start_after(cursor_doc)
+
+        if limit is not None:
+            query = query.limit(limit + 1)
+        with FirestoreCall('alert_messages', 'read') as call:
+            docs = list(query.stream())
+            call.documents = len(docs)
+        has_more = limit is not None and len(docs) > limit
+        docs = docs[:limit]
+
+        items = []
+        for doc in docs:
+            data = doc.to_dict()
+            created_at = data.get('created_at')
+            items.append({
+                'id': doc.id,
+                'body': data.get('body'),
+                'timestamp': data.get('timestamp'),
+                'created_at': created_at.isoformat() if created_at else None,
+            })
+
+        return jsonify({
+            'status': 'success',
+            'messages': [item['body'] for item in items],
+            'items': items,
+            'next_cursor': items[-1]['id'] if has_more else None,
+            'latest': items[-1]['created_at'] if items else since,
+        })
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# 🚦 /track 요청 제한: 사용자별 TRACK_RATE_LIMIT회 / TRACK_RATE_WINDOW_SECONDS초 (워커마다)
+TRACK_RATE_LIMIT = int(os.environ.get("TRACK_RATE_LIMIT", "30"))
+TRACK_RATE_WINDOW_SECONDS = float(os.environ.get("TRACK_RATE_WINDOW_SECONDS", "60"))
+
+
+class RateLimiter:
+    """키별 고정 구간 요청 수 제한 (프로세스 내)"""
+
+    def __init__(self, limit, window, max_keys=10000):
+        self._limit = limit
+        self._window = window
+        self._max_keys = max_keys
+        self._counts = {}  # key → (구간 시작, 요청 수)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._counts.get(key, (now, 0))
+            if now - started >= self._window:
+                started, count = now, 0
+            if count >= self._limit:
+                return False
+            self._counts[key] = (started, count + 1)
+            if len(self._counts) > self._max_keys:
+                # 구간이 끝난 키 정리
+                self._counts = {k: v for k, v in self._counts.items() if now - v[0] < self._window}
+            return True
+
+
+track_rate_limiter = RateLimiter(TRACK_RATE_LIMIT, TRACK_RATE_WINDOW_SECONDS)
+
+@api.route('/track', methods=['GET'])
+def track_invoice():
+    """구독 중인 송장만 조회 (tracker.delivery 자격 증명을 임의 송장 조회에 쓰지 않도록)"""
+    user_id = request.args.get('user_id')
+    invoice = request.args.get('invoice')
+    if not user_id or not invoice:
+        return jsonify({'status': 'fail', 'message': 'user_id 또는 invoice가 없습니다.'}), 400
+    if not track_rate_limiter.allow(user_id):
+        return jsonify({'status': 'fail', 'message': '요청이 너무 많습니다. 잠시 후 다시 시도해 주세요.'}), 429
+    if not wait_for_subscriptions():
+        return jsonify({'status': 'error', 'message': '구독 정보를 불러오는 중입니다. 잠시 후 다시 시도해 주세요.'}), 503
+
+    sub = subscription_store.get(user_id, invoice)
+    if sub is None or not sub.carrier_id:
+        return jsonify({'status': 'fail', 'message': '구독 정보 없음'}), 404
 
-def send_fcm_notification(token, title, body, invoice=None, user_id=None):
     try:
-        # FCM 메시지 전송
-        message = messaging.Message(
-            notification=messaging.Notification(title=title, body=body),
-            token=token,
-            data={}
-        )
-        response = messaging.send(message)
-        print(f"🔔 FCM 전송 성공: {response}")
-
-        # 메시지 Firestore 저장
-        if invoice and user_id:
-            doc_ref = db.collection("messages").document(f"{user_id}_{invoice}")
-            doc = doc_ref.get()
-            messages = doc.to_dict().get('messages', []) if doc.exists else []
-            messages.append({
-                'body': body,
-                'timestamp': datetime.now().isoformat()
-            })
-            doc_ref.set({'messages': messages})
-            print(f"☁️ Firestore 메시지 저장 완료 → {user_id}_{invoice}")
+        # 🗃️ 폴러나 다른 워커가 방금 조회한 결과가 있으면 재사용
+        track = fetch_tracking_cached([(sub.carrier_id, invoice)])[0]
+        if track is None:
+            return jsonify({'status': 'fail', 'message': '배송 정보를 조회하지 못했습니다.'}), 502
+        return jsonify({'status': 'success', 'track': track})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 
+# 💬 알림 메시지 로그: messages/{user_id}_{invoice}/items 하위 컬렉션에 한 건씩 추가
+ALERT_MESSAGES_PAGE_SIZE = 100
+ALERT_MESSAGES_MAX_PAGE_SIZE = 500
+# 예전 messages 배열 문서 이전 여부, 모두 옮긴 뒤 0으로 끄면 첫 페이지 조회 때 예전 문서를 읽지 않음
+ALERT_MESSAGES_LEGACY_MIGRATION = os.environ.get("ALERT_MESSAGES_LEGACY_MIGRATION", "1").lower() in ('1', 'true', 'yes')
+# 이전을 확인한 문서 id (워커마다 송장별로 한 번만 읽음), 이 수를 넘으면 비우고 다시 확인
+LEGACY_CHECKED_MAX_KEYS = 100000
+legacy_checked_doc_ids = set()
+legacy_checked_lock = threading.Lock()
+
+def alert_message_items(user_id, invoice):
+    return db.collection("messages").document(f"{user_id}_{invoice}").collection("items")
+
+def append_alert_message(user_id, invoice, body):
+    """기존 문서를 읽지 않고 메시지 한 건만 추가 (created_at은 서버 시각)"""
+    with FirestoreCall('append_alert_message', 'write'):
+        alert_message_items(user_id, invoice).add({
+            'body': body,
+            'timestamp': datetime.now().isoformat(),
+            'created_at': firestore.SERVER_TIMESTAMP,
+        })
+
+def mark_legacy_checked(doc_id):
+    with legacy_checked_lock:
+        if len(legacy_checked_doc_ids) >= LEGACY_CHECKED_MAX_KEYS:
+            legacy_checked_doc_ids.clear()
+        legacy_checked_doc_ids.add(doc_id)
+
+def migrate_legacy_alert_messages(user_id, invoice):
+    """messages 배열로 저장된 예전 문서를 items 하위 컬렉션으로 옮김
+
+    옮긴 항목의 문서 id는 배열 위치로 정해 두므로 여러 요청/워커가 동시에 옮겨도
+    같은 문서를 덮어쓸 뿐 메시지가 중복되지 않는다.
+    """
+    doc_id = f"{user_id}_{invoice}"
+    if not ALERT_MESSAGES_LEGACY_MIGRATION or doc_id in legacy_checked_doc_ids:
+        return
+    doc_ref = db.collection("messages").document(doc_id)
+    with FirestoreCall('migrate_alert_messages', 'read'):
+        doc = doc_ref.get()
+    if not doc.exists:
+        mark_legacy_checked(doc_id)
+        return
+    legacy = doc.to_dict().get('messages') or []
+    items_ref = doc_ref.collection("items")
+    for i in range(0, len(legacy), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for position, msg in enumerate(legacy[i:i + FIRESTORE_BATCH_SIZE], start=i):
+            try:
+                created_at = datetime.fromisoformat(msg.get('timestamp')).astimezone()
+            except (TypeError, ValueError):
+                created_at = datetime.now().astimezone()
+            batch.set(items_ref.document(f"legacy-{position:06d}"), {
+                'body': msg.get('body'),
+                'timestamp': msg.get('timestamp'),
+                'created_at': created_at,
+            })
+        with FirestoreCall('migrate_alert_messages', 'write', len(legacy[i:i + FIRESTORE_BATCH_SIZE])):
+            batch.commit()
+    with FirestoreCall('migrate_alert_messages', 'write'):
+        doc_ref.delete()
+    mark_legacy_checked(doc_id)
+    api_log.info(f"☁️ 예전 메시지 {len(legacy)}건 이전 완료 → {user_id}_{invoice}")
+
+def delete_alert_messages(user_id, invoice):
+    items_ref = alert_message_items(user_id, invoice)
+    while True:
+        with FirestoreCall('delete_alert_messages', 'read') as call:
+            refs = [doc.reference for doc in items_ref.limit(FIRESTORE_BATCH_SIZE).stream()]
+            call.documents = len(refs)
+        if not refs:
+            break
+        batch = db.batch()
+        for ref in refs:
+            batch.delete(ref)
+        with FirestoreCall('delete_alert_messages', 'write', len(refs)):
+            batch.commit()
+    with FirestoreCall('delete_alert_messages', 'write'):
+        db.collection("messages").document(f"{user_id}_{invoice}").delete()
+
+
+# 🔔 FCM 전송 큐 설정
+FCM_BATCH_SIZE = 500  # send_each 한 번에 보낼 수 있는 최대 메시지 수
+FCM_BATCH_LINGER_SECONDS = float(os.environ.get("FCM_BATCH_LINGER_SECONDS", "0.5"))
+FCM_MAX_RETRIES = int(os.environ.get("FCM_MAX_RETRIES", "3"))
+FCM_RETRY_BACKOFF_SECONDS = float(os.environ.get("FCM_RETRY_BACKOFF_SECONDS", "1"))
+# 잠시 후 다시 보내면 성공할 수 있는 오류
+FCM_TRANSIENT_ERRORS = (
+    firebase_exceptions.UnavailableError,
+    firebase_exceptions.InternalError,
+    firebase_exceptions.DeadlineExceededError,
+    firebase_exceptions.ResourceExhaustedError,
+    messaging.QuotaExceededError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+def send_fcm_messages(messages):
+    """messaging.send_each (Firebase 앱은 처음 보낼 때 초기화)"""
+    init_firebase()
+    return messaging.send_each(messages)
+
+
+class NotificationQueue:
+    """FCM 알림을 모아 백그라운드 스레드에서 send_each로 일괄 전송
+
+    transport는 messaging.send_each와 같은 형태(메시지 목록 → BatchResponse)면 되므로
+    테스트에서는 가짜 전송 함수로 바꿔 쓸 수 있다.
+    """
+
+    def __init__(self, transport=None, batch_size=FCM_BATCH_SIZE, linger=FCM_BATCH_LINGER_SECONDS,
+                 max_retries=FCM_MAX_RETRIES, backoff=FCM_RETRY_BACKOFF_SECONDS):
+        self._transport = transport or send_fcm_messages
+        self._batch_size = batch_size
+        self._linger = linger
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._reset()
+        self.stats = {
+            'enqueued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'unregistered': 0,
+            'batches': 0, 'batch_failures': 0, 'last_batch_seconds': 0.0, 'total_batch_seconds': 0.0,
+        }
+        # fork된 자식에는 전송 스레드가 없고, 부모 큐에 남은 알림은 부모가 보내므로 빈 큐로 다시 시작
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self.stats[name] += value
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='fcm-sender', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, token, title, body, invoice=None, user_id=None):
+        self._count(enqueued=1)
+        self._queue.put({'token': token, 'title': title, 'body': body, 'invoice': invoice, 'user_id': user_id})
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        # 짧게 기다리며 함께 보낼 알림을 모음
+        deadline = time.monotonic() + self._linger
+        while len(batch) < self._batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self.send_batch(batch)
+            except Exception as e:
+                self._count(failed=len(batch))
+                FCM_MESSAGES.labels('failed').inc(len(batch))
+                fcm_log.error(f"❗ FCM 일괄 전송 처리 실패: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def send_batch(self, batch):
+        pending = batch
+        for attempt in range(self._max_retries + 1):
+            messages = [
+                messaging.Message(
+                    notification=messaging.Notification(title=n['title'], body=n['body']),
+                    token=n['token'],
+                    data={}
+                )
+                for n in pending
+            ]
+            started = time.monotonic()
+            try:
+                response = self._transport(messages)
+                results = [(r.success, r.exception) for r in response.responses]
+            except Exception as e:
+                # 요청 자체가 실패하면 묶음 전체를 같은 오류로 처리
+                results = [(False, e)] * len(pending)
+                self._count(batch_failures=1)
+            elapsed = time.monotonic() - started
+            FCM_SEND_SECONDS.observe(elapsed)
+            with self._lock:
+                self.stats['batches'] += 1
+                self.stats['last_batch_seconds'] = elapsed
+                self.stats['total_batch_seconds'] += elapsed
+
+            delivered, retry = [], []
+            for notification, (success, error) in zip(pending, results):
+                if success:
+                    delivered.append(notification)
+                elif isinstance(error, messaging.UnregisteredError):
+                    self._count(unregistered=1)
+                    FCM_MESSAGES.labels('unregistered').inc()
+                    prune_unregistered_token(notification['token'])
+                elif isinstance(error, FCM_TRANSIENT_ERRORS) and attempt < self._max_retries:
+                    retry.append(notification)
+                else:
+                    self._count(failed=1)
+                    FCM_MESSAGES.labels('failed').inc()
+                    fcm_log.error(f"❗ FCM 전송 실패 [{notification['invoice']}]: {error}", extra={'invoice': notification['invoice']})
+
+            self._count(sent=len(delivered))
+            FCM_MESSAGES.labels('sent').inc(len(delivered))
+            if delivered:
+                fcm_log.info(f"🔔 FCM 일괄 전송 성공: {len(delivered)}건 ({elapsed * 1000:.0f}ms)")
+                save_delivered_messages(delivered)
+            if not retry:
+                return
+            self._count(retried=len(retry))
+            FCM_MESSAGES.labels('retried').inc(len(retry))
+            delay = self._backoff * (2 ** attempt)
+            fcm_log.warning(f"🔁 FCM 일시 오류 {len(retry)}건, {delay:.1f}초 후 재시도")
+            time.sleep(delay)
+            pending = retry
+
+    def drain(self, timeout=10.0):
+        """종료 전 큐에 남은 알림이 전송될 때까지 잠시 대기"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def save_delivered_messages(notifications):
+    """전송된 알림을 메시지 로그에 한 번의 배치로 추가"""
+    notifications = [n for n in notifications if n['invoice'] and n['user_id']]
+    try:
+        for i in range(0, len(notifications), FIRESTORE_BATCH_SIZE):
+            chunk = notifications[i:i + FIRESTORE_BATCH_SIZE]
+            batch = db.batch()
+            for n in chunk:
+                batch.set(alert_message_items(n['user_id'], n['invoice']).document(), {
+                    'body': n['body'],
+                    'timestamp': datetime.now().isoformat(),
+                    'created_at': firestore.SERVER_TIMESTAMP,
+                })
+            with FirestoreCall('save_alert_messages', 'write', len(chunk)):
+                batch.commit()
+        if notifications:
+            fcm_log.info(f"☁️ Firestore 메시지 저장 완료: {len(notifications)}건")
     except Exception as e:
-        print(f"❗ FCM 전송 실패: {e}")
+        fcm_log.error(f"❗ Firestore 메시지 저장 실패: {e}")
+
+def prune_unregistered_token(token):
+    """등록 해제된 FCM 토큰을 쓰는 구독에서 토큰 제거 (다시 구독하면 새 토큰으로 갱신)"""
+    for sub in subscription_store.by_token(token):
+        subscription_store.update(sub.user_id, sub.invoice, token=None)
+        subscription_writes.mark(sub.doc_id, {'token': None})
+        fcm_log.info(f"🧹 등록 해제된 FCM 토큰 제거 → {sub.doc_id}")
+
+
+notification_queue = NotificationQueue()
+
+def send_fcm_notification(token, title, body, invoice=None, user_id=None):
+    """알림을 전송 큐에 넣고 바로 반환 (전송/메시지 저장은 백그라운드에서 처리)"""
+    notification_queue.enqueue(token, title, body, invoice=invoice, user_id=user_id)
 
 
 # 🔍 송장번호로 carrierId 자동 감지 함수
-def detect_carrier(tracking_number, access_token):
+def detect_carrier(tracking_number, access_token=None):
     query = '''
     query Detect($trackingNumber: String!) {
       detectCarrier(trackingNumber: $trackingNumber) {
@@ -443,159 +1655,1242 @@ def detect_carrier(tracking_number, access_token):
     }
     '''
     variables = {"trackingNumber": tracking_number}
+    access_token = access_token or tracker_token_manager.get()
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {access_token}'
     }
-    response = requests.post(
-        'https://apis.tracker.delivery/graphql',
+    response = tracker_session.post(
+        TRACKER_GRAPHQL_URL,
         headers=headers,
-        json={'query': query, 'variables': variables}
+        json={'query': query, 'variables': variables},
+        timeout=TRACKER_REQUEST_TIMEOUT
     )
     result = response.json()
     if 'data' in result and result['data']['detectCarrier']:
         return result['data']['detectCarrier']['id']
     return None
 
-def check_tracking_status():
-    """5분마다 실행될 로직"""
-    print(f"🧠 PID: {os.getpid()} - 배송 상태 체크 호출")
-    load_subscriptions_from_firestore()  # ✅ 최신 데이터를 매번 로드
+TRACK_FIELDS = """
+    lastEvent {
+      status {
+        name
+      }
+      time
+    }
+"""
+
+TRACK_QUERY = """
+query Track($carrierId: ID!, $trackingNumber: String!) {
+  track(carrierId: $carrierId, trackingNumber: $trackingNumber) {%s  }
+}
+""" % TRACK_FIELDS
+
+def build_batch_track_query(count):
+    """송장 count건을 별칭(t0, t1, …) track 필드로 묶은 GraphQL 문서"""
+    params = ", ".join(f"$c{i}: ID!, $n{i}: String!" for i in range(count))
+    fields = "".join(
+        f"  t{i}: track(carrierId: $c{i}, trackingNumber: $n{i}) {{{TRACK_FIELDS}  }}\n"
+        for i in range(count)
+    )
+    return f"query TrackBatch({params}) {{\n{fields}}}\n"
+
+# 지표 라벨용 운송사 ID 형식 (예: kr.cjlogistics), 요청으로 들어온 임의 문자열은 other로 묶음
+CARRIER_LABEL_PATTERN = re.compile(r'^[a-z]{2}\.[a-z0-9-]{1,32}$')
+
+def carrier_label(carrier_ids):
+    carrier_ids = set(carrier_ids)
+    if len(carrier_ids) > 1:
+        return 'mixed'
+    carrier_id = next(iter(carrier_ids), None) or ''
+    return carrier_id if CARRIER_LABEL_PATTERN.match(carrier_id) else 'other'
+
+class TrackerRequestTimer:
+    """tracker.delivery 조회 한 번의 시간을 운송사/결과별로 기록 (결과를 정하지 않고 끝나면 exception)"""
+
+    def __init__(self, carrier_ids):
+        self.carrier = carrier_label(carrier_ids)
+        self.outcome = 'exception'
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        TRACKER_REQUEST_SECONDS.labels(self.carrier, self.outcome).observe(time.perf_counter() - self._started)
+        return False
+
+def fetch_tracking(carrier_id, invoice):
+    """송장 한 건의 lastEvent 조회, 실패 시 None"""
+    with TrackerRequestTimer([carrier_id]) as timer:
+        variables = {"carrierId": carrier_id, "trackingNumber": invoice}
+        response = post_tracker_graphql(TRACK_QUERY, variables)
+        if response.status_code != 200:
+            timer.outcome = 'http_error'
+            tracker_log.warning(f"❌ [{invoice}] HTTP Status: {response.status_code}")
+            return None
+
+        result = response.json()
+        if 'errors' in result:
+            timer.outcome = 'graphql_error'
+            tracker_log.error(f"❗ [{invoice}] GraphQL 오류 발생: {result['errors']}")
+            return None
+        if 'data' not in result or not result['data'].get('track'):
+            timer.outcome = 'missing'
+            tracker_log.error(f"❗ [{invoice}] 데이터 누락 또는 잘못된 응답.")
+            return None
+        timer.outcome = 'ok'
+        return result['data']['track']
+
+def fetch_tracking_batch(items):
+    """[(carrier_id, invoice), …]를 한 번의 요청으로 조회, 항목별 track 또는 None 목록"""
+    with TrackerRequestTimer(carrier_id for carrier_id, _ in items) as timer:
+        tracks = _fetch_tracking_batch(items, timer)
+        if timer.outcome == 'exception':
+            failed = tracks.count(None)
+            timer.outcome = 'ok' if not failed else 'partial' if failed < len(tracks) else 'missing'
+        return tracks
+
+def _fetch_tracking_batch(items, timer):
+    query = build_batch_track_query(len(items))
+    variables = {}
+    for i, (carrier_id, invoice) in enumerate(items):
+        variables[f"c{i}"] = carrier_id
+        variables[f"n{i}"] = invoice
+    response = post_tracker_graphql(query, variables)
+    invoices = [invoice for _, invoice in items]
+    if response.status_code != 200:
+        timer.outcome = 'http_error'
+        tracker_log.warning(f"❌ {invoices} HTTP Status: {response.status_code}")
+        return [None] * len(items)
+
+    result = response.json()
+    data = result.get('data') or {}
+
+    # ❗ GraphQL 오류를 별칭(path[0]) 기준으로 송장에 매핑
+    alias_index = {f"t{i}": i for i in range(len(items))}
+    failed = set()
+    for error in result.get('errors', []):
+        path = error.get('path') or [None]
+        if path[0] in alias_index:
+            failed.add(alias_index[path[0]])
+            tracker_log.error(f"❗ [{invoices[alias_index[path[0]]]}] GraphQL 오류 발생: {error}")
+        else:
+            # 특정 별칭에 속하지 않는 오류는 묶음 전체 실패로 처리
+            timer.outcome = 'graphql_error'
+            tracker_log.error(f"❗ {invoices} GraphQL 오류 발생: {error}")
+            return [None] * len(items)
+
+    tracks = []
+    for i, invoice in enumerate(invoices):
+        track = data.get(f"t{i}")
+        if i in failed:
+            track = None
+        elif not track:
+            tracker_log.error(f"❗ [{invoice}] 데이터 누락 또는 잘못된 응답.")
+        tracks.append(track)
+    return tracks
+
+# 🗃️ 배송 조회 결과 캐시: (carrier_id, invoice) → track
+# 정규화 상태별 보관 시간(초), 상태가 자주 바뀌는 단계일수록 짧게
+TRACKING_CACHE_TTL_SECONDS = {
+    '배송완료': 6 * 3600,
+    '배송출발': 120,
+    '간선하차': 300,
+    'sm 입고': 300,
+    '간선상차': 600,
+    '집화처리': 1200,
+}
+TRACKING_CACHE_DEFAULT_TTL_SECONDS = float(os.environ.get("TRACKING_CACHE_DEFAULT_TTL_SECONDS", "300"))
+TRACKING_CACHE_MAX_ENTRIES = int(os.environ.get("TRACKING_CACHE_MAX_ENTRIES", "10000"))
+# 워커 프로세스 간 공유 캐시: sqlite(기본, DELIVERY_DATA_DIR), redis, none
+TRACKING_CACHE_SHARED = os.environ.get("TRACKING_CACHE_SHARED", "sqlite").lower()
+TRACKING_CACHE_REDIS_URL = os.environ.get("TRACKING_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+
+def tracking_cache_ttl(key, track):
+    """(carrier_id, invoice) 송장의 track 보관 시간(초), 상태 이름은 그 운송사 기준으로 정규화"""
+    carrier_id, _ = key
+    status = normalize_status(track['lastEvent']['status']['name'], carrier_id)
+    return TRACKING_CACHE_TTL_SECONDS.get(status, TRACKING_CACHE_DEFAULT_TTL_SECONDS)
+
+
+class SQLiteTrackingCache:
+    """여러 워커 프로세스가 함께 쓰는 SQLite 캐시 계층"""
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS tracking_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys, now):
+        placeholders = ','.join('?' * len(keys))
+        rows = self._connect().execute(
+            f'SELECT key, value, expires_at FROM tracking_cache WHERE key IN ({placeholders}) AND expires_at > ?',
+            (*keys, now)
+        ).fetchall()
+        return {key: (json.loads(value), expires_at) for key, value, expires_at in rows}
+
+    def put(self, key, track, expires_at):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO tracking_cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(track, ensure_ascii=False), expires_at)
+        )
+        # 가끔 만료된 항목 정리
+        if hash(key) % 100 == 0:
+            conn.execute('DELETE FROM tracking_cache WHERE expires_at <= ?', (time.time(),))
+
+
+class RedisTrackingCache:
+    """Redis 캐시 계층 (redis 패키지가 있을 때만 사용)"""
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
+
+    def get_many(self, keys, now):
+        found = {}
+        for key, value in zip(keys, self._client.mget([f'tracking:{key}' for key in keys])):
+            if value is not None:
+                entry = json.loads(value)
+                found[key] = (entry['track'], entry['expires_at'])
+        return found
+
+    def put(self, key, track, expires_at):
+        ttl = max(int(math.ceil(expires_at - time.time())), 1)
+        self._client.set(
+            f'tracking:{key}', json.dumps({'track': track, 'expires_at': expires_at}, ensure_ascii=False), ex=ttl
+        )
 
+
+class _TrackingFlight:
+    __slots__ = ('done', 'track')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.track = None
+
+
+class TrackingCache:
+    """배송 조회 결과 캐시 (프로세스 내 LRU + 선택적 공유 계층)
+
+    같은 송장에 대한 동시 조회는 한 번만 요청하고 나머지는 결과를 기다림(single-flight).
+    조회 실패(None)는 캐시하지 않음. 폴러는 refresh=True로 캐시를 읽지 않고 새로 조회해
+    결과만 캐시에 넣으므로, 캐시 보관 시간 때문에 상태 변경 알림이 늦어지지 않는다.
+    """
+
+    def __init__(self, max_entries, ttl_func, shared=None):
+        self._max_entries = max_entries
+        self._ttl_func = ttl_func
+        self._shared = shared
+        self._entries = OrderedDict()  # (carrier_id, invoice) → (track, 만료 시각)
+        self._inflight = {}            # (carrier_id, invoice) → _TrackingFlight
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'shared_hits': 0, 'misses': 0, 'waits': 0, 'shared_errors': 0}
+
+    @staticmethod
+    def _shared_key(key):
+        return f'{key[0]}:{key[1]}'
+
+    def _get_local(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key, track, expires_at):
+        self._entries[key] = (track, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def fetch_many(self, keys, fetch, refresh=False):
+        """keys의 track 목록, 캐시에 없는 송장만 fetch(missing_keys)로 한 번에 조회
+
+        refresh=True면 캐시를 건너뛰고 모두 조회 (진행 중인 같은 송장 조회는 그 결과를 사용)
+        """
+        now = time.time()
+        results = {}
+        if not refresh:
+            with self._lock:
+                for key in keys:
+                    entry = self._get_local(key, now)
+                    if entry is not None:
+                        results[key] = entry[0]
+                        self._counts['hits'] += 1
+        missing = [key for key in dict.fromkeys(keys) if key not in results]
+
+        if missing and self._shared is not None and not refresh:
+            try:
+                found = self._shared.get_many([self._shared_key(key) for key in missing], now)
+            except Exception as e:
+                found = {}
+                self._counts['shared_errors'] += 1
+                tracker_log.error(f"❗ 공유 배송 조회 캐시 읽기 실패: {e}")
+            with self._lock:
+                for key in missing:
+                    entry = found.get(self._shared_key(key))
+                    if entry is not None:
+                        results[key] = entry[0]
+                        self._put_local(key, *entry)
+                        self._counts['shared_hits'] += 1
+            missing = [key for key in missing if key not in results]
+
+        # 🛫 다른 스레드가 조회 중인 송장은 기다리고, 나머지만 직접 조회
+        leading, waiting = [], []
+        with self._lock:
+            for key in missing:
+                flight = self._inflight.get(key)
+                if flight is None:
+                    flight = self._inflight[key] = _TrackingFlight()
+                    leading.append((key, flight))
+                else:
+                    waiting.append((key, flight))
+            self._counts['misses'] += len(leading)
+            self._counts['waits'] += len(waiting)
+
+        if leading:
+            try:
+                tracks = fetch([key for key, _ in leading])
+                for (key, flight), track in zip(leading, tracks):
+                    flight.track = track
+                    results[key] = track
+                    if track is not None:
+                        self._store(key, track)
+            finally:
+                with self._lock:
+                    for key, flight in leading:
+                        self._inflight.pop(key, None)
+                for _, flight in leading:
+                    flight.done.set()
+
+        for key, flight in waiting:
+            flight.done.wait(timeout=TRACKER_REQUEST_TIMEOUT * 2)
+            results[key] = flight.track
+        return [results.get(key) for key in keys]
+
+    def _store(self, key, track):
+        try:
+            expires_at = time.time() + self._ttl_func(key, track)
+        except Exception:
+            return  # 형식이 예상과 다른 결과는 캐시하지 않음
+        with self._lock:
+            self._put_local(key, track, expires_at)
+        if self._shared is not None:
+            try:
+                self._shared.put(self._shared_key(key), track, expires_at)
+            except Exception as e:
+                self._counts['shared_errors'] += 1
+                tracker_log.error(f"❗ 공유 배송 조회 캐시 저장 실패: {e}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, size=len(self._entries), inflight=len(self._inflight))
+
+
+def create_shared_tracking_cache():
+    if TRACKING_CACHE_SHARED == 'sqlite':
+        return SQLiteTrackingCache(os.path.join(DELIVERY_DATA_DIR, 'tracking_cache.sqlite3'))
+    if TRACKING_CACHE_SHARED == 'redis':
+        try:
+            return RedisTrackingCache(TRACKING_CACHE_REDIS_URL)
+        except ImportError:
+            tracker_log.warning("❗ redis 패키지가 없어 공유 배송 조회 캐시를 사용하지 않습니다.")
+    return None
+
+
+tracking_cache = TrackingCache(TRACKING_CACHE_MAX_ENTRIES, tracking_cache_ttl, create_shared_tracking_cache())
+
+def fetch_tracking_cached(keys, refresh=False):
+    """[(carrier_id, invoice), …]를 캐시 우선으로 조회, 캐시에 없는 송장만 한 번의 요청으로 조회
+
+    refresh=True(폴러)면 캐시를 읽지 않고 모두 새로 조회해 캐시를 갱신
+    """
+    def fetch(missing):
+        if len(missing) == 1:
+            return [fetch_tracking(*missing[0])]
+        return fetch_tracking_batch(missing)
+    return tracking_cache.fetch_many(keys, fetch, refresh=refresh)
+
+def process_invoice_batch(keys, subs_by_key):
+    """송장마다 한 번씩만 조회해 그 송장을 구독한 모든 구독에 반영, 송장별 [구독별 변경 여부] 목록"""
     try:
-        access_token = get_access_token(TRACKER_CLIENT_ID, TRACKER_CLIENT_SECRET)
-        print(f"✅ Access Token 생성 성공: {access_token[:10]}...")
+        tracks = fetch_tracking_cached(keys, refresh=True)
     except Exception as e:
-        print(f"❗ Access Token 생성 실패: {e}")
-        return
+        tracker_log.exception(f"❗ {[invoice for _, invoice in keys]} 조회 중 예외 발생")
+        return [[False] * len(subs_by_key[key]) for key in keys]
+    return [
+        [apply_tracking_result(sub, track) for sub in subs_by_key[key]]
+        for key, track in zip(keys, tracks)
+    ]
+
+def apply_tracking_result(sub, track):
+    """조회한 track 결과를 구독에 반영하고 변경 시 알림/저장, 상태가 바뀌면 True"""
+    invoice = sub.invoice
+    token = sub.token
+    user_id = sub.user_id
+    prev_status = sub.current_status or ''  # ✅ current_status 기준으로 비교
+    carrier_id = sub.carrier_id
 
-    for sub in alert_subscriptions:
-        invoice = sub.get('invoice')
-        token = sub.get('token')
-        user_id = sub.get('user_id')
-        prev_status = sub.get('current_status', '')  # ✅ current_status 기준으로 비교
-        carrier_id = sub.get('carrier_id')
+    try:
+        if track is None:
+            return False
+
+        current_status = track['lastEvent']['status']['name']
+        norm_status = normalize_status(current_status, carrier_id)
+        event_time_str = track['lastEvent'].get('time')
+
+        if prev_status == norm_status:
+            # 예전 문서처럼 이벤트 시각이 없으면 메모리에만 채워 다음 예측(reschedule)에 사용
+            if event_time_str and sub.last_event_time != event_time_str:
+                subscription_store.update(user_id, invoice, last_event_time=event_time_str)
+            poller_log.debug("ℹ️ [%s] 상태 변화 없음: %s", invoice, norm_status)
+            return False
+
+        poller_log.info(f"✅ [{invoice}] 상태 변경 감지: {prev_status} → {norm_status}",
+                        extra={'invoice': invoice, 'carrier_id': sub.carrier_id, 'status': norm_status})
+
+        if prev_status in ['배송완료', '배달완료'] and norm_status in ['배송완료', '배달완료']:
+            poller_log.debug("🚫 [%s] 이미 배송완료 상태, 중복 알림 생략", invoice)
+            return False
+
+        if sub.alert_enabled:
+            if norm_status in ['배송완료', '배송 완료', '배달완료', '배달 완료']:
+                try:
+                    event_time = to_event_time(datetime.fromisoformat(event_time_str))
+                    time_str = event_time.strftime("%m월 %d일 %H:%M")
+                    message_body = f"{time_str} 배송완료 되었습니다."
+                except Exception as e:
+                    poller_log.error(f"❗ 배송완료 시간 파싱 실패: {e}")
+                    message_body = f"배송완료 되었습니다."
+            else:
+                # 예측은 지금이 아닌 마지막 이벤트 시각 기준 (시각/요일/체류시간 특성)
+                prediction = predict_arrival_internal(
+                    current_status, event_time_str or datetime.now(EVENT_TIMEZONE).isoformat(), carrier_id
+                )
+                if prediction.get("status") == "success":
+                    eta_str = prediction["arrival_time"].strftime("%m월 %d일 %H:%M 도착 예상")
+                else:
+                    eta_str = "도착 시간 예측 불가"
+
+                message_body = f"송장번호 : {invoice}\n{current_status} : {eta_str}"
+
+            if token:
+                send_fcm_notification(
+                    token,
+                    "택배 상태 업데이트",
+                    message_body,
+                    invoice=invoice,
+                    user_id=user_id
+                )
+                poller_log.info(f"🔔 [{invoice}] FCM 알림 전송 완료: {norm_status}")
+            else:
+                # 등록 해제로 토큰이 지워진 구독, 알림은 켜져 있으므로 같은 메시지를 기록만 해 둠 (다시 구독하면 전송 재개)
+                append_alert_message(user_id, invoice, message_body)
+                poller_log.info(f"☁️ [{invoice}] 메시지만 저장 (FCM 토큰 없음) - {norm_status}")
 
-        if not carrier_id:
-            print(f"❗ carrierId 없음 - 송장번호: {invoice}")
-            continue
+        else:
+            append_alert_message(user_id, invoice, f"[알림 OFF] 송장번호 : {invoice} 상태변경 : {norm_status}")
+            poller_log.info(f"☁️ [{invoice}] 메시지만 저장 (알림 OFF) - {norm_status}")
+
+        # ✅ 상태 변경 후 저장
+        subscription_store.update(
+            user_id, invoice,
+            current_status=norm_status,  # 내부 상태 추적용
+            status=current_status,       # Firestore에는 API 원본 이름 저장
+            last_event_time=event_time_str
+        )
+        # 체크가 끝날 때 다른 변경과 함께 배치로 저장
+        subscription_writes.mark(f"{user_id}_{invoice}", {
+            "current_status": norm_status,   # 내부 용도 (필요하면 유지)
+            "status": current_status,        # 🔔 앱에 보여줄 원본 상태 이름
+            "last_event_time": event_time_str  # 재시작 후 예측 기준 시각
+        })
+        poller_log.debug("☁️ Firestore current_status 업데이트 예약 → %s_%s: %s", user_id, invoice, norm_status)
+        return True
+
+    except Exception as e:
+        poller_log.exception(f"❗ [{invoice}] 처리 중 예외 발생")
+        return False
+
+# 🗓️ 정규화 상태별 조회 간격(분), 배송완료는 더 이상 조회하지 않음
+POLL_INTERVAL_MINUTES = {
+    '배송출발': 5,
+    '간선하차': 15,
+    'sm 입고': 15,
+    '간선상차': 30,
+    '집화처리': 60,
+}
+POLL_RETIRED_STATUSES = {'배송완료'}
+# 예상 도착 시각 전후 이 범위(분) 안에서는 최소 간격으로 조회
+POLL_ETA_WINDOW_MINUTES = 60
+POLL_MIN_INTERVAL_MINUTES = 5
+# 야간(22시~7시)에는 최소 이 간격(분)으로만 조회, 시각은 서버 시간대가 아닌 POLL_TIMEZONE 기준
+POLL_QUIET_HOURS = (22, 7)
+POLL_QUIET_INTERVAL_MINUTES = 60
+POLL_TIMEZONE = ZoneInfo(os.environ.get("POLL_TIMEZONE", "Asia/Seoul"))
+
+def next_poll_interval(status, eta, now):
+    """상태/예상 도착 시각/시간대로 다음 조회까지의 간격(초) 계산, 종료 상태면 None"""
+    if status in POLL_RETIRED_STATUSES:
+        return None
+    minutes = POLL_INTERVAL_MINUTES.get(status, TRACKER_POLL_INTERVAL_MINUTES)
+
+    if eta is not None and abs(eta - now) <= POLL_ETA_WINDOW_MINUTES * 60:
+        return min(minutes, POLL_MIN_INTERVAL_MINUTES) * 60
+
+    hour = datetime.fromtimestamp(now, POLL_TIMEZONE).hour
+    quiet_start, quiet_end = POLL_QUIET_HOURS
+    if hour >= quiet_start or hour < quiet_end:
+        minutes = max(minutes, POLL_QUIET_INTERVAL_MINUTES)
+    return minutes * 60
+
+
+class PollScheduler:
+    """구독별 다음 조회 시각을 관리하는 우선순위 큐 (key = user_id_invoice)"""
+
+    def __init__(self):
+        self._heap = []        # (조회 시각, key), 오래된 항목은 꺼낼 때 무시
+        self._next_at = {}     # key → 조회 시각 (None: 조회 중, inf: 조회 종료)
+        self._eta = {}         # key → 예상 도착 시각(timestamp)
+        self._synced_version = None
+        self._lock = threading.Lock()
+
+    def sync(self, store, now, owns=None, ring_version=None):
+        """새 구독은 바로 조회 대상으로 추가하고, 삭제된 구독은 제거 (구독 추가/삭제가 있을 때만)
+
+        owns가 있으면 owns(key)가 True인 구독만 관리 (샤드 담당이 바뀌면 ring_version이 바뀜)
+        """
+        version = (store.version, ring_version)
+        if version == self._synced_version:
+            return
+        self._synced_version = version
+        subs_by_key = {sub.doc_id: sub for sub in store.snapshot() if owns is None or owns(sub.doc_id)}
+        with self._lock:
+            for key in list(self._next_at):
+                if key not in subs_by_key:
+                    del self._next_at[key]
+                    self._eta.pop(key, None)
+            for key, sub in subs_by_key.items():
+                if key in self._next_at:
+                    continue
+                if sub.current_status in POLL_RETIRED_STATUSES:
+                    self._next_at[key] = math.inf
+                else:
+                    self._push(key, now)
+
+    def _push(self, key, at):
+        self._next_at[key] = at
+        heapq.heappush(self._heap, (at, key))
+
+    def pop_due(self, now):
+        """조회 시각이 지난 key 목록 (오래 기다린 순)"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                at, key = heapq.heappop(self._heap)
+                if self._next_at.get(key) != at:
+                    continue
+                self._next_at[key] = None
+                due.append(key)
+        return due
+
+    def schedule(self, key, at):
+        with self._lock:
+            if key in self._next_at:
+                self._push(key, at)
+
+    def reschedule(self, key, sub, changed, now):
+        """조회 결과를 반영해 다음 조회 시각 결정, 상태가 바뀌면 예상 도착 시각도 갱신"""
+        if changed or key not in self._eta:
+            # 마지막 이벤트 시각 기준 예측, 아직 모르면 지금 시각 기준
+            last_time_str = sub.last_event_time or datetime.fromtimestamp(now, EVENT_TIMEZONE).isoformat()
+            prediction = predict_arrival_internal(sub.status or '', last_time_str, sub.carrier_id)
+            eta = prediction['arrival_time'].timestamp() if prediction.get('status') == 'success' else None
+        else:
+            eta = self._eta[key]
+
+        interval = next_poll_interval(sub.current_status, eta, now)
+        with self._lock:
+            if key not in self._next_at:
+                return
+            self._eta[key] = eta
+            if interval is None:
+                self._next_at[key] = math.inf
+            else:
+                self._push(key, now + interval)
+
+    def stats(self):
+        with self._lock:
+            retired = sum(1 for at in self._next_at.values() if at == math.inf)
+            return {'tracked': len(self._next_at), 'retired': retired}
+
+    def lag(self, now):
+        """(조회 시각이 지난 구독 수, 가장 오래 밀린 시간(초))"""
+        with self._lock:
+            overdue = [at for at in self._next_at.values() if at is not None and at <= now]
+        return len(overdue), (now - min(overdue)) if overdue else 0.0
+
+
+poll_scheduler = PollScheduler()
+
+# 👑 폴러 실행 방식
+# - leader : 여러 워커/호스트 중 리스(lease)를 가진 하나만 조회 (기본)
+# - sharded: 살아 있는 인스턴스끼리 구독을 나눠 각자 맡은 구독만 조회
+# - all    : 모든 워커가 각자 조회 (예전 방식)
+# - off    : 조회하지 않음, 웹 요청만 처리 (poller.py를 따로 실행할 때)
+POLLER_MODE = os.environ.get("POLLER_MODE", "leader").lower()
+# 리스 저장소: firestore(여러 호스트), sqlite/file(한 호스트의 워커끼리), sharded 모드는 firestore/sqlite만 사용
+POLLER_LEASE_BACKEND = os.environ.get("POLLER_LEASE_BACKEND", "firestore").lower()
+# 리더가 죽으면 최대 이 시간(초) 안에 다른 워커가 이어받음
+POLLER_LEASE_TTL_SECONDS = float(os.environ.get("POLLER_LEASE_TTL_SECONDS", "30"))
+POLLER_LEASE_HEARTBEAT_SECONDS = float(os.environ.get("POLLER_LEASE_HEARTBEAT_SECONDS", "10"))
+
+
+class FirestoreLease:
+    """poller_leases/{name} 문서를 트랜잭션으로 갱신하는 리스 (호스트 간 시계 차이는 TTL보다 작다고 가정)"""
+
+    def __init__(self, name):
+        self._name = name
+
+    @property
+    def _ref(self):
+        return db.collection("poller_leases").document(self._name)
+
+    def acquire(self, holder, ttl):
+        @firestore.transactional
+        def attempt(transaction):
+            snapshot = self._ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else {}
+            now = time.time()
+            if data.get('holder') not in (None, holder) and data.get('expires_at', 0) > now:
+                return False
+            transaction.set(self._ref, {'holder': holder, 'expires_at': now + ttl, 'heartbeat_at': now})
+            return True
+        with FirestoreCall('poller_lease', 'write'):
+            return attempt(db.transaction())
+
+    def release(self, holder):
+        @firestore.transactional
+        def attempt(transaction):
+            snapshot = self._ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.get('holder') == holder:
+                transaction.delete(self._ref)
+        with FirestoreCall('poller_lease', 'write'):
+            attempt(db.transaction())
+
+
+class SQLiteLease:
+    """같은 호스트의 워커끼리 SQLite 파일로 공유하는 리스"""
+
+    def __init__(self, path, name):
+        self._path = path
+        self._name = name
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.conn = conn
+        return conn
 
+    def acquire(self, holder, ttl):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
         try:
-            query = """
-            query Track($carrierId: ID!, $trackingNumber: String!) {
-              track(carrierId: $carrierId, trackingNumber: $trackingNumber) {
-                lastEvent {
-                  status {
-                    name
-                  }
-                  time
-                }
-              }
-            }
-            """
-            variables = {"carrierId": carrier_id, "trackingNumber": invoice}
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}'
-            }
-            response = requests.post(
-                'https://apis.tracker.delivery/graphql',
-                headers=headers,
-                json={'query': query, 'variables': variables}
+            now = time.time()
+            row = conn.execute('SELECT holder, expires_at FROM leases WHERE name = ?', (self._name,)).fetchone()
+            acquired = row is None or row[0] == holder or row[1] <= now
+            if acquired:
+                conn.execute(
+                    'INSERT OR REPLACE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)',
+                    (self._name, holder, now + ttl)
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return acquired
+
+    def release(self, holder):
+        self._connect().execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self._name, holder))
+
+
+class FileLease:
+    """flock 파일 잠금, 프로세스가 죽으면 OS가 바로 풀어 주므로 가장 빨리 넘겨받음"""
+
+    def __init__(self, path):
+        self._path = path
+        self._fd = None
+
+    def acquire(self, holder, ttl):
+        import fcntl
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, holder.encode('utf-8'))
+        self._fd = fd
+        return True
+
+    def release(self, holder):
+        if self._fd is not None:
+            os.close(self._fd)  # 닫으면 잠금도 풀림
+            self._fd = None
+
+
+class PollerLeader:
+    """리스를 주기적으로 갱신해 조회를 맡을 리더인지 판단"""
+
+    def __init__(self, lease, ttl):
+        self._lease = lease
+        self._ttl = ttl
+        self._reset()
+        self.stats = {'acquired': 0, 'lost': 0, 'errors': 0}
+        # preload_app으로 fork된 워커가 마스터와 같은 holder로 리스를 나눠 갖지 않도록 새로 만듦
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0  # time.monotonic() 기준, 이 시각까지만 리더로 간주
+        self._lock = threading.Lock()
+
+    def heartbeat(self):
+        started = time.monotonic()
+        was_leader = self.is_leader()
+        try:
+            acquired = self._lease.acquire(self.holder, self._ttl)
+        except Exception as e:
+            acquired = False
+            self.stats['errors'] += 1
+            poller_log.error(f"❗ 폴러 리스 갱신 실패: {e}")
+        with self._lock:
+            # 요청을 보낸 시점부터 TTL을 계산해 다른 워커보다 먼저 만료되도록 함
+            self._valid_until = started + self._ttl if acquired else 0.0
+        if acquired and not was_leader:
+            self.stats['acquired'] += 1
+            poller_log.info(f"👑 폴러 리더 획득 ({self.holder})")
+        elif was_leader and not acquired:
+            self.stats['lost'] += 1
+            poller_log.warning(f"⚠️ 폴러 리더 상실 ({self.holder})")
+        return acquired
+
+    def is_leader(self):
+        with self._lock:
+            return time.monotonic() < self._valid_until
+
+    def release(self):
+        with self._lock:
+            was_leader = time.monotonic() < self._valid_until
+            self._valid_until = 0.0
+        if was_leader:
+            try:
+                self._lease.release(self.holder)
+            except Exception as e:
+                poller_log.error(f"❗ 폴러 리스 반납 실패: {e}")
+
+    def status(self):
+        return dict(self.stats, holder=self.holder, leader=self.is_leader())
+
+
+# 🧩 sharded 모드: 살아 있는 폴러 인스턴스끼리 구독({user_id}_{invoice})을 일관 해싱으로 나눠 조회
+def poller_instance_id():
+    return os.environ.get("POLLER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+POLLER_INSTANCE_ID = poller_instance_id()
+POLLER_SHARD_VNODES = int(os.environ.get("POLLER_SHARD_VNODES", "64"))
+
+
+def shard_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """인스턴스마다 가상 노드 vnodes개를 두는 일관 해시 링"""
+
+    def __init__(self, members, vnodes):
+        self.members = sorted(members)
+        points = sorted(
+            (shard_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._hashes, shard_hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+    def share(self, member):
+        """링에서 member가 맡는 해시 공간 비율"""
+        if not self._owners:
+            return 0.0
+        total = 0
+        space = 1 << 64
+        for i, owner in enumerate(self._owners):
+            if owner == member:
+                previous = self._hashes[i - 1] if i else self._hashes[-1] - space
+                total += self._hashes[i] - previous
+        return total / space
+
+
+class FirestoreMembership:
+    """poller_members/{instance} 문서로 살아 있는 폴러 인스턴스 관리"""
+
+    @property
+    def _members(self):
+        return db.collection("poller_members")
+
+    def register(self, instance, ttl, info):
+        now = time.time()
+        with FirestoreCall('poller_members', 'write'):
+            self._members.document(instance).set(dict(info, expires_at=now + ttl, heartbeat_at=now))
+
+    def members(self):
+        now = time.time()
+        query = self._members.where(filter=firestore.FieldFilter('expires_at', '>', now))
+        with FirestoreCall('poller_members', 'read') as call:
+            members = {doc.id: doc.to_dict() for doc in query.stream()}
+            call.documents = len(members)
+        return members
+
+    def unregister(self, instance):
+        with FirestoreCall('poller_members', 'write'):
+            self._members.document(instance).delete()
+
+
+class SQLiteMembership:
+    """같은 호스트의 폴러 인스턴스끼리 SQLite 파일로 공유하는 인스턴스 목록"""
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS members (instance TEXT PRIMARY KEY, info TEXT NOT NULL, expires_at REAL NOT NULL)'
             )
-            if response.status_code != 200:
-                print(f"❌ [{invoice}] HTTP Status: {response.status_code}")
-                continue
+            self._local.conn = conn
+        return conn
 
-            result = response.json()
-            if 'errors' in result:
-                print(f"❗ [{invoice}] GraphQL 오류 발생: {result['errors']}")
-                continue
-            if 'data' not in result or not result['data'].get('track'):
-                print(f"❗ [{invoice}] 데이터 누락 또는 잘못된 응답.")
-                continue
+    def register(self, instance, ttl, info):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO members (instance, info, expires_at) VALUES (?, ?, ?)',
+            (instance, json.dumps(info), time.time() + ttl)
+        )
+
+    def members(self):
+        rows = self._connect().execute(
+            'SELECT instance, info, expires_at FROM members WHERE expires_at > ?', (time.time(),)
+        ).fetchall()
+        return {instance: dict(json.loads(info), expires_at=expires_at) for instance, info, expires_at in rows}
+
+    def unregister(self, instance):
+        self._connect().execute('DELETE FROM members WHERE instance = ?', (instance,))
+
+
+class PollerShards:
+    """인스턴스 목록을 주기적으로 갱신해 이 인스턴스가 맡을 구독 결정
+
+    인스턴스가 들어오거나 빠지면 다음 heartbeat에서 링을 다시 만들고 담당 구독을 다시 맞춤.
+    heartbeat마다 담당 구독 수/밀린 시간을 함께 기록해 모든 샤드의 상태를 볼 수 있음.
+    """
+
+    def __init__(self, membership, instance, ttl, vnodes):
+        self._membership = membership
+        self.instance = instance
+        self._ttl = ttl
+        self._vnodes = vnodes
+        self._ring = HashRing([], vnodes)
+        self.ring_version = 0
+        self._members = {}
+        self._valid_until = 0.0
+        self._heartbeats = 0
+        self._lock = threading.Lock()
+        self.stats = {'rebalances': 0, 'errors': 0}
+
+    def heartbeat(self):
+        started = time.monotonic()
+        now = time.time()
+        due, lag = poll_scheduler.lag(now)
+        info = {'owned': poll_scheduler.stats()['tracked'], 'due': due, 'lag_seconds': round(lag, 1), 'pid': os.getpid()}
+        try:
+            self._membership.register(self.instance, self._ttl, info)
+            members = self._membership.members()
+        except Exception as e:
+            self.stats['errors'] += 1
+            poller_log.error(f"❗ 폴러 인스턴스 목록 갱신 실패: {e}")
+            with self._lock:
+                self._valid_until = 0.0
+            return False
+
+        members[self.instance] = dict(members.get(self.instance, {}), **info)
+        with self._lock:
+            if sorted(members) != self._ring.members:
+                self._ring = HashRing(members, self._vnodes)
+                self.ring_version += 1
+                self.stats['rebalances'] += 1
+                poller_log.info(f"🧩 샤드 재분배: 인스턴스 {len(members)}개, "
+                      f"담당 비율 {self._ring.share(self.instance):.2%}")
+            self._members = members
+            self._heartbeats += 1
+            # 첫 heartbeat에서는 먼저 떠 있던 인스턴스만 보이므로, 한 번 더 갱신한 뒤부터 조회
+            if self._heartbeats >= 2:
+                self._valid_until = started + self._ttl
+        return True
+
+    def active(self):
+        with self._lock:
+            return time.monotonic() < self._valid_until
+
+    def owns(self, key):
+        return self._ring.owner(key) == self.instance
+
+    def share(self):
+        return self._ring.share(self.instance)
+
+    def release(self):
+        with self._lock:
+            self._valid_until = 0.0
+        try:
+            self._membership.unregister(self.instance)
+        except Exception as e:
+            poller_log.error(f"❗ 폴러 인스턴스 등록 해제 실패: {e}")
+
+    def status(self):
+        with self._lock:
+            ring, members = self._ring, dict(self._members)
+        return dict(
+            self.stats,
+            instance=self.instance,
+            active=self.active(),
+            share=round(ring.share(self.instance), 4),
+            members={
+                instance: {
+                    'share': round(ring.share(instance), 4),
+                    'owned': info.get('owned'),
+                    'due': info.get('due'),
+                    'lag_seconds': info.get('lag_seconds'),
+                }
+                for instance, info in members.items()
+            },
+        )
 
-            current_status = result['data']['track']['lastEvent']['status']['name']
-            norm_status = normalize_status(current_status)
 
-            if prev_status != norm_status:
-                print(f"✅ [{invoice}] 상태 변경 감지: {prev_status} → {norm_status}")
+def create_poller_membership():
+    if POLLER_LEASE_BACKEND == 'sqlite':
+        return SQLiteMembership(os.path.join(DELIVERY_DATA_DIR, 'poller_lease.sqlite3'))
+    return FirestoreMembership()
+
+
+def create_poller_lease():
+    if POLLER_LEASE_BACKEND == 'sqlite':
+        return SQLiteLease(os.path.join(DELIVERY_DATA_DIR, 'poller_lease.sqlite3'), 'tracking')
+    if POLLER_LEASE_BACKEND == 'file':
+        return FileLease(os.path.join(DELIVERY_DATA_DIR, 'poller.lock'))
+    return FirestoreLease('tracking')
+
+
+poller_leader = PollerLeader(create_poller_lease(), POLLER_LEASE_TTL_SECONDS)
+poller_shards = (
+    PollerShards(create_poller_membership(), POLLER_INSTANCE_ID, POLLER_LEASE_TTL_SECONDS, POLLER_SHARD_VNODES)
+    if POLLER_MODE == 'sharded' else None
+)
+
+def _reset_poller_instance():
+    # preload_app으로 fork된 워커는 마스터 PID 대신 자기 PID로 인스턴스 ID를 다시 정함
+    poller_shards.instance = poller_instance_id()
+
+if poller_shards is not None:
+    os.register_at_fork(after_in_child=_reset_poller_instance)
+
+# 체크가 겹쳐 실행되지 않도록 보호
+_sweep_lock = threading.Lock()
+_last_subscription_load = 0.0
+
+def poller_active():
+    """이 프로세스가 지금 배송 상태 조회를 맡고 있는지"""
+    if POLLER_MODE == 'leader':
+        return poller_leader.is_leader()
+    if POLLER_MODE == 'sharded':
+        return poller_shards.active()
+    return POLLER_MODE != 'off'
+
+def update_poller_metrics():
+    """구독 수/조회 담당 여부/밀린 구독 게이지 갱신 (스케줄러 tick, /metrics 요청 시)"""
+    SUBSCRIPTIONS.set(len(subscription_store))
+    active = poller_active()
+    POLLER_ACTIVE.set(1 if active else 0)
+    # 조회를 맡지 않은 프로세스의 스케줄러는 예전 상태일 수 있으므로 0으로 기록
+    due, lag = poll_scheduler.lag(time.time()) if active else (0, 0.0)
+    POLLER_OWNED.set(poll_scheduler.stats()['tracked'] if active else 0)
+    POLLER_DUE.set(due)
+    POLLER_LAG_SECONDS.set(lag)
+    if poller_shards is not None:
+        POLLER_SHARD_SHARE.set(poller_shards.share() if active else 0)
 
-                if prev_status in ['배송완료', '배달완료'] and norm_status in ['배송완료', '배달완료']:
-                    print(f"🚫 [{invoice}] 이미 배송완료 상태, 중복 알림 생략")
-                    continue
+def check_tracking_status():
+    """스케줄러 tick마다 실행, 조회 시각이 된 구독만 확인"""
+    update_poller_metrics()
+    if POLLER_MODE == 'off':
+        return
+    if POLLER_MODE == 'leader' and not poller_leader.is_leader():
+        return
+    if POLLER_MODE == 'sharded' and not poller_shards.active():
+        return
+    if not _sweep_lock.acquire(blocking=False):
+        poller_log.warning("⏭️ 이전 배송 상태 체크가 아직 진행 중, 이번 실행 생략")
+        return
+    try:
+        run_tracking_sweep()
+    finally:
+        _sweep_lock.release()
+
+def sync_subscriptions():
+    """스케줄러 tick마다 모든 프로세스에서 실행, 메모리 구독을 Firestore와 맞춤
+
+    조회 담당 여부(POLLER_MODE/리더/샤드)와 관계없이 실행해야 웹 워커의
+    구독 변경/조회 API가 다른 프로세스에서 생긴 변경을 볼 수 있다.
+    """
+    global _last_subscription_load
+    if SUBSCRIPTION_SYNC_MODE == 'listener' and not subscription_listener_active():
+        subscription_log.warning("❗ Firestore 구독 리스너 중단 감지 - 재시작")
+        start_subscription_listener()
+    # 리스너가 동작 중이면 변경분이 바로 반영되므로 전체 로드 생략
+    if subscription_listener_active():
+        return
+    # 진행 중인 체크가 저장까지 마친 뒤 로드해 체크 결과를 예전 문서로 덮어쓰지 않도록 함
+    with _sweep_lock:
+        now = time.time()
+        if now - _last_subscription_load >= TRACKER_POLL_INTERVAL_MINUTES * 60:
+            load_subscriptions_from_firestore()  # ✅ 기본 조회 주기마다 최신 데이터 로드
+            _last_subscription_load = now
+
+def run_tracking_sweep():
+    started = time.monotonic()
+    now = time.time()
+    if poller_shards is not None:
+        poll_scheduler.sync(subscription_store, now, poller_shards.owns, poller_shards.ring_version)
+    else:
+        poll_scheduler.sync(subscription_store, now)
+    due = [(key, subscription_store.get_by_doc_id(key)) for key in poll_scheduler.pop_due(now)]
+    due = [(key, sub) for key, sub in due if sub is not None]
+    if not due:
+        return
+    due_keys = [key for key, _ in due]
+    poller_log.info(f"🧠 배송 상태 체크 호출: {len(due)}건 (전체 {len(subscription_store)}건)")
 
-                if sub.get('alert_enabled', True):
-                    if norm_status in ['배송완료', '배송 완료', '배달완료', '배달 완료']:
-                        try:
-                            event_time_str = result['data']['track']['lastEvent']['time']
-                            event_time = datetime.fromisoformat(event_time_str)
-                            time_str = event_time.strftime("%m월 %d일 %H:%M")
-                            message_body = f"{time_str} 배송완료 되었습니다."
-                        except Exception as e:
-                            print(f"❗ 배송완료 시간 파싱 실패: {e}")
-                            message_body = f"배송완료 되었습니다."
-                    else:
-                        prediction = predict_arrival_internal(current_status, datetime.now().isoformat(), carrier_id)
-                        if prediction.get("status") == "success":
-                            minutes = prediction["predicted_minutes"]
-                            eta = datetime.now() + timedelta(minutes=minutes)
-                            eta_str = eta.strftime("%m월 %d일 %H:%M 도착 예상")
-                        else:
-                            eta_str = "도착 시간 예측 불가"
-
-                        message_body = f"송장번호 : {invoice}\n{current_status} : {eta_str}"
-
-                    send_fcm_notification(
-                        token,
-                        "택배 상태 업데이트",
-                        message_body,
-                        invoice=invoice,
-                        user_id=user_id
-                    )
-                    print(f"🔔 [{invoice}] FCM 알림 전송 완료: {norm_status}")
+    try:
+        tracker_token_manager.get()  # 캐시된 토큰 재사용, 만료 임박 시에만 갱신
+    except Exception as e:
+        poller_log.error(f"❗ Access Token 생성 실패: {e}")
+        for key in due_keys:
+            poll_scheduler.schedule(key, now)
+        return
 
-                else:
-                    doc_ref = db.collection("messages").document(f"{user_id}_{invoice}")
-                    doc = doc_ref.get()
-                    messages = doc.to_dict().get('messages', []) if doc.exists else []
-                    messages.append({
-                        'body': f"[알림 OFF] 송장번호 : {invoice} 상태변경 : {norm_status}",
-                        'timestamp': datetime.now().isoformat()
-                    })
-                    doc_ref.set({'messages': messages})
-                    print(f"☁️ [{invoice}] 메시지만 저장 (알림 OFF) - {norm_status}")
-
-                # ✅ 상태 변경 후 저장
-                sub['current_status'] = norm_status  # 내부 상태 추적용
-                sub['status'] = current_status       # Firestore에는 API 원본 이름 저장
-                doc_ref = db.collection("subscriptions").document(f"{user_id}_{invoice}")
-                doc_ref.update({
-                    "current_status": norm_status,   # 내부 용도 (필요하면 유지)
-                    "status": current_status         # 🔔 앱에 보여줄 원본 상태 이름
-                })
-                print(f"☁️ Firestore current_status 업데이트 → {user_id}_{invoice}: {norm_status}")
+    deadline = started + TRACKER_SWEEP_DEADLINE
 
-                save_subscriptions_to_file()
-            else:
-                print(f"ℹ️ [{invoice}] 상태 변화 없음: {norm_status}")
+    # 📦 같은 송장을 구독한 구독끼리 묶어 송장마다 한 번만 조회
+    subs_by_key = {}
+    outcome_by_doc_id = {}
+    for _, sub in due:
+        if not sub.carrier_id:
+            poller_log.error(f"❗ carrierId 없음 - 송장번호: {sub.invoice}")
+            outcome_by_doc_id[sub.doc_id] = False
+            continue
+        subs_by_key.setdefault((sub.carrier_id, sub.invoice), []).append(sub)
+
+    def worker(chunk):
+        # ⏱️ 제한 시간이 지나면 남은 구독은 다음 체크로 넘김 (None)
+        if time.monotonic() >= deadline:
+            return [[None] * len(subs_by_key[key]) for key in chunk]
+        return process_invoice_batch(chunk, subs_by_key)
+
+    invoice_keys = list(subs_by_key)
+    chunks = [
+        invoice_keys[i:i + TRACKER_QUERY_BATCH_SIZE]
+        for i in range(0, len(invoice_keys), TRACKER_QUERY_BATCH_SIZE)
+    ]
+    with ThreadPoolExecutor(max_workers=TRACKER_POLL_CONCURRENCY, thread_name_prefix='tracker') as executor:
+        for chunk, chunk_outcomes in zip(chunks, executor.map(worker, chunks)):
+            for key, sub_outcomes in zip(chunk, chunk_outcomes):
+                for sub, outcome in zip(subs_by_key[key], sub_outcomes):
+                    outcome_by_doc_id[sub.doc_id] = outcome
+
+    subscriptions = [sub for _, sub in due]
+    outcomes = [outcome_by_doc_id[key] for key in due_keys]
+    changed = outcomes.count(True)
+    skipped = outcomes.count(None)
+
+    finished = time.time()
+    for key, sub, outcome in zip(due_keys, subscriptions, outcomes):
+        if outcome is None:
+            poll_scheduler.schedule(key, now)  # 다음 tick에 우선 조회
+        else:
+            poll_scheduler.reschedule(key, sub, outcome, finished)
 
-        except Exception as e:
-            print(f"❗ [{invoice}] 예외 발생: {e}")
+    save_subscriptions_to_file()
+    SWEEP_SECONDS.observe(time.monotonic() - started)
+    SWEEP_SUBSCRIPTIONS.labels('changed').inc(changed)
+    SWEEP_SUBSCRIPTIONS.labels('unchanged').inc(len(outcomes) - changed - skipped)
+    SWEEP_SUBSCRIPTIONS.labels('deferred').inc(skipped)
+    if skipped:
+        poller_log.info(f"⏱️ 제한 시간 초과로 {skipped}건은 다음 체크로 연기")
+    poller_log.info(f"🏁 배송 상태 체크 완료: {len(subscriptions)}건 중 {changed}건 변경 "
+          f"(송장 {len(invoice_keys)}건 조회), {time.monotonic() - started:.1f}초")
 
 
 
-# ✅ 로드 후 즉시 스케줄러 시작
-load_subscriptions_from_file()
-load_subscriptions_from_firestore()
-print(f"👀 로드된 alert_subscriptions: {alert_subscriptions}")
+# 🚀 프로세스별 시작 준비
+# APP_AUTOSTART=0이면 import 시 백그라운드 작업을 시작하지 않음 (gunicorn.conf.py가 설정하고
+# 워커마다 post_worker_init에서 start_runtime() 호출, preload_app이면 모델은 pre_fork에서 마스터가 로드)
+APP_AUTOSTART = os.environ.get("APP_AUTOSTART", "1").lower() not in ('0', 'false', 'no')
 
 from apscheduler.schedulers.background import BackgroundScheduler
 scheduler = BackgroundScheduler()
-scheduler.add_job(check_tracking_status, 'interval', minutes=5)
-scheduler.start()
+
+runtime_ready = threading.Event()
+_runtime_lock = threading.Lock()
+_runtime_started = False
+
+def load_initial_subscriptions():
+    """시작 시 구독 한 번 로드 (listener 모드는 리스너의 초기 스냅샷으로 대신)"""
+    global _last_subscription_load
+    try:
+        if SUBSCRIPTION_SYNC_MODE == 'listener':
+            start_subscription_listener()
+            if not subscriptions_synced.wait(timeout=SUBSCRIPTION_READY_TIMEOUT):
+                subscription_log.warning("❗ 구독 리스너 초기 동기화 대기 시간 초과")
+        else:
+            load_subscriptions_from_firestore()
+            _last_subscription_load = time.time()
+    finally:
+        subscriptions_loaded.set()
+    log.info(f"👀 로드된 구독 수: {len(subscription_store)}")
+
+def start_poller():
+    """폴러 모드에 맞춰 리스 갱신과 배송 상태 체크 작업 시작"""
+    if POLLER_MODE == 'leader':
+        # 리스 갱신은 조회와 별도 작업으로 실행해 긴 조회 중에도 리더를 유지
+        poller_leader.heartbeat()
+        scheduler.add_job(poller_leader.heartbeat, 'interval', seconds=POLLER_LEASE_HEARTBEAT_SECONDS,
+                          max_instances=1, coalesce=True)
+        atexit.register(poller_leader.release)
+    elif POLLER_MODE == 'sharded':
+        poller_shards.heartbeat()
+        scheduler.add_job(poller_shards.heartbeat, 'interval', seconds=POLLER_LEASE_HEARTBEAT_SECONDS,
+                          max_instances=1, coalesce=True)
+        atexit.register(poller_shards.release)
+    if POLLER_MODE != 'off':
+        scheduler.add_job(check_tracking_status, 'interval', seconds=TRACKER_SCHEDULER_TICK_SECONDS,
+                          max_instances=1, coalesce=True)
+    log.info(f"🔁 폴러 모드: {POLLER_MODE}" + (f" (리스: {POLLER_LEASE_BACKEND})" if POLLER_MODE in ('leader', 'sharded') else ""))
+
+def warm_up():
+    """모델/배송 저장소/구독을 준비한 뒤 폴러 시작 (프로세스마다 백그라운드 스레드에서 한 번)"""
+    started = time.perf_counter()
+    try:
+        model_registry.preload()  # preload_app이면 fork 전에 로드되어 있어 바로 반환
+        try:
+            delivery_store.open()
+        except Exception as e:
+            log.error(f"❗ 배송 데이터 저장소 초기화 실패: {e}")
+        load_initial_subscriptions()
+        # 구독 동기화는 폴러 모드와 관계없이 모든 프로세스에서 실행
+        scheduler.add_job(sync_subscriptions, 'interval', seconds=TRACKER_SCHEDULER_TICK_SECONDS,
+                          max_instances=1, coalesce=True)
+        start_poller()
+        scheduler.start()
+    except Exception:
+        log.exception("❗ 시작 준비 실패")
+    finally:
+        runtime_ready.set()
+    log.info(f"✅ 시작 준비 완료: {time.perf_counter() - started:.2f}초")
+
+def start_runtime(wait=False):
+    """이 프로세스의 백그라운드 작업 시작 (여러 번 호출해도 한 번만)
+
+    알림 전송 스레드만 바로 띄우고 나머지는 warm-up 스레드에서 준비하므로
+    워커는 곧바로 요청을 받는다. wait=True면 준비가 끝날 때까지 기다린다.
+    """
+    global _runtime_started
+    if not _runtime_started:
+        with _runtime_lock:
+            if not _runtime_started:
+                notification_queue.start()
+                atexit.register(notification_queue.drain)
+                threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+                _runtime_started = True
+    if wait:
+        runtime_ready.wait()
+
+def _reset_runtime_after_fork():
+    # fork 전에 시작한 스레드/리스너/스케줄러는 자식에 없으므로 자식에서 처음부터 다시 시작할 수 있게 초기화
+    global _runtime_started, _runtime_lock, runtime_ready, scheduler
+    global _subscription_watch, subscriptions_synced, subscriptions_loaded
+    _runtime_started = False
+    _runtime_lock = threading.Lock()
+    runtime_ready = threading.Event()
+    scheduler = BackgroundScheduler()
+    _subscription_watch = None
+    subscriptions_synced = threading.Event()
+    subscriptions_loaded = threading.Event()
+
+os.register_at_fork(after_in_child=_reset_runtime_after_fork)
+
+@api.before_app_request
+def ensure_runtime_started():
+    # APP_AUTOSTART=0인데 start_runtime()을 부르지 않은 경우 첫 요청에서 시작
+    start_runtime()
+
+def create_app():
+    """Flask 앱 생성 (백그라운드 작업은 start_runtime()이 따로 시작)"""
+    flask_app = Flask(__name__)
+    CORS(flask_app, origins=["https://alimbox.com"])
+    flask_app.register_blueprint(api)
+    return flask_app
+
+
+app = create_app()
+
+if APP_AUTOSTART:
+    start_runtime()
 
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))  # Render가 제공하는 포트 환경변수 사용
-    print(f"🚀 서버 시작 - PID: {os.getpid()}, 포트: {port}")
+    log.info(f"🚀 서버 시작 - 포트: {port}")
+    start_runtime()
     app.run(debug=False, host='0.0.0.0', port=port, use_reloader=False)
\ No newline at end of file
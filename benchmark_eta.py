@@ -0,0 +1,128 @@
+"""배송 소요시간 예측 정확도/지연시간 비교 벤치마크
+
+train_models.py가 쌓아 둔 학습 데이터(--work-dir)를 앞쪽은 학습, 뒤쪽 holdout은 평가로 나눠
+- current  : 설치된 상태 코드 모델 (model-dir)
+- status   : 같은 데이터로 학습한 상태 코드 모델
+- features : 시각/요일/체류시간 특성 테이블
+의 MAE(분)와 예측 1건/배치 지연시간을 비교한다.
+
+    python benchmark_eta.py --work-dir training --model-dir . --output bench_eta.json
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from eta_model import (
+    MODEL_FILES, DWELL_BUCKET_EDGES, compile_eta_table, dwell_buckets, predict_eta, build_arrival_graphs
+)
+from train_models import encode, fit_carrier, load_dataset, load_pickle
+
+
+def expand_dwell(dataset):
+    """평가 이벤트마다 그 상태에 머문 체류 구간 경계 시점들로 펼침 (event index, 체류 분)"""
+    survived = DWELL_BUCKET_EDGES[None, :] < dataset['gaps'][:, None]
+    survived[:, 0] = True
+    rows, buckets = np.nonzero(survived)
+    return rows, DWELL_BUCKET_EDGES[buckets]
+
+
+def mae(pred, actual):
+    return float(np.mean(np.abs(pred - actual))) if len(actual) else None
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples = np.array(samples) * 1e6
+    return {'p50_us': round(float(np.percentile(samples, 50)), 1), 'p99_us': round(float(np.percentile(samples, 99)), 1)}
+
+
+def benchmark_carrier(key, dataset, model_dir, kind, holdout, repeat, batch_size):
+    model_file, mapping_file, _ = MODEL_FILES[key]
+    current_model = load_pickle(os.path.join(model_dir, model_file))
+    current_map = load_pickle(os.path.join(model_dir, mapping_file))
+
+    status_map = dict(current_map or {})
+    for name in dict.fromkeys(dataset['names'].tolist()):
+        status_map.setdefault(name, max(status_map.values(), default=-1) + 1)
+
+    split = int(len(dataset['names']) * (1 - holdout))
+    train = {column: values[:split] for column, values in dataset.items()}
+    test = {column: values[split:] for column, values in dataset.items()}
+    model, features = fit_carrier(train, status_map, kind)
+    eta_table = compile_eta_table(model, status_map)
+
+    # 📏 정확도: 체류 구간 경계 시점마다 예측한 총 소요시간 vs 실제
+    rows, dwell = expand_dwell(test)
+    actual = test['minutes'][rows]
+    codes = encode(test['names'], status_map).ravel()[rows] + 1
+    accuracy = {
+        'status': mae(np.maximum(eta_table[codes], dwell), actual),
+        'features': mae(features['minutes'][codes, test['hours'][rows], test['weekdays'][rows], dwell_buckets(dwell)], actual),
+        'samples': int(len(actual)),
+    }
+    if current_model is not None and current_map is not None:
+        current_codes = encode(test['names'], current_map).ravel()[rows] + 1
+        current_table = compile_eta_table(current_model, current_map)
+        accuracy['current'] = mae(np.maximum(current_table[current_codes], dwell), actual)
+
+    # ⏱️ 지연시간: 서버와 같은 경로 (predict_eta + 5일 그래프)
+    status_entry = {'status_map': status_map, 'eta_table': eta_table, 'features': None}
+    feature_entry = {'status_map': status_map, 'eta_table': eta_table, 'features': features}
+    names = test['names'] if len(test['names']) else train['names']
+    base = datetime(2025, 5, 1, 10, 0)
+    statuses = [str(names[i % len(names)]) for i in range(batch_size)]
+    last_times = [base + timedelta(minutes=37 * i) for i in range(batch_size)]
+    now = (base + timedelta(hours=3)).timestamp()
+
+    def run(entry, count):
+        minutes, residuals = predict_eta(entry, statuses[:count], last_times[:count], now)
+        arrivals = [t + timedelta(minutes=float(m)) for t, m in zip(last_times[:count], minutes)]
+        build_arrival_graphs(arrivals, statuses[:count], residuals)
+
+    latency = {}
+    for label, entry in (('status', status_entry), ('features', feature_entry)):
+        latency[label] = {
+            'single': time_calls(lambda: run(entry, 1), repeat),
+            f'batch_{batch_size}': time_calls(lambda: run(entry, batch_size), max(repeat // 20, 10)),
+        }
+    return {'carrier': key, 'train_rows': split, 'eval_rows': len(test['names']), 'mae_minutes': accuracy, 'latency': latency}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='배송 소요시간 예측 정확도/지연시간 벤치마크')
+    parser.add_argument('--work-dir', default='training')
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR', '') or '.')
+    parser.add_argument('--model', choices=['forest', 'linear'], default='forest')
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--output', help='결과 JSON 저장 경로')
+    args = parser.parse_args()
+
+    results = []
+    for key in MODEL_FILES:
+        dataset = load_dataset(args.work_dir, key)
+        if len(dataset['names']) < 2:
+            continue
+        result = benchmark_carrier(key, dataset, args.model_dir, args.model, args.holdout, args.repeat, args.batch_size)
+        results.append(result)
+        print(f"📊 [{key}] MAE {result['mae_minutes']}")
+        print(f"⏱️ [{key}] {result['latency']}")
+
+    if not results:
+        print("ℹ️ 학습 데이터가 없습니다. 먼저 train_models.py를 실행하세요.")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""ETA 테이블 동등성 확인 + 마이크로벤치마크
+
+운송사별 설치된 모델(model-dir)로 compile_eta_table을 만든 뒤, 상태 코드마다(알 수 없는 상태 -1 포함)
+예전 방식인 단건 model.predict 결과와 같은지 확인하고 예측 1건의 호출 시간을 비교한다.
+서버는 로드할 때 한 번의 predict로 테이블만 만들므로, 모델을 새로 설치하기 전에 이 스크립트로 확인한다.
+
+    python benchmark_eta_table.py --model-dir . --repeat 2000
+"""
+import argparse
+import os
+import timeit
+
+import numpy as np
+
+from eta_model import MODEL_FILES, compile_eta_table
+from train_models import load_pickle
+
+
+def check_equivalence(model, eta_table):
+    """(code, 테이블 값, 단건 predict 값) 불일치 목록"""
+    mismatches = []
+    for code in range(-1, len(eta_table) - 1):
+        expected = model.predict(np.array([[code]]))[0]
+        if not np.isclose(eta_table[code + 1], expected):
+            mismatches.append((code, float(eta_table[code + 1]), float(expected)))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ETA 테이블 동등성 확인/벤치마크')
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR', '') or '.')
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    failed = False
+    for key, (model_file, mapping_file, _) in MODEL_FILES.items():
+        model = load_pickle(os.path.join(args.model_dir, model_file))
+        status_map = load_pickle(os.path.join(args.model_dir, mapping_file))
+        if model is None or status_map is None:
+            print(f"ℹ️ [{key}] 모델 또는 매핑 파일 없음, 건너뜀")
+            continue
+
+        eta_table = compile_eta_table(model, status_map)
+        mismatches = check_equivalence(model, eta_table)
+        print(f"🔍 [{key}] 동등성 확인: 상태 코드 {len(eta_table)}개 중 불일치 {len(mismatches)}개")
+        for code, table_value, expected in mismatches[:20]:
+            print(f"  ❗ code={code}: 테이블 {table_value} / predict {expected}")
+        failed = failed or bool(mismatches)
+
+        # 서버 요청 한 건처럼 상태 이름 → 코드 → 예측
+        status = next(iter(status_map), '')
+        results = {
+            'predict': timeit.timeit(lambda: model.predict(np.array([[status_map.get(status, -1)]]))[0],
+                                     number=args.repeat),
+            'table': timeit.timeit(lambda: eta_table[status_map.get(status, -1) + 1], number=args.repeat),
+        }
+        for name, seconds in results.items():
+            print(f"⏱️ [{key}] {name:<8} {seconds / args.repeat * 1e6:10.1f} us/호출")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,615 @@
+"""API 부하 테스트 + 배송 상태 체크(sweep) 벤치마크
+
+외부 서비스 없이 로컬 가짜 서버로 실행한다.
+- tracker.delivery : OAuth 토큰/GraphQL(단건, 별칭 묶음)을 흉내 내는 스텁 서버 (별도 프로세스)
+- Firestore       : 메모리 가짜 클라이언트
+- FCM             : 지연시간만 흉내 내는 가짜 send_each
+
+1) app을 별도 프로세스의 HTTP 서버로 띄우고 /predict_arrival, /subscribe_alert, /toggle_alert,
+   /save_delivery와 페이지 조회(/get_current_statuses, /alert_messages)에 동시 요청을 보내
+   p50/p99 지연시간과 초당 요청 수를 잰다.
+2) 또 다른 프로세스에서 구독 1천/1만/10만 건을 채운 뒤 check_tracking_status 한 번을 잰다.
+
+결과는 JSON으로 저장하므로 변경 전후 실행 결과를 비교할 수 있다.
+
+    python benchmark_load.py --concurrency 1,16,64 --requests 2000 --output bench_load.json
+    python benchmark_load.py --endpoints predict_arrival --sweep-sizes 1000,10000,100000 --query-batch-size 20
+"""
+import argparse
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from eta_model import MODEL_FILES
+
+ENDPOINTS = ('predict_arrival', 'subscribe_alert', 'toggle_alert', 'save_delivery', 'get_current_statuses', 'alert_messages')
+# 쿼리 문자열로 요청하는 페이지 조회 엔드포인트
+GET_ENDPOINTS = ('get_current_statuses', 'alert_messages')
+# 페이지 조회 요청의 limit, 알림 메시지를 미리 넣어 둘 구독 수와 구독마다 메시지 수
+PAGE_LIMIT = 20
+SEED_MESSAGE_SUBSCRIPTIONS = 100
+SEED_MESSAGES = 50
+# 스텁 tracker가 모든 송장에 돌려주는 상태, 구독의 current_status가 다르면 상태 변경으로 처리됨
+STUB_STATUS = '배송출발'
+PREDICT_STATUSES = ('집화처리', '간선상차', '간선하차', '배송출발', 'sm 입고', '알 수 없는 상태')
+SEED_USERS = 100
+
+
+# ── tracker.delivery 스텁 ─────────────────────────────────────────────
+
+class TrackerStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 헤더와 본문을 따로 쓰므로 Nagle을 끄지 않으면 지연 ACK(~40ms)만큼 응답이 늦어짐
+    disable_nagle_algorithm = True
+    latency = 0.0
+    counts = {'token': 0, 'graphql': 0, 'invoices': 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        with self.lock:
+            self._send(200, dict(self.counts))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/oauth2/token'):
+            with self.lock:
+                self.counts['token'] += 1
+            return self._send(200, {'access_token': 'stub-token', 'expires_in': 3600})
+
+        if self.latency:
+            time.sleep(self.latency)
+        variables = json.loads(body).get('variables', {})
+        track = {'lastEvent': {'status': {'name': STUB_STATUS}, 'time': datetime.now().astimezone().isoformat()}}
+        if 'trackingNumber' in variables:
+            data, invoices = {'track': track}, 1
+        else:
+            # 묶음 조회: 변수 n0, n1, … 마다 별칭 t0, t1, …
+            aliases = [name[1:] for name in variables if re.fullmatch(r'n\d+', name)]
+            data, invoices = {f"t{i}": track for i in aliases}, len(aliases)
+        with self.lock:
+            self.counts['graphql'] += 1
+            self.counts['invoices'] += invoices
+        self._send(200, {'data': data})
+
+
+def serve_tracker(latency, port_queue):
+    TrackerStubHandler.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TrackerStubHandler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+# ── 가짜 Firestore / FCM ─────────────────────────────────────────────
+
+class FakeSnapshot:
+    def __init__(self, ref, data):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, path, doc_id):
+        self._db = db
+        self._path = path
+        self.id = doc_id
+
+    def _docs(self):
+        return self._db.collections.setdefault(self._path, {})
+
+    def set(self, data, merge=False):
+        data = self._db.resolve(data)
+        with self._db.lock:
+            if merge and self.id in self._docs():
+                self._docs()[self.id].update(data)
+            else:
+                self._docs()[self.id] = data
+            self._db.writes += 1
+
+    def update(self, fields):
+        from google.api_core.exceptions import NotFound
+        with self._db.lock:
+            if self.id not in self._docs():
+                raise NotFound(f"{self._path}/{self.id}")
+            self._docs()[self.id].update(self._db.resolve(fields))
+            self._db.writes += 1
+
+    def delete(self):
+        with self._db.lock:
+            self._docs().pop(self.id, None)
+            self._db.writes += 1
+
+    def get(self, transaction=None):
+        with self._db.lock:
+            self._db.reads += 1
+            return FakeSnapshot(self, copy.deepcopy(self._docs().get(self.id)))
+
+    def collection(self, name):
+        return FakeCollection(self._db, f"{self._path}/{self.id}/{name}")
+
+
+class FakeCollection:
+    """stream/where(==, >, …)/order_by/limit/select/start_after만 지원 (벤치마크 경로에서 쓰는 만큼)"""
+
+    OPERATORS = {'==': lambda a, b: a == b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+                 '<': lambda a, b: a < b, '<=': lambda a, b: a <= b}
+
+    def __init__(self, db, path, filters=(), order=None, descending=False, limit=None, fields=None, start_after=None):
+        self._db = db
+        self._path = path
+        self._filters = list(filters)
+        self._order = order
+        self._descending = descending
+        self._limit = limit
+        self._fields = fields
+        self._start_after = start_after
+
+    def _query(self, **changes):
+        options = dict(filters=self._filters, order=self._order, descending=self._descending,
+                       limit=self._limit, fields=self._fields, start_after=self._start_after)
+        options.update(changes)
+        return FakeCollection(self._db, self._path, **options)
+
+    def document(self, doc_id=None):
+        return FakeDocument(self._db, self._path, doc_id or os.urandom(10).hex())
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._query(filters=self._filters + [(field, self.OPERATORS[op], value)])
+
+    def order_by(self, field, direction=None):
+        return self._query(order=field, descending=direction == 'DESCENDING')
+
+    def limit(self, count):
+        return self._query(limit=count)
+
+    def select(self, fields):
+        return self._query(fields=list(fields))
+
+    def start_after(self, cursor):
+        """cursor는 문서 스냅샷 또는 {필드: 값} (문서 ID는 '__name__': 문서 참조)"""
+        if isinstance(cursor, FakeSnapshot):
+            doc_id, data = cursor.id, cursor._data or {}
+        else:
+            name = cursor.get('__name__')
+            doc_id, data = getattr(name, 'id', name), cursor
+        return self._query(start_after=self._sort_key(doc_id, data))
+
+    def _sort_key(self, doc_id, data):
+        if not self._order or self._order == '__name__':
+            return (doc_id,)
+        return (data.get(self._order), doc_id)
+
+    def stream(self):
+        if self._db.read_latency:
+            time.sleep(self._db.read_latency)
+        with self._db.lock:
+            rows = [
+                (doc_id, copy.deepcopy(data))
+                for doc_id, data in self._db.collections.get(self._path, {}).items()
+                if all(field in data and op(data[field], value) for field, op, value in self._filters)
+                and (self._order in (None, '__name__') or self._order in data)  # 정렬 필드가 없는 문서는 제외
+            ]
+        rows.sort(key=lambda row: self._sort_key(*row), reverse=self._descending)
+        if self._start_after is not None:
+            if self._descending:
+                rows = [row for row in rows if self._sort_key(*row) < self._start_after]
+            else:
+                rows = [row for row in rows if self._sort_key(*row) > self._start_after]
+        for doc_id, data in rows[:self._limit]:
+            self._db.reads += 1
+            if self._fields is not None:
+                data = {field: data[field] for field in self._fields if field in data}
+            yield FakeSnapshot(self.document(doc_id), data)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref, fields):
+        self._ops.append(lambda: ref.update(fields))
+
+    def delete(self, ref):
+        self._ops.append(ref.delete)
+
+    def commit(self):
+        for op in self._ops:
+            op()
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0, read_latency=0.0):
+        self.collections = {}
+        self.lock = threading.RLock()
+        self.latency = latency
+        self.read_latency = read_latency
+        self.reads = self.writes = 0
+        self.clients = 0  # firestore.client() 호출 수
+
+    def resolve(self, data):
+        from google.cloud.firestore_v1 import SERVER_TIMESTAMP
+        if self.latency:
+            time.sleep(self.latency)
+        now = datetime.now(timezone.utc)
+        return {key: now if value is SERVER_TIMESTAMP else copy.deepcopy(value) for key, value in data.items()}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def fake_send_each(latency):
+    def send_each(messages):
+        if latency:
+            time.sleep(latency)
+        ok = types.SimpleNamespace(success=True, exception=None)
+        return types.SimpleNamespace(responses=[ok] * len(messages))
+    return send_each
+
+
+def seed_subscriptions(db, count, prefix, changed_ratio=1.0, subs_per_invoice=1):
+    """구독 count건 추가, changed_ratio 비율만 스텁 상태와 다른 current_status로 둠"""
+    subscriptions = db.collections.setdefault('subscriptions', {})
+    subscriptions.clear()
+    changed = int(count * changed_ratio)
+    for i in range(count):
+        invoice = f"{prefix}{i // subs_per_invoice:08d}"
+        user_id = f"{prefix.lower()}-user-{i % SEED_USERS}-{i % subs_per_invoice}"
+        subscriptions[f"{user_id}_{invoice}"] = {
+            'invoice': invoice,
+            'user_id': user_id,
+            'token': f"token-{i}",
+            'carrier_id': 'kr.cjlogistics',
+            'status': '간선상차',
+            'current_status': '간선상차' if i < changed else STUB_STATUS,
+            'subscribed_at': datetime.now().isoformat(),
+            'alert_enabled': True,
+        }
+
+
+def seed_alert_messages(db, subscriptions, messages):
+    """SEED 구독 앞쪽 subscriptions건에 알림 메시지 messages건씩 추가 (messages/{doc}/items)"""
+    started = datetime.now(timezone.utc) - timedelta(days=1)
+    for k in range(subscriptions):
+        doc_id = f"seed-user-{k % SEED_USERS}-0_SEED{k:08d}"
+        items = db.collections.setdefault(f"messages/{doc_id}/items", {})
+        for j in range(messages):
+            created_at = started + timedelta(minutes=j)
+            items[f"m{j:06d}"] = {'body': f"송장번호 : SEED{k:08d} 메시지 {j}",
+                                  'timestamp': created_at.isoformat(), 'created_at': created_at}
+
+
+def import_app_with_fakes(env, options, log_path, db=None):
+    """가짜 Firestore/FCM을 끼운 뒤 app import, (app 모듈, 가짜 Firestore)"""
+    os.environ.update(env)
+    # JSON 로그(경고 포함)는 결과 출력과 섞이지 않도록 파일로
+    sys.stdout = open(log_path, 'a', encoding='utf-8', buffering=1)
+    logging.captureWarnings(True)
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore, messaging
+
+    if db is None:
+        db = FakeFirestore(options['firestore_latency'])
+
+    def client(*args, **kwargs):
+        db.clients += 1
+        return db
+
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    credentials.Certificate = lambda *args, **kwargs: None
+    firestore.client = client
+    messaging.send_each = fake_send_each(options['fcm_latency'])
+    if options.get('seed_subscriptions'):
+        seed_subscriptions(db, options['seed_subscriptions'], 'SEED', changed_ratio=0.0)
+        seed_alert_messages(db, min(options['seed_subscriptions'], SEED_MESSAGE_SUBSCRIPTIONS), SEED_MESSAGES)
+
+    import app
+    return app, db
+
+
+# ── 1) HTTP 부하 테스트 ──────────────────────────────────────────────
+
+def serve_app(env, options, log_path, port_queue):
+    app, _ = import_app_with_fakes(env, options, log_path)
+    app.start_runtime(wait=True)
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # keep-alive
+    WSGIRequestHandler.disable_nagle_algorithm = True
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    port_queue.put(server.server_port)
+    server.serve_forever()
+
+
+def request_body(endpoint, i, rng, tag, seed_count):
+    if endpoint == 'predict_arrival':
+        last_time = datetime.now() - timedelta(minutes=rng.randint(0, 2880))
+        carrier_id = rng.choice([key for key in MODEL_FILES if key != 'default'] + ['kr.cjlogistics'])
+        return {'status': rng.choice(PREDICT_STATUSES), 'last_time': last_time.isoformat(), 'carrier_id': carrier_id}
+    if endpoint == 'subscribe_alert':
+        return {'invoice': f"LOAD{tag}{i:08d}", 'user_id': f"load-user-{i % SEED_USERS}", 'token': f"token-{i}",
+                'carrier_id': 'kr.cjlogistics', 'status': '집화처리'}
+    if endpoint == 'toggle_alert':
+        k = rng.randrange(seed_count)
+        return {'invoice': f"SEED{k:08d}", 'user_id': f"seed-user-{k % SEED_USERS}-0", 'enabled': i % 2 == 0}
+    if endpoint == 'get_current_statuses':
+        return {'user_id': f"seed-user-{rng.randrange(SEED_USERS)}-0", 'limit': PAGE_LIMIT}
+    if endpoint == 'alert_messages':
+        k = rng.randrange(min(seed_count, SEED_MESSAGE_SUBSCRIPTIONS))
+        return {'invoice': f"SEED{k:08d}", 'user_id': f"seed-user-{k % SEED_USERS}-0", 'limit': PAGE_LIMIT}
+    return {
+        'invoice': f"DLV{tag}{i:08d}",
+        'carrier_id': 'kr.cjlogistics',
+        'lastEvent': {'status': {'name': '배송완료'}, 'time': datetime.now().astimezone().isoformat(),
+                      'description': '고객님의 상품이 배송완료 되었습니다.'},
+    }
+
+
+def summarize(latencies, errors, elapsed):
+    samples = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(float(np.percentile(samples, 50)), 2),
+        'p90_ms': round(float(np.percentile(samples, 90)), 2),
+        'p99_ms': round(float(np.percentile(samples, 99)), 2),
+        'max_ms': round(float(samples.max()), 2),
+    }
+
+
+def run_load(base_url, endpoint, concurrency, count, warmup, seed, seed_count):
+    local = threading.local()
+    rng = random.Random(f"{seed}:{endpoint}:{concurrency}")
+    tag = f"C{concurrency}-"
+    bodies = [request_body(endpoint, i, rng, tag, seed_count) for i in range(warmup + count)]
+    url = f"{base_url}/{endpoint}"
+
+    def send(body):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        if endpoint in GET_ENDPOINTS:
+            response = session.get(url, params=body, timeout=60)
+        else:
+            response = session.post(url, json=body, timeout=60)
+        return time.perf_counter() - started, response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, bodies[:warmup]))
+        started = time.perf_counter()
+        results = list(executor.map(send, bodies[warmup:]))
+        elapsed = time.perf_counter() - started
+    return summarize([latency for latency, _ in results], sum(1 for _, ok in results if not ok), elapsed)
+
+
+# ── 2) 배송 상태 체크(sweep) ─────────────────────────────────────────
+
+def run_sweeps(env, options, log_path, tracker_url, result_queue):
+    try:
+        app, db = import_app_with_fakes(env, options, log_path)
+        app.start_runtime(wait=True)
+        results = []
+        for size in options['sweep_sizes']:
+            seed_subscriptions(db, size, f"SW{size}-", options['changed_ratio'], options['subs_per_invoice'])
+            started = time.perf_counter()
+            app.load_subscriptions_from_firestore()
+            load_seconds = time.perf_counter() - started
+
+            before = requests.get(tracker_url, timeout=10).json()
+            writes = db.writes
+            started = time.perf_counter()
+            app.check_tracking_status()
+            sweep_seconds = time.perf_counter() - started
+            after = requests.get(tracker_url, timeout=10).json()
+
+            started = time.perf_counter()
+            app.notification_queue.drain(timeout=600)
+            app.save_subscriptions_to_file()
+            drain_seconds = time.perf_counter() - started
+
+            changed = sum(1 for sub in app.subscription_store.snapshot() if sub.current_status == STUB_STATUS)
+            results.append({
+                'subscriptions': size,
+                'invoices': -(-size // options['subs_per_invoice']),
+                'load_seconds': round(load_seconds, 3),
+                'sweep_seconds': round(sweep_seconds, 3),
+                'subscriptions_per_second': round(size / sweep_seconds, 1),
+                'fcm_drain_seconds': round(drain_seconds, 3),
+                'tracker_requests': after['graphql'] - before['graphql'],
+                'tracker_invoices': after['invoices'] - before['invoices'],
+                'firestore_writes': db.writes - writes,
+                'subscriptions_current': changed,
+            })
+        result_queue.put(results)
+    except BaseException as e:
+        result_queue.put(e)
+        raise
+
+
+# ── 실행 ────────────────────────────────────────────────────────────
+
+def start_process(context, target, *args):
+    port_queue = context.Queue()
+    process = context.Process(target=target, args=args + (port_queue,), daemon=True)
+    process.start()
+    return process, port_queue.get(timeout=120)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def parse_ints(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='API 부하 테스트 / 배송 상태 체크 벤치마크 (로컬 스텁 사용)')
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f'쉼표 구분, 빈 값이면 생략 ({",".join(ENDPOINTS)})')
+    parser.add_argument('--concurrency', default='1,16,64', help='동시 요청 수 목록')
+    parser.add_argument('--requests', type=int, default=2000, help='엔드포인트/동시성 조합마다 보낼 요청 수')
+    parser.add_argument('--warmup', type=int, default=50)
+    parser.add_argument('--seed-subscriptions', type=int, default=1000, help='toggle_alert/페이지 조회 대상으로 미리 넣어 둘 구독 수')
+    parser.add_argument('--sweep-sizes', default='1000,10000,100000', help='체크할 구독 수 목록, 빈 값이면 생략')
+    parser.add_argument('--changed-ratio', type=float, default=1.0, help='체크에서 상태가 바뀌는 구독 비율')
+    parser.add_argument('--subs-per-invoice', type=int, default=1, help='송장 하나를 구독한 사용자 수')
+    parser.add_argument('--query-batch-size', type=int, help='TRACKER_QUERY_BATCH_SIZE (기본: 서버 기본값)')
+    parser.add_argument('--poll-concurrency', type=int, help='TRACKER_POLL_CONCURRENCY (기본: 서버 기본값)')
+    parser.add_argument('--tracker-latency-ms', type=float, default=20.0)
+    parser.add_argument('--firestore-latency-ms', type=float, default=0.0, help='가짜 Firestore 쓰기마다 추가할 지연')
+    parser.add_argument('--fcm-latency-ms', type=float, default=50.0)
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR') or os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--log-level', default='INFO', help='서버 LOG_LEVEL')
+    parser.add_argument('--app-log', help='서버 로그 저장 경로 (기본: 버림)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_load.json', help='결과 JSON 저장 경로')
+    args = parser.parse_args()
+
+    endpoints = [e for e in args.endpoints.split(',') if e]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"알 수 없는 엔드포인트: {sorted(unknown)}")
+
+    context = multiprocessing.get_context('spawn')
+    work_dir = tempfile.mkdtemp(prefix='bench_load_')
+    log_path = args.app_log or os.devnull
+    tracker, tracker_port = start_process(context, serve_tracker, args.tracker_latency_ms / 1000)
+    tracker_url = f"http://127.0.0.1:{tracker_port}"
+
+    env = {
+        'FIREBASE_CREDENTIALS': '{}',
+        'TRACKER_CLIENT_ID': 'bench', 'TRACKER_CLIENT_SECRET': 'bench',
+        'TRACKER_AUTH_URL': f"{tracker_url}/oauth2/token",
+        'TRACKER_GRAPHQL_URL': f"{tracker_url}/graphql",
+        'SUBSCRIPTION_SYNC_MODE': 'poll',
+        'MODEL_DIR': args.model_dir,
+        'LOG_LEVEL': args.log_level,
+        'LOG_LEVELS': 'werkzeug=WARNING',
+        # 부하 테스트 중에는 스케줄러가 끼어들지 않도록 tick을 길게
+        'TRACKER_SCHEDULER_TICK_SECONDS': '86400',
+        'TRACKER_SWEEP_DEADLINE': '86400',
+    }
+    if args.query_batch_size:
+        env['TRACKER_QUERY_BATCH_SIZE'] = str(args.query_batch_size)
+    if args.poll_concurrency:
+        env['TRACKER_POLL_CONCURRENCY'] = str(args.poll_concurrency)
+    options = {
+        'firestore_latency': args.firestore_latency_ms / 1000,
+        'fcm_latency': args.fcm_latency_ms / 1000,
+        'changed_ratio': args.changed_ratio,
+        'subs_per_invoice': max(1, args.subs_per_invoice),
+        'sweep_sizes': parse_ints(args.sweep_sizes),
+    }
+
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args),
+        'http': {},
+        'sweeps': [],
+    }
+    try:
+        if endpoints:
+            server_env = dict(env, POLLER_MODE='off', DELIVERY_DATA_DIR=os.path.join(work_dir, 'http'))
+            server_options = dict(options, seed_subscriptions=max(1, args.seed_subscriptions))
+            server, port = start_process(context, serve_app, server_env, server_options, log_path)
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                for endpoint in endpoints:
+                    results['http'][endpoint] = {}
+                    for concurrency in parse_ints(args.concurrency):
+                        summary = run_load(base_url, endpoint, concurrency, args.requests, args.warmup,
+                                           args.seed, server_options['seed_subscriptions'])
+                        results['http'][endpoint][str(concurrency)] = summary
+                        print(f"🌐 /{endpoint:<16} 동시 {concurrency:>3}: {summary['rps']:>8.1f} req/s, "
+                              f"p50 {summary['p50_ms']:.2f}ms, p99 {summary['p99_ms']:.2f}ms, 오류 {summary['errors']}")
+            finally:
+                server.terminate()
+
+        if options['sweep_sizes']:
+            sweep_env = dict(env, POLLER_MODE='all', DELIVERY_DATA_DIR=os.path.join(work_dir, 'sweep'))
+            result_queue = context.Queue()
+            sweeper = context.Process(target=run_sweeps, args=(sweep_env, options, log_path, tracker_url, result_queue),
+                                      daemon=True)
+            sweeper.start()
+            sweeps = result_queue.get()
+            sweeper.join(timeout=30)
+            if isinstance(sweeps, BaseException):
+                raise sweeps
+            results['sweeps'] = sweeps
+            for sweep in sweeps:
+                print(f"🧠 구독 {sweep['subscriptions']:>7}건 체크: {sweep['sweep_seconds']:.2f}초 "
+                      f"({sweep['subscriptions_per_second']:.0f}건/초, tracker 요청 {sweep['tracker_requests']}회, "
+                      f"로드 {sweep['load_seconds']:.2f}초, 알림 전송 마무리 {sweep['fcm_drain_seconds']:.2f}초)")
+    finally:
+        tracker.terminate()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 결과 저장: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""상태 정규화 동등성 확인 + 마이크로벤치마크
+
+예전 normalize_status(그룹마다 any(kw in status))와 컴파일한 정규식 방식의 결과가
+키워드 조합/대소문자/공백/임의 문자열에서 모두 같은지 확인한 뒤 호출 시간을 비교한다.
+
+    python benchmark_normalize.py --repeat 200000
+"""
+import argparse
+import itertools
+import random
+import timeit
+
+from status_normalizer import STATUS_KEYWORDS, StatusMatcher, _normalize, normalize_status
+
+
+def legacy_normalize_status(status):
+    """예전 구현 (비교 기준)"""
+    status = status.lower().strip()
+    mapping_keywords = {
+        '배송완료': ['배송완료', '배달완료', 'delivered'],
+        '배송출발': ['배송출발', '배달출발', 'out for delivery'],
+        '간선상차': ['간선상차', '캠프상차', '터미널상차', '상차'],
+        '간선하차': ['간선하차', '캠프도착', '터미널하차', '하차'],
+        '집화처리': ['접수', '인수', '소터분류', '운송장출력', '수거', '집하', '수집'],
+        'sm 입고': ['입고', '센터입고'],
+    }
+    for norm_status, keywords in mapping_keywords.items():
+        if any(kw in status for kw in keywords):
+            return norm_status
+    return status
+
+
+# tracker.delivery가 실제로 돌려주는 형태의 상태 이름
+SAMPLE_STATUSES = [
+    '집화처리', '간선상차', '간선하차', '배송출발', '배송완료', '배달완료', '캠프상차', '캠프도착',
+    '터미널상차', '터미널하차', 'SM 입고', '센터입고', '운송장출력', '접수', '인수', '소터분류',
+    'Delivered', 'Out for Delivery', '배달출발', '상품인수', '집하완료', '간선 상차', '미배달', '보관',
+]
+
+
+def build_corpus(seed):
+    keywords = [kw for group in STATUS_KEYWORDS.values() for kw in group]
+    corpus = set(SAMPLE_STATUSES) | set(keywords)
+    # 서로 다른 키워드 두 개를 앞뒤로 붙여 우선순위 확인
+    for a, b in itertools.permutations(keywords, 2):
+        corpus.update({a + b, f'{a} {b}', f'[{a}] {b.upper()}', a[:-1] + b})
+    rng = random.Random(seed)
+    alphabet = ''.join(set(''.join(keywords))) + ' ABCxyz'
+    for _ in range(20000):
+        corpus.add(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 12))))
+    corpus.update(f'  {s}\t' for s in list(corpus)[:2000])
+    return sorted(corpus)
+
+
+def check_equivalence(corpus):
+    matcher = StatusMatcher(STATUS_KEYWORDS)
+    mismatches = []
+    for status in corpus:
+        expected = legacy_normalize_status(status)
+        compiled = matcher.match(status.lower().strip()) or status.lower().strip()
+        if compiled != expected or normalize_status(status) != expected:
+            mismatches.append((status, expected, compiled))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='상태 정규화 동등성 확인/벤치마크')
+    parser.add_argument('--repeat', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.seed)
+    mismatches = check_equivalence(corpus)
+    print(f"🔍 동등성 확인: {len(corpus)}건 중 불일치 {len(mismatches)}건")
+    for status, expected, compiled in mismatches[:20]:
+        print(f"  ❗ {status!r}: 예전 {expected!r} / 새 {compiled!r}")
+
+    # 실제 분포처럼 적은 종류의 상태 이름이 반복되는 입력
+    rng = random.Random(args.seed)
+    workload = [rng.choice(SAMPLE_STATUSES) for _ in range(args.repeat)]
+    uncached = _normalize.__wrapped__
+
+    results = {
+        'legacy': timeit.timeit(lambda: [legacy_normalize_status(s) for s in workload], number=1),
+        'compiled (캐시 없음)': timeit.timeit(lambda: [uncached(s, None) for s in workload], number=1),
+        'compiled + LRU': timeit.timeit(lambda: [normalize_status(s) for s in workload], number=1),
+    }
+    for name, seconds in results.items():
+        print(f"⏱️ {name:<20} {seconds / args.repeat * 1e9:8.0f} ns/호출")
+    print(f"📊 캐시 {_normalize.cache_info()}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""서버 시작 시간 벤치마크
+
+benchmark_load.py의 가짜 Firestore/FCM에 구독 N건을 넣고 새 인터프리터에서 app을 띄워 잰다.
+- import         : `import app`이 끝날 때까지 (gunicorn이 워커에 앱을 넘겨받는 시점)
+- first_response : 첫 GET /test 응답까지
+- ready          : 모델/구독 로드와 스케줄러 시작이 끝날 때까지 (start_runtime(wait=True))
+
+--workers를 주면 gunicorn --preload(gunicorn.conf.py)처럼 한 프로세스에서 import/모델 로드 후
+워커를 fork해 각 워커의 응답/준비 시간과 Firestore 클라이언트 생성 횟수를 함께 기록한다.
+(마스터에서 클라이언트를 만들면 fork 후 gRPC 채널을 쓸 수 없으므로 0이어야 함)
+
+    python benchmark_startup.py --subscriptions 0,10000,100000 --workers 4 --output bench_startup.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmark_load import FakeFirestore, git_revision, import_app_with_fakes, parse_ints, seed_subscriptions
+
+
+def start_and_measure(app, db, started):
+    """(첫 응답까지 초, 준비 완료까지 초, 읽은 문서 수, 클라이언트 생성 수) 측정 결과"""
+    start_runtime = getattr(app, 'start_runtime', None)
+    if start_runtime is not None:
+        start_runtime()
+    response = app.app.test_client().get('/test')
+    first_response = time.perf_counter() - started
+    if start_runtime is not None:
+        start_runtime(wait=True)
+    return {
+        'first_response_seconds': round(first_response, 3),
+        'ready_seconds': round(time.perf_counter() - started, 3),
+        'status_code': response.status_code,
+        'firestore_reads': db.reads,
+        'firestore_clients': db.clients,
+        'subscriptions_loaded': len(app.subscription_store),
+    }
+
+
+def measure_worker(env, options, log_path, result_queue):
+    """preload 없이 워커 하나가 app을 import해 준비될 때까지"""
+    try:
+        db = FakeFirestore(read_latency=options['read_latency'])
+        seed_subscriptions(db, options['subscriptions'], 'START', changed_ratio=0.0)
+        started = time.perf_counter()
+        app, _ = import_app_with_fakes(env, options, log_path, db)
+        import_seconds = time.perf_counter() - started
+        result = dict(start_and_measure(app, db, started), import_seconds=round(import_seconds, 3))
+        result_queue.put(result)
+    except BaseException as e:
+        result_queue.put(e)
+        raise
+
+
+def measure_preload(env, options, log_path, result_queue):
+    """preload_app처럼 마스터에서 import(모델 로드) 후 워커를 fork"""
+    try:
+        db = FakeFirestore(read_latency=options['read_latency'])
+        seed_subscriptions(db, options['subscriptions'], 'START', changed_ratio=0.0)
+        started = time.perf_counter()
+        app, _ = import_app_with_fakes(dict(env, APP_AUTOSTART='0'), options, log_path, db)
+        app.model_registry.preload()  # gunicorn.conf.py pre_fork와 같게
+        master = {
+            'import_seconds': round(time.perf_counter() - started, 3),
+            'firestore_reads': db.reads,
+            'firestore_clients': db.clients,
+        }
+
+        gc.freeze()
+        children = []
+        for _ in range(options['workers']):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                code = 0
+                try:
+                    result = start_and_measure(app, db, time.perf_counter())
+                except BaseException as e:
+                    result, code = {'error': repr(e)}, 1
+                with os.fdopen(write_fd, 'w') as f:
+                    json.dump(result, f)
+                os._exit(code)
+            os.close(write_fd)
+            children.append((pid, read_fd))
+
+        workers = []
+        for pid, read_fd in children:
+            with os.fdopen(read_fd) as f:
+                workers.append(json.loads(f.read() or '{"error": "no result"}'))
+            os.waitpid(pid, 0)
+        result_queue.put({'master': master, 'workers': workers})
+    except BaseException as e:
+        result_queue.put(e)
+        raise
+
+
+def run_in_process(context, target, *args):
+    result_queue = context.Queue()
+    process = context.Process(target=target, args=args + (result_queue,), daemon=False)
+    process.start()
+    result = result_queue.get(timeout=600)
+    process.join(timeout=60)
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='서버 시작 시간 벤치마크 (가짜 Firestore 사용)')
+    parser.add_argument('--subscriptions', default='0,10000,100000', help='Firestore에 넣어 둘 구독 수 목록')
+    parser.add_argument('--workers', type=int, default=4, help='preload 측정에서 fork할 워커 수, 0이면 생략')
+    parser.add_argument('--repeat', type=int, default=3, help='구독 수마다 반복 횟수 (중앙값 사용)')
+    parser.add_argument('--read-latency-ms', type=float, default=50.0, help='가짜 Firestore 조회(stream) 한 번의 지연')
+    parser.add_argument('--sync-mode', default='poll', help='SUBSCRIPTION_SYNC_MODE (가짜 Firestore는 poll만 지원)')
+    parser.add_argument('--poller-mode', default='all', help='POLLER_MODE')
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR') or os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--app-log', help='서버 로그 저장 경로 (기본: 버림)')
+    parser.add_argument('--output', default='bench_startup.json', help='결과 JSON 저장 경로')
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    log_path = args.app_log or os.devnull
+    env = {
+        'FIREBASE_CREDENTIALS': '{}',
+        'TRACKER_CLIENT_ID': 'bench', 'TRACKER_CLIENT_SECRET': 'bench',
+        # 시작 중 조회가 끼어들지 않도록 tick을 길게, 외부로 나가지 않도록 로컬 주소
+        'TRACKER_AUTH_URL': 'http://127.0.0.1:9/oauth2/token',
+        'TRACKER_GRAPHQL_URL': 'http://127.0.0.1:9/graphql',
+        'TRACKER_SCHEDULER_TICK_SECONDS': '86400',
+        'SUBSCRIPTION_SYNC_MODE': args.sync_mode,
+        'POLLER_MODE': args.poller_mode,
+        'MODEL_DIR': args.model_dir,
+        'LOG_LEVEL': 'INFO',
+    }
+
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args),
+        'worker': [],
+        'preload': [],
+    }
+    try:
+        for count in parse_ints(args.subscriptions):
+            options = {'subscriptions': count, 'read_latency': args.read_latency_ms / 1000,
+                       'workers': args.workers, 'firestore_latency': 0.0, 'fcm_latency': 0.0}
+            runs = []
+            for i in range(args.repeat):
+                run_env = dict(env, DELIVERY_DATA_DIR=os.path.join(work_dir, f"worker-{count}-{i}"))
+                runs.append(run_in_process(context, measure_worker, run_env, options, log_path))
+            runs.sort(key=lambda run: run['ready_seconds'])
+            median = dict(runs[len(runs) // 2], subscriptions=count)
+            results['worker'].append(median)
+            print(f"🚀 구독 {count:>7}건, 워커 단독: import {median['import_seconds']:.2f}초, "
+                  f"첫 응답 {median['first_response_seconds']:.2f}초, 준비 완료 {median['ready_seconds']:.2f}초 "
+                  f"(문서 {median['firestore_reads']}건 조회)")
+
+            if args.workers:
+                run_env = dict(env, DELIVERY_DATA_DIR=os.path.join(work_dir, f"preload-{count}"))
+                preload = dict(run_in_process(context, measure_preload, run_env, options, log_path),
+                               subscriptions=count)
+                results['preload'].append(preload)
+                workers = preload['workers']
+                ready = [w['ready_seconds'] for w in workers if 'ready_seconds' in w]
+                first = [w['first_response_seconds'] for w in workers if 'first_response_seconds' in w]
+                print(f"🍴 구독 {count:>7}건, preload + 워커 {len(workers)}개: 마스터 import "
+                      f"{preload['master']['import_seconds']:.2f}초 (클라이언트 {preload['master']['firestore_clients']}개), "
+                      f"워커 첫 응답 최대 {max(first, default=0):.2f}초, 준비 완료 최대 {max(ready, default=0):.2f}초, "
+                      f"오류 {sum(1 for w in workers if 'error' in w)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 결과 저장: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""배송 소요시간 예측 테이블 (서버와 학습/벤치마크 스크립트가 함께 사용)
+
+- 기본 모델: 상태 코드 하나 → 예측 소요시간(분), 로드 시점에 코드별 결과를 모두 계산해 둠
+- 특성 테이블: (상태 코드, 이벤트 시각, 요일, 현재 상태 체류시간 구간) → 예측 소요시간(분)
+  + 상태별 실제-예측 오차 분위수, 5일 도착 확률 그래프 계산에 사용
+"""
+import hashlib
+import json
+import os
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+# 📦 운송사별 (모델, 상태 매핑, 특성 테이블) 파일, 등록되지 않은 운송사는 기본 모델 사용
+# 특성 테이블 파일은 없어도 되며, 없으면 상태 코드만으로 예측
+MODEL_FILES = {
+    'kr.coupangls': ('arrival_predictor_coupangls.pkl', 'status_mapping_coupangls.pkl', 'eta_table_coupangls.pkl'),
+    'kr.epost': ('arrival_predictor_epost.pkl', 'status_mapping_epost.pkl', 'eta_table_epost.pkl'),
+    'kr.hanjin': ('arrival_predictor_hanjin.pkl', 'status_mapping_hanjin.pkl', 'eta_table_hanjin.pkl'),
+    'default': ('arrival_predictor.pkl', 'status_mapping.pkl', 'eta_table.pkl'),
+}
+
+# 🧾 설치 중인 모델 버전 기록 (model-dir), 서버는 파일 내용이 이 버전과 같을 때만 로드
+# train_models.py --install이 파일을 바꾸기 전에 새 버전을 먼저 기록하므로 교체 도중의 섞인 조합은 로드하지 않음
+MODEL_MANIFEST_FILE = 'model_manifest.json'
+
+
+def model_files_version(model_bytes, mapping_bytes, features_bytes=b''):
+    """모델/매핑/특성 테이블 파일 내용 버전 (서버 레지스트리와 설치 스크립트가 같은 방식으로 계산)"""
+    return hashlib.sha256(model_bytes + mapping_bytes + features_bytes).hexdigest()[:12]
+
+
+def load_model_manifest(model_dir):
+    """운송사 키 → {'version', 'installed_at'}, 파일이 없으면 빈 dict"""
+    path = os.path.join(model_dir, MODEL_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_model_manifest(model_dir, manifest):
+    tmp_path = os.path.join(model_dir, f'.{MODEL_MANIFEST_FILE}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(model_dir, MODEL_MANIFEST_FILE))
+
+
+# ⏱️ 현재 상태 체류시간 구간 경계(분), 구간 k = [edges[k], edges[k+1])
+DWELL_BUCKET_EDGES = np.array([0, 30, 60, 120, 240, 480, 720, 1440, 2880, 4320], dtype=np.float64)
+# 오차 분위수 (1% ~ 99%), 5일 확률은 분위수 점들이 각 날짜에 떨어지는 비율
+RESIDUAL_QUANTILE_LEVELS = np.linspace(0.01, 0.99, 99)
+# 칸별 평균을 쓰기 위한 최소 표본 수, 부족하면 더 넓은 묶음으로 대체
+FEATURE_MIN_SAMPLES = 5
+RESIDUAL_MIN_SAMPLES = 30
+FEATURE_TABLE_FORMAT = 1
+# 🕘 이벤트 시각 기준 시간대 (배송 조회 API 시각은 한국 시간), 시각/요일 특성과 체류시간 계산에 사용
+EVENT_TIMEZONE = ZoneInfo('Asia/Seoul')
+
+
+def compile_eta_table(model, status_map):
+    """상태 코드 → 예측 소요시간(분) 테이블 생성
+
+    모델 입력은 상태 코드 하나뿐이므로 가능한 출력을 로드 시점에 모두 계산해 둔다.
+    인덱스는 code + 1 (알 수 없는 상태 코드 -1 → 0번)
+    """
+    max_code = max(status_map.values(), default=-1)
+    codes = np.arange(-1, max_code + 1)
+    # 단건 predict 결과와의 일치 여부는 benchmark_eta_table.py로 확인
+    return model.predict(codes.reshape(-1, 1)).astype(np.float64)
+
+
+def to_event_time(t):
+    """시간대가 없는 시각은 한국 시간으로 보고, 있으면 한국 시간으로 변환"""
+    if t.tzinfo is None:
+        return t.replace(tzinfo=EVENT_TIMEZONE)
+    return t.astimezone(EVENT_TIMEZONE)
+
+
+def dwell_buckets(dwell_minutes):
+    buckets = np.searchsorted(DWELL_BUCKET_EDGES, dwell_minutes, side='right') - 1
+    return np.clip(buckets, 0, len(DWELL_BUCKET_EDGES) - 1)
+
+
+def build_feature_table(codes, hours, weekdays, gaps, minutes, eta_table):
+    """학습 데이터로 특성 테이블 생성
+
+    codes/hours/weekdays : 상태 이벤트의 상태 코드, 시각(0~23), 요일(월=0)
+    gaps : 다음 이벤트까지 걸린 분 (그 상태에 머문 시간)
+    minutes : 이벤트부터 배송완료까지 걸린 분
+    eta_table : 기본 모델의 상태 코드별 예측, 표본이 없는 칸에 사용
+
+    체류 구간 k의 표본은 그 상태에 edges[k]분 이상 머문 이벤트만 사용한다.
+    """
+    codes = np.asarray(codes, dtype=np.int64) + 1
+    hours = np.asarray(hours, dtype=np.int64)
+    weekdays = np.asarray(weekdays, dtype=np.int64)
+    gaps = np.asarray(gaps, dtype=np.float64)
+    minutes = np.asarray(minutes, dtype=np.float64)
+    n_codes = len(eta_table)
+    n_buckets = len(DWELL_BUCKET_EDGES)
+    shape = (n_codes, 24, 7, n_buckets)
+
+    # 이벤트 × 체류 구간 표본 펼치기
+    survived = DWELL_BUCKET_EDGES[None, :] < gaps[:, None]
+    survived[:, 0] = True
+    rows, buckets = np.nonzero(survived)
+    index = (codes[rows], hours[rows], weekdays[rows], buckets)
+
+    sums = np.zeros(shape)
+    counts = np.zeros(shape)
+    np.add.at(sums, index, minutes[rows])
+    np.add.at(counts, index, 1)
+
+    # 칸 → (상태, 요일, 구간) → (상태, 시각, 구간) → (상태, 구간) → 기본 모델 순으로 대체
+    fallback = np.maximum(np.asarray(eta_table, dtype=np.float64)[:, None, None, None], DWELL_BUCKET_EDGES)
+    table = np.broadcast_to(fallback, shape).copy()
+    filled = np.zeros(shape, dtype=bool)
+    for axes in ((), (1,), (2,), (1, 2)):
+        level_sums = np.broadcast_to(sums.sum(axis=axes, keepdims=True), shape)
+        level_counts = np.broadcast_to(counts.sum(axis=axes, keepdims=True), shape)
+        use = ~filled & (level_counts >= FEATURE_MIN_SAMPLES)
+        table[use] = level_sums[use] / level_counts[use]
+        filled |= use
+
+    # 상태별 실제-예측 오차 분위수, 표본이 부족한 상태는 NaN (고정 가중치 사용)
+    residuals = minutes[rows] - table[index]
+    residual_quantiles = np.full((n_codes, len(RESIDUAL_QUANTILE_LEVELS)), np.nan)
+    order = np.argsort(index[0], kind='stable')
+    sorted_codes = index[0][order]
+    for code in np.unique(sorted_codes):
+        start, end = np.searchsorted(sorted_codes, [code, code + 1])
+        if end - start >= RESIDUAL_MIN_SAMPLES:
+            residual_quantiles[code] = np.quantile(residuals[order[start:end]], RESIDUAL_QUANTILE_LEVELS)
+
+    return {
+        'format': FEATURE_TABLE_FORMAT,
+        'dwell_edges': DWELL_BUCKET_EDGES.copy(),
+        'minutes': table,
+        'residual_quantiles': residual_quantiles,
+    }
+
+
+def validate_feature_table(features, eta_table):
+    if features.get('format') != FEATURE_TABLE_FORMAT:
+        raise ValueError(f"지원하지 않는 특성 테이블 형식: {features.get('format')}")
+    if not np.array_equal(features['dwell_edges'], DWELL_BUCKET_EDGES):
+        raise ValueError("특성 테이블의 체류 구간이 서버 설정과 다릅니다.")
+    expected = (len(eta_table), 24, 7, len(DWELL_BUCKET_EDGES))
+    if features['minutes'].shape != expected:
+        raise ValueError(f"특성 테이블 크기 불일치: {features['minutes'].shape} != {expected}")
+
+
+def predict_eta(entry, statuses, last_times, now):
+    """여러 건의 예측 소요시간(분, last_time 기준)과 상태별 오차 분위수 계산
+
+    now : 현재 시각(timestamp), last_time부터 지금까지를 현재 상태 체류시간으로 사용
+    last_times : 이벤트 시각, 시간대가 없으면 한국 시간으로 봄
+
+    특성 테이블이 있으면 이벤트 시각/요일/체류시간을 함께 사용하고, 없으면 상태 코드만 사용.
+    오차 분위수가 없는 항목은 None.
+    """
+    status_map = entry['status_map']
+    codes = np.array([status_map.get(status, -1) for status in statuses], dtype=np.int64) + 1
+    features = entry.get('features')
+    if features is None:
+        return entry['eta_table'][codes], [None] * len(codes)
+
+    last_times = [to_event_time(t) for t in last_times]
+    hours = np.array([t.hour for t in last_times], dtype=np.int64)
+    weekdays = np.array([t.weekday() for t in last_times], dtype=np.int64)
+    dwell = np.maximum((now - np.array([t.timestamp() for t in last_times], dtype=np.float64)) / 60, 0.0)
+    minutes = features['minutes'][codes, hours, weekdays, dwell_buckets(dwell)]
+    # 이미 예측보다 오래 머문 경우 지금 도착하는 것으로 봄
+    minutes = np.maximum(minutes, dwell)
+
+    quantiles = features['residual_quantiles'][codes]
+    residuals = [None if np.isnan(row[0]) else row for row in quantiles]
+    return minutes, residuals
+
+
+# 📈 도착 예정일 기준 5일(-1일 ~ +3일) 확률 가중치 (오차 분위수가 없는 상태에 사용)
+ARRIVAL_WEIGHT_MAP = {
+    '집화처리': [0.05, 0.65, 0.20, 0.07, 0.03],
+    '간선상차': [0.10, 0.60, 0.15, 0.10, 0.05],
+    '간선하차': [0.15, 0.50, 0.20, 0.10, 0.05],
+    '배송출발': [0.20, 0.65, 0.10, 0.03, 0.02],
+    'sm 입고': [0.07, 0.65, 0.20, 0.05, 0.03]
+}
+DEFAULT_ARRIVAL_WEIGHTS = [0.1, 0.5, 0.2, 0.15, 0.05]
+ARRIVAL_GRAPH_OFFSETS = np.arange(-1, 4)
+
+def build_arrival_graphs(arrival_times, statuses, residuals=None):
+    """여러 건의 도착 예상 시각으로 5일 날짜/확률 그래프를 한 번에 계산
+
+    residuals[i]가 있으면 도착 예상 시각 + 오차 분위수 점들이 각 날짜에 떨어지는 비율을 확률로 사용
+    (일요일에 떨어진 점은 다음 날로 넘김), 없으면 상태별 고정 가중치 사용
+    """
+    base_dates = np.array([t.date() for t in arrival_times], dtype='datetime64[D]')
+    # 🔔 일요일이면 하루 추가 (1970-01-01은 목요일 → weekday 3)
+    base_weekdays = (base_dates.astype(np.int64) + 3) % 7
+    base_dates = base_dates + (base_weekdays == 6)
+
+    graph_dates = base_dates[:, None] + ARRIVAL_GRAPH_OFFSETS
+    weekdays = (graph_dates.astype(np.int64) + 3) % 7
+    weights = np.array([ARRIVAL_WEIGHT_MAP.get(s, DEFAULT_ARRIVAL_WEIGHTS) for s in statuses], dtype=np.float64)
+
+    if residuals is not None:
+        rows = [i for i, r in enumerate(residuals) if r is not None]
+        if rows:
+            times = [arrival_times[i] for i in rows]
+            minute_of_day = np.array([t.hour * 60 + t.minute + t.second / 60 for t in times])
+            quantiles = np.array([residuals[i] for i in rows])
+            # 예상 도착일 기준 날짜 차이
+            day_offsets = np.floor((minute_of_day[:, None] + quantiles) / 1440).astype(np.int64)
+            sample_dates = np.array([t.date() for t in times], dtype='datetime64[D]')[:, None] + day_offsets
+            sample_dates = sample_dates + (((sample_dates.astype(np.int64) + 3) % 7) == 6)
+            positions = (sample_dates - graph_dates[rows, :1]).astype(np.int64)
+            counts = np.stack([(positions == k).sum(axis=1) for k in range(len(ARRIVAL_GRAPH_OFFSETS))], axis=1)
+            weights[rows] = counts / quantiles.shape[1]
+
+    probabilities = np.where(weekdays == 6, 0.0, np.round(weights, 4))
+    return graph_dates.astype(str).tolist(), probabilities.tolist()
@@ -0,0 +1,45 @@
+"""gunicorn 설정 (실행 디렉터리의 gunicorn.conf.py는 자동으로 읽힘)
+
+PROMETHEUS_MULTIPROC_DIR을 지정하면 워커별 지표 파일을 그 디렉터리에 기록하므로
+시작할 때 지난 실행의 파일을 지우고, 워커가 종료되면 그 워커의 게이지 값을 정리한다.
+
+app.py는 import할 때 백그라운드 작업(알림 전송/구독 로드/스케줄러)을 시작하지 않고
+워커마다 post_worker_init에서 시작한다. --preload(또는 APP_PRELOAD=1)이면 마스터가
+fork 전에 모델을 로드해 워커들이 copy-on-write로 함께 쓴다.
+
+    gunicorn -w 4 --preload app:app
+"""
+import gc
+import glob
+import os
+
+# app.py보다 먼저 읽히므로 여기서 설정해 두면 --preload로 마스터에서 import해도 작업을 띄우지 않음
+os.environ["APP_AUTOSTART"] = "0"
+
+preload_app = os.environ.get("APP_PRELOAD", "").lower() in ('1', 'true', 'yes')
+
+
+def on_starting(server):
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if multiproc_dir:
+        os.makedirs(multiproc_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+            os.remove(path)
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        import app
+        app.model_registry.preload()  # 이미 로드했으면 파일 변경 여부만 확인
+        # 로드한 모델 객체를 GC가 건드리지 않게 해 워커와 공유하는 메모리 페이지가 복사되지 않도록 함
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    import app
+    app.start_runtime()
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,107 @@
+"""JSON 구조화 로그 설정 (서버/폴러가 함께 사용)
+
+로그 호출은 레코드를 큐에 넣고 바로 반환하며, 포맷/출력은 백그라운드 스레드(QueueListener)가 맡는다.
+
+- LOG_LEVEL  : 기본 레벨 (기본 INFO)
+- LOG_LEVELS : 로거별 레벨, 예) "app.tracker=DEBUG,app.api=WARNING,apscheduler=WARNING"
+- LOG_FORMAT : json(기본) 또는 text (로컬 개발용)
+
+디버그용 큰 출력은 lazy()로 감싸 두면 그 레벨이 꺼져 있을 때 계산하지 않는다.
+
+    log.debug("status_map keys: %s", lazy(lambda: list(status_map)))
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+from pythonjsonlogger.json import JsonFormatter
+
+LOG_RECORD_FIELDS = '%(asctime)s %(levelname)s %(name)s %(process)d %(threadName)s %(message)s'
+# 스케줄러 tick마다 나오는 작업 실행 로그 등은 기본으로 숨김
+DEFAULT_LOG_LEVELS = {'apscheduler': 'WARNING', 'urllib3': 'WARNING'}
+
+_listener = None
+
+
+class lazy:
+    """로그 메시지로 실제 출력될 때만 fn()을 계산"""
+
+    __slots__ = ('_fn',)
+
+    def __init__(self, fn):
+        self._fn = fn
+
+    def __str__(self):
+        return str(self._fn())
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """호출한 스레드에서는 메시지 문자열만 만들고, JSON 포맷은 리스너 스레드에서 처리
+
+    기본 QueueHandler.prepare는 예외 traceback까지 메시지에 붙여 버리므로
+    exc_text로 따로 넘겨 JSON의 exc_info 필드로 나가게 한다.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_levels(spec):
+    """LOG_LEVELS 문자열 → {로거 이름: 레벨}, 지정하지 않은 라이브러리 로거는 DEFAULT_LOG_LEVELS"""
+    levels = dict(DEFAULT_LOG_LEVELS)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, level = item.partition('=')
+        if not level:
+            raise ValueError(f"잘못된 LOG_LEVELS 항목: {item}")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _stop_listener():
+    # fork 전에 큐를 비워 두어야 자식이 같은 로그를 다시 출력하지 않음
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def _start_listener():
+    # fork된 자식(gunicorn preload)에는 리스너 스레드가 없으므로 새로 띄움
+    if _listener is not None and _listener._thread is None:
+        _listener.start()
+
+
+def configure_logging():
+    """루트 로거를 큐 핸들러 하나로 설정 (여러 번 호출해도 한 번만 적용)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "json").lower() == 'text':
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s'))
+    else:
+        output.setFormatter(JsonFormatter(LOG_RECORD_FIELDS, json_ensure_ascii=False))
+
+    log_queue = queue.SimpleQueue()  # 크기 제한 없음, put이 막히지 않음
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_NonBlockingQueueHandler(log_queue))
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    for name, level in parse_levels(os.environ.get("LOG_LEVELS")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_stop_listener)  # 종료 전 큐에 남은 로그 출력
+    os.register_at_fork(before=_stop_listener, after_in_parent=_start_listener, after_in_child=_start_listener)
@@ -0,0 +1,106 @@
+"""Prometheus 지표 정의 (서버/폴러가 함께 사용)
+
+gunicorn 워커 여러 개로 띄울 때는 PROMETHEUS_MULTIPROC_DIR(빈 디렉터리)을 지정해야
+/metrics가 모든 워커의 값을 합쳐서 보여 준다. 환경변수는 prometheus_client를 import하기
+전에 설정되어 있어야 하며, 종료된 워커 정리는 gunicorn.conf.py의 child_exit에서 처리.
+
+    PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus gunicorn -w 4 app:app
+"""
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    start_http_server
+)
+
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# ⏱️ 구간 경계(초)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SWEEP_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'API 요청 처리 시간', ['endpoint', 'method', 'status'],
+    buckets=REQUEST_BUCKETS,
+)
+MODEL_LOAD_SECONDS = Histogram(
+    'model_load_duration_seconds', '모델/매핑/특성 테이블 로드 시간', ['carrier'], buckets=SWEEP_BUCKETS,
+)
+MODEL_PREDICT_SECONDS = Histogram(
+    'model_predict_duration_seconds', 'predict_eta 한 번 호출 시간', ['carrier'], buckets=FAST_BUCKETS,
+)
+MODEL_PREDICTIONS = Counter('model_predictions_total', '예측한 건수', ['carrier'])
+TRACKER_REQUEST_SECONDS = Histogram(
+    'tracker_request_duration_seconds', 'tracker.delivery 배송 조회 요청 시간', ['carrier', 'outcome'],
+    buckets=REQUEST_BUCKETS,
+)
+FIRESTORE_OPERATION_SECONDS = Histogram(
+    'firestore_operation_duration_seconds', 'Firestore 호출 시간', ['operation', 'kind'], buckets=REQUEST_BUCKETS,
+)
+FIRESTORE_DOCUMENTS = Counter('firestore_documents_total', 'Firestore에서 읽고 쓴 문서 수', ['operation', 'kind'])
+FIRESTORE_ERRORS = Counter('firestore_errors_total', 'Firestore 호출 실패 수', ['operation', 'kind'])
+FCM_SEND_SECONDS = Histogram('fcm_send_duration_seconds', 'FCM send_each 한 번 호출 시간', buckets=REQUEST_BUCKETS)
+FCM_MESSAGES = Counter('fcm_messages_total', 'FCM 알림 처리 결과별 건수', ['outcome'])
+SWEEP_SECONDS = Histogram('tracking_sweep_duration_seconds', '배송 상태 체크 한 번 소요 시간', buckets=SWEEP_BUCKETS)
+SWEEP_SUBSCRIPTIONS = Counter('tracking_sweep_subscriptions_total', '체크한 구독 수', ['outcome'])
+
+# 게이지는 워커마다 값이 따로 있으므로 합치는 방식을 지정 (live* = 살아 있는 워커만)
+SUBSCRIPTIONS = Gauge('subscriptions', '메모리에 로드된 구독 수', multiprocess_mode='livemax')
+POLLER_ACTIVE = Gauge('poller_active', '배송 상태 조회를 맡고 있는 프로세스 수', multiprocess_mode='livesum')
+POLLER_OWNED = Gauge('poller_owned_subscriptions', '이 프로세스가 조회를 맡은 구독 수', multiprocess_mode='livesum')
+POLLER_DUE = Gauge('poller_due_subscriptions', '조회 시각이 지났지만 아직 조회하지 않은 구독 수', multiprocess_mode='livesum')
+POLLER_LAG_SECONDS = Gauge('poller_lag_seconds', '가장 오래 밀린 구독의 지연 시간', multiprocess_mode='livemax')
+POLLER_SHARD_SHARE = Gauge('poller_shard_share', '해시 링에서 이 프로세스가 맡은 비율', multiprocess_mode='livesum')
+
+
+class FirestoreCall:
+    """Firestore 호출 시간/문서 수 기록
+
+        with FirestoreCall('load_subscriptions', 'read') as call:
+            docs = list(query.stream())
+            call.documents = len(docs)
+    """
+
+    def __init__(self, operation, kind, documents=1):
+        self.operation = operation
+        self.kind = kind
+        self.documents = documents
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        FIRESTORE_OPERATION_SECONDS.labels(self.operation, self.kind).observe(time.perf_counter() - self._started)
+        if exc_type is not None:
+            FIRESTORE_ERRORS.labels(self.operation, self.kind).inc()
+        elif self.documents:
+            FIRESTORE_DOCUMENTS.labels(self.operation, self.kind).inc(self.documents)
+        return False
+
+
+def collector_registry():
+    """멀티프로세스 모드면 모든 워커 값을 합치는 레지스트리"""
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    """(본문, Content-Type)"""
+    return generate_latest(collector_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    """Flask 없이 실행하는 프로세스(poller.py)용 /metrics HTTP 서버"""
+    start_http_server(port, registry=collector_registry())
+
+
+def mark_process_dead(pid):
+    """종료된 워커의 live* 게이지 값 정리 (gunicorn child_exit에서 호출)"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
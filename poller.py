@@ -0,0 +1,44 @@
+"""배송 상태 폴러 단독 실행
+
+웹 워커는 조회 없이 요청만 처리하고, 조회는 이 프로세스가 맡도록 나눠 실행할 수 있다.
+
+    POLLER_MODE=off gunicorn app:app
+    python poller.py
+
+여러 대에서 띄워도 리스를 가진 하나만 조회하고 (POLLER_LEASE_BACKEND, 기본 firestore),
+POLLER_MODE=sharded로 띄우면 살아 있는 인스턴스끼리 구독을 나눠 조회한다.
+POLLER_METRICS_PORT를 지정하면 그 포트에서 Prometheus 지표를 노출한다.
+"""
+import logging
+import os
+import signal
+import threading
+
+# 웹 워커용 POLLER_MODE=off 설정을 그대로 물려받아도 이 프로세스는 조회하도록 함
+if os.environ.get("POLLER_MODE", "leader").lower() == 'off':
+    os.environ["POLLER_MODE"] = 'leader'
+
+import app  # noqa: E402
+from metrics import start_metrics_server  # noqa: E402
+
+log = logging.getLogger('poller')
+stopped = threading.Event()
+
+
+def stop(signum, frame):
+    log.info(f"🛑 폴러 종료 신호 수신 ({signum})")
+    stopped.set()
+
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    metrics_port = os.environ.get("POLLER_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+        log.info(f"📊 지표 노출 - 포트: {metrics_port}")
+    app.start_runtime(wait=True)  # 모델/구독 로드 후 스케줄러 시작
+    log.info("🚀 폴러 시작")
+    stopped.wait()
+    app.scheduler.shutdown(wait=True)
+    # 리스 반납/알림 전송 마무리는 atexit에서 처리
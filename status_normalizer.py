@@ -0,0 +1,87 @@
+"""배송 상태 이름 정규화 (서버와 벤치마크 스크립트가 함께 사용)
+
+키워드 표의 그룹 순서가 우선순위: 상태 이름에 여러 그룹의 키워드가 들어 있으면 앞 그룹으로 정규화.
+운송사별 키워드 표는 STATUS_KEYWORDS_FILE(JSON)로 지정할 수 있다.
+
+    {"default": {"배송완료": ["배송완료", ...], ...}, "kr.cjlogistics": {...}}
+
+운송사 표가 있으면 그 운송사는 기본 표 대신 운송사 표만 사용한다.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+
+# 🔧 정규화 상태 → 키워드 (위에서부터 우선)
+STATUS_KEYWORDS = {
+    '배송완료': ['배송완료', '배달완료', 'delivered'],
+    '배송출발': ['배송출발', '배달출발', 'out for delivery'],
+    '간선상차': ['간선상차', '캠프상차', '터미널상차', '상차'],
+    '간선하차': ['간선하차', '캠프도착', '터미널하차', '하차'],
+    '집화처리': ['접수', '인수', '소터분류', '운송장출력', '수거', '집하', '수집'],
+    'sm 입고': ['입고', '센터입고'],
+}
+# tracker.delivery 상태 이름은 종류가 많지 않으므로 결과를 캐시
+STATUS_CACHE_SIZE = int(os.environ.get("STATUS_CACHE_SIZE", "4096"))
+
+
+class StatusMatcher:
+    """키워드 표 하나를 정규식 하나로 컴파일
+
+    각 위치에서 시작하는 키워드를 전방 탐색 (?=(…))으로 모두 찾고, 그중 가장 앞 그룹을 선택.
+    같은 위치에서는 대체 패턴 순서(그룹 순)대로 맞춰 보므로 결과가 그룹 순서대로 any(…)를
+    확인하던 방식과 같다.
+    """
+
+    def __init__(self, keywords):
+        self._group_of = {}
+        for priority, (norm_status, group_keywords) in enumerate(keywords.items()):
+            for keyword in group_keywords:
+                self._group_of.setdefault(keyword, (priority, norm_status))
+        ordered = sorted(self._group_of, key=lambda kw: self._group_of[kw][0])
+        self._pattern = re.compile('(?=(%s))' % '|'.join(map(re.escape, ordered))) if ordered else None
+
+    def match(self, status):
+        """정규화 상태, 맞는 키워드가 없으면 None"""
+        if self._pattern is None:
+            return None
+        best = None
+        for found in self._pattern.finditer(status):
+            group = self._group_of[found.group(1)]
+            if best is None or group[0] < best[0]:
+                best = group
+                if group[0] == 0:
+                    break
+        return best[1] if best else None
+
+
+def load_carrier_keywords(path):
+    """STATUS_KEYWORDS_FILE 읽기, {carrier_id 또는 'default': 키워드 표}"""
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as f:
+        tables = json.load(f)
+    for carrier_id, table in tables.items():
+        if not isinstance(table, dict) or not all(isinstance(v, list) for v in table.values()):
+            raise ValueError(f"잘못된 상태 키워드 표: {carrier_id}")
+    return tables
+
+
+_carrier_tables = load_carrier_keywords(os.environ.get("STATUS_KEYWORDS_FILE"))
+_default_matcher = StatusMatcher(_carrier_tables.get('default', STATUS_KEYWORDS))
+_carrier_matchers = {
+    carrier_id: StatusMatcher(table) for carrier_id, table in _carrier_tables.items() if carrier_id != 'default'
+}
+
+
+@lru_cache(maxsize=STATUS_CACHE_SIZE)
+def _normalize(status, carrier_key):
+    status = status.lower().strip()
+    matcher = _carrier_matchers.get(carrier_key, _default_matcher)
+    return matcher.match(status) or status
+
+
+def normalize_status(status, carrier_id=None):
+    """상태 이름을 정규화 상태로 변환, 맞는 키워드가 없으면 소문자/공백 제거한 원본"""
+    # 표가 없는 운송사는 캐시 키를 하나로 묶어 같은 상태 이름을 공유
+    return _normalize(status, carrier_id if carrier_id in _carrier_matchers else None)
@@ -0,0 +1,348 @@
+"""배송 소요시간 예측 모델 재학습 CLI
+
+/save_delivery로 쌓인 배송완료 데이터(data/deliveries/*.jsonl)를 읽어
+운송사별 (상태 이름, 이벤트 시각/요일, 상태 체류시간 → 도착까지 남은 분) 학습 데이터를 만들고,
+운송사별 모델과 특성 테이블을 병렬로 학습/평가해 서버가 읽는 pkl 파일로 내보낸다.
+
+    python train_models.py                # 새로 쌓인 배송만 반영해 재학습
+    python train_models.py --full         # 처음부터 다시 만들기
+    python train_models.py --install      # 기존 모델보다 나은 경우 MODEL_DIR에 설치
+
+이전 실행에서 읽은 위치(세그먼트, 오프셋)와 운송사별 학습 데이터는 --work-dir에 보관되어,
+다음 실행에서는 새 배송만 읽고 데이터가 늘어난 운송사만 다시 학습한다.
+(학습 중 실패하거나 종료된 운송사는 state.json의 pending에 남아 다음 실행에서 다시 학습)
+"""
+import argparse
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+
+from eta_model import (
+    MODEL_FILES, build_feature_table, compile_eta_table, dwell_buckets, load_model_manifest, model_files_version,
+    save_model_manifest, to_event_time
+)
+
+# 누적 학습 데이터 형식, 바뀌면 처음부터 다시 읽음
+DATASET_VERSION = 2
+DATASET_COLUMNS = ('names', 'minutes', 'hours', 'weekdays', 'gaps')
+
+
+def carrier_key(carrier_id):
+    return carrier_id if carrier_id in MODEL_FILES else 'default'
+
+
+def iter_events(record):
+    """배송 한 건의 이벤트 목록 (tracker.delivery 응답 형태 몇 가지를 모두 지원)"""
+    events = record.get('events') or record.get('progresses') or []
+    if isinstance(events, dict):
+        events = [edge.get('node', {}) for edge in events.get('edges', [])]
+    for event in events:
+        status = event.get('status') or {}
+        name = status.get('name') if isinstance(status, dict) else status
+        if name and event.get('time'):
+            yield name.strip(), event['time']
+
+
+def extract_rows(record):
+    """(상태 이름, 도착까지 남은 분, 시각, 요일(한국 시간 기준), 다음 이벤트까지 걸린 분) 목록
+
+    도착 시각은 lastEvent(배송완료) 시각
+    """
+    try:
+        arrival = to_event_time(datetime.fromisoformat(record['lastEvent']['time']))
+    except (KeyError, TypeError, ValueError):
+        return []
+    events = []
+    for name, time_str in iter_events(record):
+        try:
+            event_time = to_event_time(datetime.fromisoformat(time_str))
+            minutes = (arrival - event_time).total_seconds() / 60
+        except (TypeError, ValueError):
+            continue
+        if minutes >= 0:
+            events.append((minutes, name, event_time))
+
+    # 오래된 이벤트부터, 다음 이벤트(없으면 배송완료)까지가 그 상태에 머문 시간
+    events.sort(key=lambda e: -e[0])
+    rows = []
+    for i, (minutes, name, event_time) in enumerate(events):
+        next_minutes = events[i + 1][0] if i + 1 < len(events) else 0.0
+        rows.append((name, minutes, event_time.hour, event_time.weekday(), minutes - next_minutes))
+    return rows
+
+
+def read_new_deliveries(segment_dir, cursor):
+    """cursor(세그먼트, 오프셋) 이후에 추가된 배송을 순서대로 읽음, (행 목록, 새 cursor) 반환"""
+    rows = {}
+    segments = sorted(f for f in os.listdir(segment_dir) if f.endswith('.jsonl')) if os.path.isdir(segment_dir) else []
+    cursor_segment, cursor_offset = cursor or (None, 0)
+    delivered = 0
+    for segment in segments:
+        if cursor_segment and segment < cursor_segment:
+            continue
+        offset = cursor_offset if segment == cursor_segment else 0
+        with open(os.path.join(segment_dir, segment), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # 아직 쓰는 중인 마지막 줄은 다음 실행에서 읽음
+                offset += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                delivered += 1
+                rows.setdefault(carrier_key(record.get('carrier_id')), []).extend(extract_rows(record))
+        cursor_segment, cursor_offset = segment, offset
+    print(f"📥 새 배송 {delivered}건 읽음")
+    return rows, (cursor_segment, cursor_offset) if cursor_segment else cursor
+
+
+def rows_to_dataset(rows):
+    names, minutes, hours, weekdays, gaps = zip(*rows) if rows else ((),) * 5
+    return {
+        'names': np.array(names, dtype=str),
+        'minutes': np.array(minutes, dtype=np.float64),
+        'hours': np.array(hours, dtype=np.int64),
+        'weekdays': np.array(weekdays, dtype=np.int64),
+        'gaps': np.array(gaps, dtype=np.float64),
+    }
+
+
+def load_dataset(work_dir, key):
+    path = os.path.join(work_dir, f'dataset_{key}.npz')
+    if not os.path.exists(path):
+        return rows_to_dataset([])
+    with np.load(path) as data:
+        return {column: data[column] for column in DATASET_COLUMNS}
+
+
+def save_dataset(work_dir, key, dataset):
+    path = os.path.join(work_dir, f'dataset_{key}.npz')
+    tmp_path = os.path.join(work_dir, f'.dataset_{key}.npz.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **dataset)
+    os.replace(tmp_path, path)
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state_path, state):
+    """임시 파일에 쓴 뒤 교체 (중간에 죽어도 이전/새 내용 중 하나만 남음)"""
+    tmp_path = f'{state_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+
+def load_pickle(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def build_model(kind):
+    if kind == 'linear':
+        return LinearRegression()
+    return RandomForestRegressor(n_estimators=100, min_samples_leaf=5, n_jobs=1, random_state=0)
+
+
+def encode(names, status_map):
+    return np.array([status_map.get(name, -1) for name in names]).reshape(-1, 1)
+
+
+def fit_carrier(dataset, status_map, kind):
+    """상태 코드 모델 + 특성 테이블 학습"""
+    codes = encode(dataset['names'], status_map)
+    model = build_model(kind)
+    model.fit(codes, dataset['minutes'])
+    features = build_feature_table(
+        codes.ravel(), dataset['hours'], dataset['weekdays'], dataset['gaps'], dataset['minutes'],
+        compile_eta_table(model, status_map)
+    )
+    return model, features
+
+
+def train_carrier(key, dataset, current_model, current_map, kind, holdout):
+    """운송사 하나 학습/평가 (프로세스 풀에서 실행)
+
+    평가는 상태 이벤트 시점(체류시간 0) 기준 MAE:
+    mae는 특성 테이블, status_only_mae는 새 상태 코드 모델, current_mae는 설치된 모델
+    """
+    names = dataset['names']
+    # 기존 코드는 유지하고 처음 보는 상태 이름에만 새 코드를 붙임
+    status_map = dict(current_map or {})
+    next_code = max(status_map.values(), default=-1) + 1
+    for name in dict.fromkeys(names.tolist()):
+        if name not in status_map:
+            status_map[name] = next_code
+            next_code += 1
+
+    # 쌓인 순서 기준 마지막 holdout 비율을 평가용으로 사용
+    split = int(len(names) * (1 - holdout))
+    train = {column: values[:split] for column, values in dataset.items()}
+    test = {column: values[split:] for column, values in dataset.items()}
+    model, features = fit_carrier(train, status_map, kind)
+
+    result = {'carrier': key, 'rows': int(len(names)), 'eval_rows': int(len(test['names']))}
+    if len(test['names']):
+        codes = encode(test['names'], status_map).ravel() + 1
+        feature_pred = features['minutes'][codes, test['hours'], test['weekdays'], dwell_buckets(0.0)]
+        result['mae'] = float(np.mean(np.abs(feature_pred - test['minutes'])))
+        status_pred = model.predict(encode(test['names'], status_map))
+        result['status_only_mae'] = float(np.mean(np.abs(status_pred - test['minutes'])))
+        if current_model is not None and current_map is not None:
+            current_pred = current_model.predict(encode(test['names'], current_map))
+            result['current_mae'] = float(np.mean(np.abs(current_pred - test['minutes'])))
+
+    # 평가 후에는 전체 데이터로 다시 학습
+    model, features = fit_carrier(dataset, status_map, kind)
+    return result, model, status_map, features
+
+
+def install_carrier(key, out_dir, model_dir):
+    """out_dir의 운송사 결과물을 model_dir에 설치
+
+    서버 레지스트리는 파일 내용 버전이 설치 기록(model_manifest.json)과 같을 때만 다시 로드하므로,
+    새 버전을 먼저 기록한 뒤 파일을 하나씩 교체한다. 교체 도중(또는 중간에 실패해)
+    새 매핑 + 예전 모델처럼 섞인 조합은 로드되지 않고 이전 모델이 계속 쓰인다.
+    """
+    model_file, mapping_file, features_file = MODEL_FILES[key]
+    contents = {}
+    for filename in (model_file, mapping_file, features_file):
+        with open(os.path.join(out_dir, filename), 'rb') as f:
+            contents[filename] = f.read()
+
+    manifest = load_model_manifest(model_dir)
+    manifest[key] = {
+        'version': model_files_version(contents[model_file], contents[mapping_file], contents[features_file]),
+        'installed_at': datetime.now().isoformat(),
+    }
+    save_model_manifest(model_dir, manifest)
+    for filename, data in contents.items():
+        tmp_path = os.path.join(model_dir, f'.{filename}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(model_dir, filename))
+    return manifest[key]['version']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='배송 소요시간 예측 모델 재학습')
+    parser.add_argument('--data-dir', default=os.environ.get('DELIVERY_DATA_DIR', 'data'))
+    parser.add_argument('--model-dir', default=os.environ.get('MODEL_DIR', '') or '.')
+    parser.add_argument('--out-dir', default='models', help='버전별 결과물 저장 위치')
+    parser.add_argument('--work-dir', default='training', help='읽은 위치/누적 학습 데이터 보관 위치')
+    parser.add_argument('--model', choices=['forest', 'linear'], default='forest')
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--min-rows', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--full', action='store_true', help='누적 데이터를 버리고 처음부터 다시 읽기')
+    parser.add_argument('--install', action='store_true', help='기존 모델보다 MAE가 낮으면 model-dir에 설치')
+    parser.add_argument('--force', action='store_true', help='--install 시 성능 비교 없이 설치')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    state_path = os.path.join(args.work_dir, 'state.json')
+    state = {} if args.full else load_state(state_path)
+    if state.get('dataset_version') != DATASET_VERSION:
+        if state:
+            print("ℹ️ 학습 데이터 형식이 바뀌어 처음부터 다시 읽습니다.")
+        state = {}
+        args.full = True
+    if args.full:
+        for key in MODEL_FILES:
+            path = os.path.join(args.work_dir, f'dataset_{key}.npz')
+            if os.path.exists(path):
+                os.remove(path)
+
+    new_rows, cursor = read_new_deliveries(os.path.join(args.data_dir, 'deliveries'), state.get('cursor'))
+
+    # 새 데이터가 생긴 운송사만 학습 데이터에 추가하고 재학습 대기(pending)로 표시
+    pending = set(state.get('pending', ()))
+    datasets = {}
+    for key, rows in new_rows.items():
+        dataset = load_dataset(args.work_dir, key)
+        if rows:
+            added = rows_to_dataset(rows)
+            dataset = {column: np.concatenate([dataset[column], added[column]]) for column in DATASET_COLUMNS}
+            save_dataset(args.work_dir, key, dataset)
+            pending.add(key)
+        datasets[key] = dataset
+
+    # 학습 데이터를 저장한 직후 읽은 위치도 저장: 학습 중 실패/종료되어도 다음 실행에서 같은 배송을
+    # 다시 추가하지 않고, 아직 학습하지 못한 운송사(pending)만 다시 학습
+    state['cursor'] = cursor
+    state['dataset_version'] = DATASET_VERSION
+    state['pending'] = sorted(pending)
+    save_state(state_path, state)
+
+    jobs = {}
+    for key in sorted(pending):
+        dataset = datasets[key] if key in datasets else load_dataset(args.work_dir, key)
+        if len(dataset['names']) >= args.min_rows:
+            jobs[key] = dataset
+        else:
+            pending.discard(key)  # 데이터가 더 쌓이면 다시 표시됨
+            print(f"⏭️ [{key}] 학습 데이터 부족 ({len(dataset['names'])}/{args.min_rows}), 건너뜀")
+
+    version = datetime.now().strftime('%Y%m%d_%H%M%S')
+    out_dir = os.path.join(args.out_dir, version)
+    report = {'version': version, 'cursor': cursor, 'carriers': []}
+
+    if jobs:
+        os.makedirs(out_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=min(args.workers or 1, len(jobs))) as executor:
+            futures = {}
+            for key, dataset in jobs.items():
+                model_file, mapping_file, _ = MODEL_FILES[key]
+                current_model = load_pickle(os.path.join(args.model_dir, model_file))
+                current_map = load_pickle(os.path.join(args.model_dir, mapping_file))
+                futures[key] = executor.submit(
+                    train_carrier, key, dataset, current_model, current_map, args.model, args.holdout
+                )
+
+            for key, future in futures.items():
+                result, model, status_map, features = future.result()
+                model_file, mapping_file, features_file = MODEL_FILES[key]
+                for filename, obj in ((model_file, model), (mapping_file, status_map), (features_file, features)):
+                    with open(os.path.join(out_dir, filename), 'wb') as f:
+                        pickle.dump(obj, f)
+
+                improved = 'current_mae' not in result or result.get('mae', float('inf')) <= result['current_mae']
+                result['installed'] = False
+                if args.install and (improved or args.force):
+                    # 서버 레지스트리가 파일 변경을 감지해 다시 로드함
+                    result['model_version'] = install_carrier(key, out_dir, args.model_dir)
+                    result['installed'] = True
+                report['carriers'].append(result)
+                pending.discard(key)
+                print(f"🧠 [{key}] 학습 완료 rows={result['rows']} mae={result.get('mae')} "
+                      f"status_only_mae={result.get('status_only_mae')} current_mae={result.get('current_mae')} "
+                      f"installed={result['installed']}")
+
+        with open(os.path.join(out_dir, 'metrics.json'), 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📦 결과물 저장 완료: {out_dir}")
+    else:
+        print("ℹ️ 재학습할 운송사가 없습니다.")
+
+    state['pending'] = sorted(pending)
+    state['last_version'] = version if jobs else state.get('last_version')
+    save_state(state_path, state)
+
+
+if __name__ == '__main__':
+    main()